@@ -0,0 +1,22 @@
+# app/core/etag.py
+from typing import Optional
+
+from fastapi import Response, status
+
+# builds a strong entity tag from values that together identify one representation
+def make_strong_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+# If-None-Match uses the weak comparison, so W/ prefixes are ignored and "*" matches any current representation
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+
+    return etag.removeprefix("W/") in [candidate.removeprefix("W/") for candidate in candidates]
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
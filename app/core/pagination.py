@@ -0,0 +1,117 @@
+# app/core/pagination.py
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from typing import Any, Literal, Optional
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import Select, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.settings import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_COUNT_MODE_HEADER = "X-Total-Count-Mode"
+
+CountMode = Literal["none", "exact", "estimated"]
+
+# encodes the sort key of the last row of a page into an opaque cursor
+def encode_cursor(sort: str, values: list[Any]) -> str:
+    payload = {
+        "sort": sort,
+        "values": [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values],
+    }
+    encoded = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return encoded.decode("ascii").rstrip("=")
+
+# decodes a cursor back into sort key values typed like the given columns
+def decode_cursor(cursor: str, sort: str, columns: list) -> list[Any]:
+    invalid_cursor_exception = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    try:
+        padded_cursor = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded_cursor.encode("ascii")))
+        raw_values = payload["values"]
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise invalid_cursor_exception
+
+    # A cursor only continues the sort order it was issued for
+    if payload.get("sort") != sort or not isinstance(raw_values, list) or len(raw_values) != len(columns):
+        raise invalid_cursor_exception
+
+    values = []
+    try:
+        for column, value in zip(columns, raw_values):
+            python_type = column.type.python_type
+            if value is not None and python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif value is not None and python_type is date:
+                value = date.fromisoformat(value)
+            values.append(value)
+    except (ValueError, TypeError):
+        raise invalid_cursor_exception
+
+    return values
+
+# orders a query by the sort key columns and continues after the cursor; one extra row is fetched to detect a next page
+def paginate_by_keyset(query: Select, columns: list, descending: bool, sort: str, cursor: Optional[str], limit: int) -> Select:
+    if cursor:
+        values = decode_cursor(cursor, sort, columns)
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    order_by = [column.desc() if descending else column.asc() for column in columns]
+    return query.order_by(*order_by).limit(limit + 1)
+
+# splits the fetched rows into the page and the cursor of the next page (None on the last page)
+def get_page(rows: list, columns: list, sort: str, limit: int) -> tuple[list, Optional[str]]:
+    if len(rows) <= limit:
+        return list(rows), None
+
+    page = list(rows[:limit])
+    last_row = page[-1]
+    return page, encode_cursor(sort, [getattr(last_row, column.key) for column in columns])
+
+# exposes the next page cursor to the client
+def set_next_cursor_header(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+# counts the rows matched by a query (without its ordering and limit)
+async def count_rows(db: AsyncSession, query: Select) -> int:
+    count_query = select(func.count()).select_from(query.order_by(None).limit(None).subquery())
+    return (await db.execute(count_query)).scalar_one()
+
+# reads the planner's row estimate for a query; only PostgreSQL exposes one, so other databases return None
+async def estimate_rows(db: AsyncSession, query: Select) -> Optional[int]:
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return None
+
+    compiled_query = query.order_by(None).limit(None).compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+    plan = (await db.execute(text(f"EXPLAIN (FORMAT JSON) {compiled_query}"))).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+# returns the total row count and how it was obtained; estimates below the threshold are replaced by an exact count
+async def get_total_count(db: AsyncSession, query: Select, mode: CountMode) -> tuple[Optional[int], CountMode]:
+    if mode == "none":
+        return None, mode
+
+    if mode == "estimated":
+        estimate = await estimate_rows(db, query)
+        if estimate is not None and estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+            return estimate, mode
+
+    return await count_rows(db, query), "exact"
+
+# exposes the total count of a listing to the client
+def set_total_count_headers(response: Response, total_count: Optional[int], mode: CountMode):
+    if total_count is not None:
+        response.headers[TOTAL_COUNT_HEADER] = str(total_count)
+        response.headers[TOTAL_COUNT_MODE_HEADER] = mode
@@ -0,0 +1,108 @@
+# app/core/quota.py
+from datetime import date, timedelta
+from typing import Optional
+
+
+class RetrievalCounter:
+    '''
+    Retrieval count of one user in the current period, with the increments not yet written to the database
+    and the increments taken by a flush that has not committed yet
+    '''
+
+    __slots__ = ("count", "period_start", "pending", "flushing")
+
+    def __init__(self, count: int, period_start: date, pending: int = 0):
+        self.count = count
+        self.period_start = period_start
+        self.pending = pending
+        self.flushing = 0
+
+
+class InMemoryRetrievalCounterStore:
+    '''
+    Per-worker retrieval counters; the in-process stand-in for a shared counter store.
+    A shared store (e.g. Redis) can replace it by implementing the same async methods.
+    '''
+
+    def __init__(self):
+        self._counters: dict[int, RetrievalCounter] = {}
+        self._pending_total = 0
+
+    async def is_loaded(self, user_id: int) -> bool:
+        return user_id in self._counters
+
+    # seeds a user's counter from the database row
+    async def load(self, user_id: int, count: int, period_start: Optional[date]):
+        if user_id not in self._counters:
+            self._counters[user_id] = RetrievalCounter(count, period_start or date.min)
+
+    # starts a new period if the current one expired, then counts one retrieval unless the limit is reached
+    async def try_increment(self, user_id: int, limit: int, today: date, period_days: int) -> Optional[int]:
+        counter = self._counters[user_id]
+
+        if counter.period_start < today - timedelta(days=period_days):
+            counter.count = 0
+            counter.period_start = today
+
+        if counter.count >= limit:
+            return None
+
+        counter.count += 1
+        counter.pending += 1
+        self._pending_total += 1
+        return counter.count
+
+    # takes back a retrieval that was counted but not served
+    async def decrement(self, user_id: int):
+        counter = self._counters.get(user_id)
+        if counter is not None and counter.pending > 0:
+            counter.count -= 1
+            counter.pending -= 1
+            self._pending_total -= 1
+
+    async def pending_total(self) -> int:
+        return self._pending_total
+
+    # hands out the pending increments as (user_id, pending, period_start) and marks them as being flushed
+    async def take_pending(self) -> list[tuple[int, int, date]]:
+        pending = [
+            (user_id, counter.pending, counter.period_start)
+            for user_id, counter in self._counters.items()
+            if counter.pending > 0
+        ]
+
+        for user_id, increments, _ in pending:
+            counter = self._counters[user_id]
+            counter.flushing += increments
+            counter.pending = 0
+        self._pending_total = 0
+
+        return pending
+
+    # puts increments back after a failed flush so that the next flush writes them
+    async def restore_pending(self, pending: list[tuple[int, int, date]]):
+        for user_id, increments, _ in pending:
+            counter = self._counters.get(user_id)
+            if counter is not None:
+                counter.flushing -= increments
+                counter.pending += increments
+                self._pending_total += increments
+
+    # records that a flush committed its increments, and drops the counters it flushed that have nothing left to write
+    # (neither pending nor taken by another flush), so they are reloaded from the committed counts when next used
+    async def discard_flushed(self, flushed: list[tuple[int, int, date]]):
+        for user_id, increments, _ in flushed:
+            counter = self._counters.get(user_id)
+            if counter is None:
+                continue
+
+            counter.flushing -= increments
+            if counter.pending == 0 and counter.flushing == 0:
+                del self._counters[user_id]
+
+    async def clear(self):
+        self._counters.clear()
+        self._pending_total = 0
+
+    def __len__(self) -> int:
+        return len(self._counters)
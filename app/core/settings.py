@@ -1,23 +1,109 @@
 # app/core/settings.py
+from typing import Literal
+
+from pydantic import field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     DATABASE_URL: str
 
+    # Connection pool configuration
+    DB_USE_NULL_POOL: bool = False # Set to true when an external pooler (e.g. PgBouncer) already pools connections
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+
+    # Prepared statement caching: "direct" when connected straight to Postgres,
+    # "pgbouncer" behind a pooler that supports prepared statements (PgBouncer >= 1.21 / Supavisor),
+    # "disabled" to parse and plan every query (safe for any pooler)
+    DB_STATEMENT_CACHE_MODE: Literal["direct", "pgbouncer", "disabled"] = "disabled"
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
     FILE_STORAGE_URL : str
     FILE_STORAGE_ACCESS_KEY_ID : str
     FILE_STORAGE_SECRET_ACCESS_KEY : str
     FILE_STORAGE_REGION : str
 
+    # Shared storage client configuration
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_CONNECT_TIMEOUT_SECONDS: float = 10.0
+    S3_READ_TIMEOUT_SECONDS: float = 60.0
+    S3_KEEPALIVE_TIMEOUT_SECONDS: float = 30.0 # Idle time before a pooled connection is closed
+    S3_MAX_ATTEMPTS: int = 2
+
+    # Uploads are read in parts of this size; larger files are sent with S3 multipart upload
+    STORAGE_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024 # S3 requires at least 5 MiB per part
+    STORAGE_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024
+    UPLOAD_CONCURRENCY: int = 4 # Max files of one request uploaded at once
+    # Codec uploaded dotfiles are compressed with at rest; zstd requires the zstandard package and proxy downloads
+    STORAGE_COMPRESSION: Literal["none", "gzip", "zstd"] = "none"
+    STORAGE_COMPRESSION_LEVEL: int = 6
+
+    ARCHIVE_FETCH_CONCURRENCY: int = 8 # Max storage objects fetched at once while building an archive
+
+    # Built archive cache, keyed by collection id and version
+    ARCHIVE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024 # In-memory tier size per worker process
+    ARCHIVE_CACHE_MAX_ENTRY_BYTES: int = 8 * 1024 * 1024 # Larger archives are streamed but not cached
+    ARCHIVE_CACHE_S3_ENABLED: bool = False # Also keep built archives in the storage bucket, shared by all workers
+
+    # Downloads: "proxy" streams content through the API worker, "presigned" redirects to a short-lived storage URL
+    DOWNLOAD_MODE: Literal["proxy", "presigned"] = "proxy"
+    PRESIGNED_URL_EXPIRES_SECONDS: int = 300
+
     ACCESS_TOKEN_EXPIRE_HOURS: int
     SECRET_KEY: str
     ALGORITHM: str
 
+    # Authenticated user cache (per worker process); TTL bounds staleness across workers
+    USER_CACHE_MAX_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: int = 60
+
+    # Free-tier retrieval quota engine: "database" counts each retrieval with one UPDATE on the user row,
+    # "memory" counts in worker memory and writes aggregated increments behind. Each worker enforces the limit on its own
+    # counts, so "memory" only enforces the limit with a single worker process; N workers would allow up to N times the limit
+    QUOTA_ENGINE: Literal["database", "memory"] = "database"
+    WEB_CONCURRENCY: int = 1 # Worker processes; uvicorn and gunicorn default their worker count to it
+    QUOTA_FLUSH_INTERVAL_SECONDS: float = 5.0
+    QUOTA_FLUSH_MAX_PENDING: int = 1000 # Also flush once this many increments are pending
+
+    # Page size of paginated listings
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 100
+    # Estimated total counts below this are replaced by an exact COUNT(*)
+    COUNT_ESTIMATE_THRESHOLD: int = 10000
+
     FREE_TIER_RETRIEVAL_LIMIT: int
     RETRIEVAL_PERIOD_DAYS: int
 
     model_config = SettingsConfigDict(env_file=".env") # Load settings from .env file
+
+    # Fail at startup rather than on the first upload when the zstd codec cannot be used
+    @field_validator("STORAGE_COMPRESSION")
+    @classmethod
+    def check_storage_compression_available(cls, codec: str) -> str:
+        if codec == "zstd":
+            try:
+                import zstandard # noqa: F401
+            except ImportError as exc:
+                raise ValueError("STORAGE_COMPRESSION=zstd requires the zstandard package") from exc
+        return codec
+
+    # Fail at startup rather than letting every worker grant a free user the whole limit
+    @model_validator(mode="after")
+    def check_quota_engine_workers(self) -> "Settings":
+        if self.QUOTA_ENGINE == "memory" and self.WEB_CONCURRENCY > 1:
+            raise ValueError("QUOTA_ENGINE=memory only enforces the retrieval limit with a single worker; set WEB_CONCURRENCY=1 or use the database engine")
+        return self
+
+    # Presigned downloads are served with the stored Content-Encoding, which most HTTP clients only decode for gzip
+    @model_validator(mode="after")
+    def check_presigned_downloads_decodable(self) -> "Settings":
+        if self.STORAGE_COMPRESSION == "zstd" and self.DOWNLOAD_MODE == "presigned":
+            raise ValueError("STORAGE_COMPRESSION=zstd cannot be used with DOWNLOAD_MODE=presigned; use gzip or proxy downloads")
+        return self
     
 
 settings = Settings()
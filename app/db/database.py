@@ -7,15 +7,53 @@ from sqlalchemy.pool import NullPool
 
 from app.core.settings import settings
 
-# Create the async engine
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    poolclass=NullPool,
-    connect_args={
+# builds the pooling options for the engine from settings
+def get_engine_pool_options() -> dict:
+    # An external pooler already holds the server connections, so don't pool them twice
+    if settings.DB_USE_NULL_POOL:
+        return {"poolclass": NullPool}
+
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+    }
+
+# builds the asyncpg connect args for the configured prepared statement cache mode
+def get_engine_connect_args(mode: str | None = None) -> dict:
+    mode = mode or settings.DB_STATEMENT_CACHE_MODE
+    cache_size = settings.DB_STATEMENT_CACHE_SIZE
+
+    if mode == "direct":
+        # Statements are prepared once per connection and reused on every execution
+        return {
+            "statement_cache_size": cache_size,
+            "prepared_statement_cache_size": cache_size,
+        }
+
+    if mode == "pgbouncer":
+        # Statements are still cached per connection, but get globally unique names so that
+        # clients sharing a server connection through the pooler never collide
+        return {
+            "statement_cache_size": cache_size,
+            "prepared_statement_cache_size": cache_size,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+
+    # Caching disabled: every query is parsed and planned again
+    return {
         "statement_cache_size": 0,
         "prepared_statement_cache_size": 0,
         "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
-    },
+    }
+
+# Create the async engine
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    **get_engine_pool_options(),
+    connect_args=get_engine_connect_args(),
 )
 AsyncSessionLocal = async_sessionmaker(
     engine, 
@@ -28,4 +66,4 @@ Base = declarative_base()
 
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
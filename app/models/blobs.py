@@ -0,0 +1,12 @@
+# app/models/blobs.py
+from sqlalchemy import BigInteger, Column, Integer, String, TIMESTAMP, func
+from app.db.database import Base
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True) # Content hash; the object is stored under a key derived from it
+    size = Column(BigInteger, nullable=False)
+    etag = Column(String(255), nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0") # Number of dotfiles referencing the content
+    created_at = Column(TIMESTAMP, server_default=func.now())
@@ -1,14 +1,26 @@
 # app/models/collections.py
-from sqlalchemy import Boolean, ForeignKey, Text, Column, Integer, String, TIMESTAMP, func
+from sqlalchemy import Boolean, ForeignKey, Index, Text, Column, Integer, String, TIMESTAMP, func, text
 from app.db.database import Base
 
 class Collection(Base):
     __tablename__ = "collections"
+    __table_args__ = (
+        # Keyset pagination sort orders of the owned collections listing
+        Index("ix_collections_owner_id_id", "owner_id", "id"),
+        Index("ix_collections_owner_id_updated_at_id", "owner_id", "updated_at", "id"),
+        Index("ix_collections_owner_id_name_id", "owner_id", "name", "id"),
+        # Keyset pagination sort orders of the public collections listing; each predicate matches how the dialect
+        # renders not_(Collection.is_private), since a partial index is only used when the query implies its predicate
+        Index("ix_collections_public_id", "id", postgresql_where=text("NOT is_private"), sqlite_where=text("is_private = 0")),
+        Index("ix_collections_public_updated_at_id", "updated_at", "id", postgresql_where=text("NOT is_private"), sqlite_where=text("is_private = 0")),
+        Index("ix_collections_public_name_id", "name", "id", postgresql_where=text("NOT is_private"), sqlite_where=text("is_private = 0")),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False)
     description = Column(Text)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     is_private = Column(Boolean, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1") # Bumped whenever the collection's files change
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now())
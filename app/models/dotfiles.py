@@ -1,15 +1,23 @@
 # app/models/dotfiles.py
-from sqlalchemy import ForeignKey, Text, Column, Integer, String, UniqueConstraint
+from sqlalchemy import BigInteger, ForeignKey, Index, Text, Column, Integer, String, UniqueConstraint
 from app.db.database import Base
 
 class Dotfile(Base):
     __tablename__ = "dotfiles"
     __table_args__ = (
         UniqueConstraint("collection_id", "path", name="dotfiles_collection_id_path_key"),
+        # Single file lookups and deletions filter by filename within a collection
+        Index("ix_dotfiles_collection_id_filename", "collection_id", "filename"),
     )
     
     id = Column(Integer, primary_key=True)
     collection_id = Column(Integer, ForeignKey("collections.id"), nullable=False)
     path = Column(String(255), nullable=False) # Can change string length later
     filename = Column(String(255), nullable=False)
+    # Recorded at upload time; null for dotfiles uploaded before these columns existed
+    sha256 = Column(String(64), nullable=True)
+    size = Column(BigInteger, nullable=True)
+    etag = Column(String(255), nullable=True) # ETag of the stored object
+    # Content-addressed blob holding the content; null for dotfiles stored under their collection and filename
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)
                 
\ No newline at end of file
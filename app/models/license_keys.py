@@ -1,14 +1,19 @@
-from sqlalchemy import (Column, Integer, String, Boolean,DateTime, ForeignKey, func)
+from sqlalchemy import (Column, Integer, String, Boolean,DateTime, ForeignKey, Index, func)
 from sqlalchemy import sql
 from app.db.database import Base
 
 class LicenseKey(Base):
     __tablename__ = "license_keys"
+    __table_args__ = (
+        # Serve the filtered admin listing, which pages in id order
+        Index("ix_license_keys_is_used_id", "is_used", "id"),
+        Index("ix_license_keys_created_at_id", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     key_string = Column(String(255), unique=True, nullable=False, index=True)
     is_used = Column(Boolean, nullable=False, server_default=sql.false())
 
-    activated_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    activated_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     
     activated_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -1,9 +1,13 @@
 # app/models/users.py
-from sqlalchemy import Column, Date, Integer, String, TIMESTAMP, func
+from sqlalchemy import Column, Date, Index, Integer, String, TIMESTAMP, func
 from app.db.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Serves the tier-filtered user listing in id order
+        Index("ix_users_account_tier_id", "account_tier", "id"),
+    )
     
     id = Column(Integer, primary_key=True) # Can change to uuid later
     username = Column(String(50), unique=True, nullable=False, index=True)
@@ -1,24 +1,43 @@
 # # app/routers/admin_key.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.pagination import CountMode, set_next_cursor_header, set_total_count_headers
+from app.core.settings import settings
 from app.db.database import get_db
 from app.schemas.users import UserPromote
-from app.services.license_key_service import create_keys, get_all_license_key, get_license_key_by_id
+from app.services.license_key_service import create_keys, get_license_keys, get_license_key_by_id
 from app.schemas.license_key import KeyGenerationRequest, KeyGenerationResponse
-from app.services.user_service import get_user_by_id
+from app.services.user_service import get_user_by_id, invalidate_cached_user
 from app.schemas.license_key import LicenseKeyOutput
 
 router = APIRouter()
 
 @router.get("/license", response_model=list[LicenseKeyOutput], status_code=status.HTTP_200_OK)
-async def list_license_keys(db: AsyncSession = Depends(get_db)):
+async def list_license_keys(
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)] = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    used: Optional[bool] = None,
+    activated_by_user_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    count: CountMode = "none",
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Retrieve all license keys.
+    Retrieve a page of license keys, optionally filtered by usage, activating user and creation time.
     """
-    db_license_keys = await get_all_license_key(db)
+    license_keys, next_cursor, total_count, count_mode = await get_license_keys(
+        db, limit, cursor, used, activated_by_user_id, created_after, created_before, count
+    )
+    set_next_cursor_header(response, next_cursor)
+    set_total_count_headers(response, total_count, count_mode)
 
-    return db_license_keys
+    return license_keys
 
 @router.post("/license", response_model=KeyGenerationResponse, status_code=status.HTTP_201_CREATED)
 async def create_license_keys(request: KeyGenerationRequest, db: AsyncSession = Depends(get_db)):
@@ -77,6 +96,9 @@ async def promote_user(
             status_code=500,
             detail=f"Failed to update user tier: {str(e)}"
         )
+
+    # Drop the cached snapshot so the new tier applies to the user's next request
+    invalidate_cached_user(user_id)
     
     # Return response immediately (no refresh needed since we use extracted values)
     return {
@@ -1,34 +1,61 @@
 # app/routers/collections.py
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, status, File, Form
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, UploadFile, status, File, Form
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import ValidationError
 
 from aiobotocore.session import ClientCreatorContext as S3Client
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.etag import etag_matches, not_modified_response
+from app.core.pagination import set_next_cursor_header
 from app.core.settings import settings
 from app.db.database import get_db
+from app.models.collections import Collection
 from app.s3.s3_bucket import get_s3_client
 
-from app.schemas.collections import CollectionCreate, CollectionContentRead, CollectionContentAdd, CollectionOutput
-from app.schemas.dotfiles import DotfileOutput
-from app.services import collection_service, dotfile_service
+from app.schemas.collections import CollectionCreate, CollectionContentRead, CollectionContentAdd, CollectionContentPreflight, CollectionOutput, CollectionSort, CollectionSyncDotfileOutput, CollectionSyncOutput, CollectionSyncRequest
+from app.schemas.dotfiles import DotfileOutput, DotfilePreflight
+from app.services import collection_service, dotfile_service, file_storage_service, quota_service
 from app.services.auth_service import get_current_user
-from app.services.license_key_service import refresh_retrieval_period
 
 router = APIRouter()
-FREE_TIER_RETRIEVAL_LIMIT = settings.FREE_TIER_RETRIEVAL_LIMIT
 
 @router.get("/public", response_model=list[CollectionOutput])
-async def get_public_collections(db: AsyncSession = Depends(get_db)):
-    '''Retrieves all public collections'''
-    return await collection_service.get_public_collections(db)
+async def get_public_collections(
+    response: Response,
+    sort: CollectionSort = "oldest",
+    limit: Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)] = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    '''
+    Retrieves a page of public collections.
+    Pass the X-Next-Cursor response header back as 'cursor' (with the same 'sort') to get the next page
+    '''
+    collections, next_cursor = await collection_service.get_public_collections(db, sort, limit, cursor)
+    set_next_cursor_header(response, next_cursor)
+
+    return collections
 
 @router.get("/owned", response_model=list[CollectionOutput])
-async def get_my_collections(db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
-    '''Retrieves all collections owned by the current user'''
-    return await collection_service.get_collections_by_user_id(db, user.id)
+async def get_my_collections(
+    response: Response,
+    sort: CollectionSort = "oldest",
+    limit: Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)] = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user)
+):
+    '''
+    Retrieves a page of collections owned by the current user.
+    Pass the X-Next-Cursor response header back as 'cursor' (with the same 'sort') to get the next page
+    '''
+    collections, next_cursor = await collection_service.get_collections_by_user_id(db, user.id, sort, limit, cursor)
+    set_next_cursor_header(response, next_cursor)
+
+    return collections
 
 @router.post("/", response_model=CollectionOutput, status_code=status.HTTP_201_CREATED)
 async def create_collection(collection : CollectionCreate, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
@@ -52,18 +79,19 @@ async def add_to_collection(
             )
         )
     ],
-    files: list[UploadFile] = File(
-        ...,
-        description="Upload files in the same order as content"
+    files: Optional[list[UploadFile]] = File(
+        None,
+        description="Upload files in the same order as the content entries without a sha256"
     ),
     db: AsyncSession = Depends(get_db),
     s3: S3Client = Depends(get_s3_client),
-    user = Depends(get_current_user)
+    db_collection: Collection = Depends(collection_service.get_editable_collection)
 ):
     """
     Add dotfiles to a collection.
     The 'content' list in the request body must match the 'files' list in order, 
-    e.g. content[0] describes files[0]
+    e.g. content[0] describes files[0].
+    Entries with a 'sha256' reference content the server already has (see /dotfiles/preflight) and have no file
     """
     try:
         collection_add = CollectionContentAdd.model_validate_json(collection_add_payload)
@@ -77,36 +105,23 @@ async def add_to_collection(
             detail=f"Body collection_id ({collection_add.collection_id}) must match URL collection_id ({collection_id})"
         )
 
-    # Validate that files and content lists match
-    if len(files) != len(collection_add.content):
+    # Validate that files and the content entries to upload match
+    files = files or []
+    uploaded_content = [content for content in collection_add.content if not content.sha256]
+    if len(files) != len(uploaded_content):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Number of files ({len(files)}) must match number of content entries ({len(collection_add.content)})"
+            detail=f"Number of files ({len(files)}) must match number of content entries ({len(uploaded_content)})"
         )
     
     # Validate that filenames match (to catch coordination errors)
-    for i, (file, content) in enumerate(zip(files, collection_add.content)):
+    for i, (file, content) in enumerate(zip(files, uploaded_content)):
         if file.filename != content.filename:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Filename mismatch at index {i}: uploaded file is '{file.filename}' but content specifies '{content.filename}'"
             )
 
-    # Check if collection exists
-    collection_exists = await collection_service.get_collection_by_id(db, collection_id)
-    if not collection_exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
-
-    # Check if collection is public
-    collection_is_public = await collection_service.is_collection_public(db, collection_id)
-    if not collection_is_public:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
-
-    #Check if user is owner
-    user_is_owner = await collection_service.is_collection_owned_by_user(db, collection_id, user.id)
-    if not user_is_owner:
-         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to edit this collection")       
-
     result = await collection_service.add_to_collection(db, s3, collection_add, files)
 
     # Validate and convert ORM objects to plain dicts for reliable JSON serialization
@@ -121,82 +136,174 @@ async def add_to_collection(
 
     return dotfile_outputs
 
+@router.post("/{collection_id}/dotfiles/preflight", response_model=list[DotfilePreflight])
+async def preflight_add_to_collection(collection_id:int, collection_preflight: CollectionContentPreflight, db: AsyncSession = Depends(get_db), db_collection: Collection = Depends(collection_service.get_editable_collection)):
+    '''
+    Returns the entries whose files must be uploaded to add them to a collection.
+    The other entries can be added without a file by sending their 'sha256' in the content of POST /dotfiles
+    '''
+    return await collection_service.get_required_uploads(db, db_collection, collection_preflight.content)
+
 @router.get("/{collection_id}/archive")
-async def get_collection_content(collection_id:int, db: AsyncSession = Depends(get_db), s3: S3Client = Depends(get_s3_client), user = Depends(get_current_user)):
+async def get_collection_content(collection_id:int, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db), s3: S3Client = Depends(get_s3_client), user = Depends(get_current_user), db_collection: Collection = Depends(collection_service.get_readable_collection)):
     '''Retrieves all dotfiles from a collection as a zip archive'''
     # GET requests cannot have a body; construct the read model from the path param instead
     collection = CollectionContentRead(collection_id=collection_id)
 
-    # Check if collection exists
-    collection_exists = await collection_service.get_collection_by_id(db, collection_id)
-    if not collection_exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
+    # An unchanged archive is neither rebuilt nor counted as a retrieval
+    etag = collection_service.get_collection_etag(db_collection, "archive")
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
 
-    # Check if user has access
-    user_has_access = await collection_service.get_access_to_collection_for_user(db, collection_id, user.id)
-    if not user_has_access:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
+    # In presigned mode the archive is built and stored in the bucket before the retrieval is counted, so that the
+    # quota row lock is only held for the count and its commit; the URL expires after PRESIGNED_URL_EXPIRES_SECONDS
+    if settings.DOWNLOAD_MODE == "presigned":
+        archive_url = await collection_service.get_presigned_archive_url(db, s3, collection, db_collection.version, db_collection.updated_at)
 
-    if user.account_tier == "free":
-        await refresh_retrieval_period(db, user)
+        await quota_service.enforce_retrieval_quota(db, user)
+        if user.account_tier == "free":
+            await db.commit()
 
-        # Check if user has reached or exceeded the limit
-        if user.monthly_retrieval_count >= FREE_TIER_RETRIEVAL_LIMIT:
-            raise HTTPException(
-                status_code=429, # "Too Many Requests" is the correct HTTP status code
-                detail=f"You have exceeded your monthly limit of {FREE_TIER_RETRIEVAL_LIMIT} retrievals. Please upgrade to a Pro account for unlimited access."
-            )
+        return RedirectResponse(archive_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"ETag": etag})
+
+    # Resets an expired period, checks the limit and counts this retrieval for free-tier users
+    await quota_service.enforce_retrieval_quota(db, user)
 
-    # Generate the zip archive
-    zipfile = await collection_service.get_dotfiles_from_collection(db, s3, collection)
+    # Prepare the zip archive stream (entries are fetched from storage while the response is sent, unless this version is cached)
+    try:
+        zip_stream = await collection_service.get_dotfiles_from_collection(db, s3, collection, db_collection.version, db_collection.updated_at)
+    except Exception:
+        # The retrieval is not counted if the archive cannot be prepared
+        if user.account_tier == "free":
+            await db.rollback()
+            await quota_service.refund_retrieval(user.id)
+        raise
     
-    # Increment user's monthly retrieval count (only for free tier)
+    # Commit the counted retrieval (only for free tier)
+    if user.account_tier == "free":
+        await db.commit()
+
+    headers = {"Content-Disposition": "attachment; filename=files.zip", "ETag": etag}
+    media_type = "application/zip"
+
+    return StreamingResponse(zip_stream, headers=headers, media_type=media_type)
+
+@router.post("/{collection_id}/sync", response_model=CollectionSyncOutput)
+async def sync_collection(collection_id:int, sync_request: CollectionSyncRequest, request: Request, db: AsyncSession = Depends(get_db), db_collection: Collection = Depends(collection_service.get_readable_collection)):
+    '''
+    Compares the files the client has, given as (path, sha256) pairs, with a collection.
+    Returns the dotfiles added and changed since, each with the URL of its content, and the deleted paths
+    '''
+    added, changed, deleted = await collection_service.get_collection_changes(db, collection_id, sync_request.files)
+
+    def to_output(dotfile) -> CollectionSyncDotfileOutput:
+        # The path tells apart dotfiles that share a filename
+        content_url = str(request.url_for("get_file_content_in_collection", collection_id=collection_id, filename=dotfile.filename).include_query_params(path=dotfile.path))
+        return CollectionSyncDotfileOutput(**DotfileOutput.model_validate(dotfile).model_dump(), content_url=content_url)
+
+    return CollectionSyncOutput(
+        version=db_collection.version,
+        added=[to_output(dotfile) for dotfile in added],
+        changed=[to_output(dotfile) for dotfile in changed],
+        deleted=deleted,
+    )
+
+@router.post("/{collection_id}/sync/archive")
+async def get_changed_collection_content(collection_id:int, sync_request: CollectionSyncRequest, db: AsyncSession = Depends(get_db), s3: S3Client = Depends(get_s3_client), user = Depends(get_current_user), db_collection: Collection = Depends(collection_service.get_readable_collection)):
+    '''Retrieves only the dotfiles added or changed since the files the client has as a zip archive; 204 when there are none'''
+    zip_stream = await collection_service.get_changed_dotfiles_from_collection(db, s3, collection_id, sync_request.files, db_collection.updated_at)
+
+    # Nothing to download is not counted as a retrieval
+    if zip_stream is None:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    # Counted like a full archive retrieval (only for free tier); nothing can fail between counting and streaming
+    await quota_service.enforce_retrieval_quota(db, user)
     if user.account_tier == "free":
-        user.monthly_retrieval_count += 1
         await db.commit()
-        # Refresh the user to avoid detached instance issues
-        await db.refresh(user)
 
-    headers = {"Content-Disposition": "attachment; filename=files.zip"}
+    headers = {"Content-Disposition": "attachment; filename=changes.zip"}
     media_type = "application/zip"
 
-    return Response(content=zipfile, headers=headers, media_type=media_type)
+    return StreamingResponse(zip_stream, headers=headers, media_type=media_type)
 
 @router.get("/{collection_id}/dotfiles", response_model=list[DotfileOutput])
-async def get_collection_file_paths(collection_id:int, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
+async def get_collection_file_paths(collection_id:int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db), db_collection: Collection = Depends(collection_service.get_readable_collection)):
     '''Retrieves all dotfiles from a collection'''
-    # Check if collection exists
-    collection_exists = await collection_service.get_collection_by_id(db, collection_id)
-    if not collection_exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
-
-    # Check if user has access
-    user_has_access = await collection_service.get_access_to_collection_for_user(db, collection_id, user.id)
-    if not user_has_access:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
+    etag = collection_service.get_collection_etag(db_collection, "dotfiles")
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
 
     result = await collection_service.get_dotfile_from_collection(db, collection_id)
+    response.headers["ETag"] = etag
 
     return result
 
-@router.delete("/{collection_id}/dotfiles/{filename}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_file_in_collection(collection_id:int, filename:str, db: AsyncSession = Depends(get_db), s3 : S3Client = Depends(get_s3_client), user = Depends(get_current_user)):
-    '''Deletes a dotfile from a collection'''
-    # Check if collection exists
-    collection_exists = await collection_service.get_collection_by_id(db, collection_id)
-    if not collection_exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
-    
-    # Check if collection is public
-    collection_is_public = await collection_service.is_collection_public(db, collection_id)
-    if not collection_is_public:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
+@router.get("/{collection_id}/dotfiles/{filename}/content")
+async def get_file_content_in_collection(collection_id:int, filename:str, path: Optional[str] = Query(None), range_header: Optional[str] = Header(None, alias="Range"), if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db), s3: S3Client = Depends(get_s3_client), user = Depends(get_current_user), db_collection: Collection = Depends(collection_service.get_readable_collection)):
+    '''
+    Streams the content of one dotfile from a collection, or the byte range requested by a Range header.
+    The path query parameter selects the dotfile when several share the filename; the first uploaded one is served otherwise
+    '''
+    db_dotfiles = await dotfile_service.get_dotfile_by_filename_in_collection(db, collection_id, filename, path)
+    if not db_dotfiles:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File {filename} not found")
+
+    # An unchanged file is neither fetched nor counted as a retrieval
+    etag = dotfile_service.get_dotfile_etag(db_dotfiles[0])
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
 
-    #Check if user is owner
-    user_is_owner = await collection_service.is_collection_owned_by_user(db, collection_id, user.id)
-    if not user_is_owner:
-         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to edit this collection")       
+    # Counted like an archive retrieval so that files cannot be downloaded one by one past the limit. Range requests
+    # count too: compressed objects and presigned URLs are served whole, and any range exemption could be chained
+    await quota_service.enforce_retrieval_quota(db, user)
+
+    try:
+        if settings.DOWNLOAD_MODE == "presigned":
+            file_url = await collection_service.get_presigned_dotfile_url(s3, collection_id, db_dotfiles[0])
+        else:
+            storage_object = await collection_service.get_dotfile_content_from_collection(s3, collection_id, db_dotfiles[0], range_header)
+    except Exception:
+        # The retrieval is not counted if the file cannot be fetched
+        if user.account_tier == "free":
+            await db.rollback()
+            await quota_service.refund_retrieval(user.id)
+        raise
 
+    if user.account_tier == "free":
+        await db.commit()
+
+    # The file is downloaded from storage directly, which also serves Range requests
+    if settings.DOWNLOAD_MODE == "presigned":
+        return RedirectResponse(file_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"ETag": etag} if etag else None)
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Length": str(storage_object["ContentLength"]),
+        "Accept-Ranges": "bytes",
+    }
+    if etag:
+        headers["ETag"] = etag
+
+    # Content compressed at rest is decompressed while streamed; its length is the recorded size and ranges are not served
+    codec = file_storage_service.get_storage_codec(storage_object)
+    if codec:
+        headers["Accept-Ranges"] = "none"
+        del headers["Content-Length"]
+        if db_dotfiles[0].size is not None:
+            headers["Content-Length"] = str(db_dotfiles[0].size)
+
+    # Storage answers a satisfiable Range with the selected bytes and their position
+    status_code = status.HTTP_200_OK
+    if storage_object.get("ContentRange"):
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = storage_object["ContentRange"]
+
+    return StreamingResponse(file_storage_service.stream_file_body(storage_object["Body"], codec=codec), status_code=status_code, headers=headers, media_type="application/octet-stream")
+
+@router.delete("/{collection_id}/dotfiles/{filename}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_file_in_collection(collection_id:int, filename:str, db: AsyncSession = Depends(get_db), s3 : S3Client = Depends(get_s3_client), db_collection: Collection = Depends(collection_service.get_editable_collection)):
+    '''Deletes a dotfile from a collection'''
     # Check if the file in the collection exists
     file_exists = await dotfile_service.get_dotfile_by_filename_in_collection(db, collection_id, filename)
     if not file_exists:
@@ -207,23 +314,8 @@ async def delete_file_in_collection(collection_id:int, filename:str, db: AsyncSe
     return
 
 @router.delete("/{collection_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_collection(collection_id:int, db: AsyncSession = Depends(get_db), s3 : S3Client = Depends(get_s3_client), user = Depends(get_current_user)):    
+async def delete_collection(collection_id:int, db: AsyncSession = Depends(get_db), s3 : S3Client = Depends(get_s3_client), db_collection: Collection = Depends(collection_service.get_editable_collection)):    
     '''Deletes an entire collection'''
-    # Check if collection exists
-    collection_exists = await collection_service.get_collection_by_id(db, collection_id)
-    if not collection_exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
-    
-    # Check if collection is public
-    collection_is_public = await collection_service.is_collection_public(db, collection_id)
-    if not collection_is_public:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
-
-    #Check if user is owner
-    user_is_owner = await collection_service.is_collection_owned_by_user(db, collection_id, user.id)
-    if not user_is_owner:
-         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to edit this collection")       
-
     await collection_service.delete_collection(db, s3, collection_id)
 
     return
\ No newline at end of file
@@ -1,10 +1,14 @@
 # app/routers/users.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Annotated, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
 
 
+from app.core.pagination import CountMode, set_next_cursor_header, set_total_count_headers
+from app.core.settings import settings
 from app.db.database import get_db
 from app.schemas.users import UserCreate, UserOutput
 from app.services import user_service
@@ -15,9 +19,18 @@ from app.services.license_key_service import get_license_key_by_string
 router = APIRouter()
 
 @router.get("/", response_model=list[UserOutput], status_code=status.HTTP_200_OK)
-async def user_list(db:AsyncSession = Depends(get_db)):
-    '''Retrieves a list of all users'''
-    db_users = await user_service.get_users(db)
+async def user_list(
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)] = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    tier: Optional[Literal["free", "pro", "admin"]] = None,
+    count: CountMode = "none",
+    db: AsyncSession = Depends(get_db)
+):
+    '''Retrieves a page of users, optionally filtered by account tier'''
+    db_users, next_cursor, total_count, count_mode = await user_service.get_users(db, limit, cursor, tier, count)
+    set_next_cursor_header(response, next_cursor)
+    set_total_count_headers(response, total_count, count_mode)
     return db_users
     
 @router.get("/me", response_model=UserOutput, status_code=status.HTTP_200_OK)
@@ -85,6 +98,9 @@ async def activate_license_key(
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to activate license key: {exc}") from exc
 
+    # Drop the cached snapshot so the pro tier applies to the user's next request
+    user_service.invalidate_cached_user(db_user.id)
+
     await db.refresh(db_user)
     await db.refresh(key_in_db)
 
@@ -1,41 +1,69 @@
 # app/s3/s3_bucket.py
+import asyncio
 from collections.abc import AsyncGenerator
+from contextlib import AsyncExitStack
+from typing import Optional
 
-import aiobotocore
+import aiobotocore.session
 from aiobotocore.client import AioBaseClient
-from botocore.config import Config
+from aiobotocore.config import AioConfig
 from app.core.settings import settings
 
 BUCKET_NAME = 'dot-s3'
 
-async def get_s3_client() -> AsyncGenerator[AioBaseClient, None]:
-    config = Config(
-        connect_timeout=10,
-        read_timeout=60,
-        retries={'max_attempts': 2}
+# Long-lived client shared by all requests of this worker, managed by the app lifespan
+_s3_client: Optional[AioBaseClient] = None
+_s3_client_stack: Optional[AsyncExitStack] = None
+_s3_client_lock = asyncio.Lock()
+
+def get_s3_client_config() -> AioConfig:
+    return AioConfig(
+        connect_timeout=settings.S3_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=settings.S3_READ_TIMEOUT_SECONDS,
+        retries={'max_attempts': settings.S3_MAX_ATTEMPTS},
+        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connector_args={'keepalive_timeout': settings.S3_KEEPALIVE_TIMEOUT_SECONDS},
     )
-    
-    # Create a new session for each request to avoid connection reuse issues
-    session = aiobotocore.session.get_session()
-    
-    async with session.create_client(
-        service_name='s3',
-        aws_access_key_id=settings.FILE_STORAGE_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.FILE_STORAGE_SECRET_ACCESS_KEY,
-        endpoint_url=settings.FILE_STORAGE_URL,
-        region_name=settings.FILE_STORAGE_REGION,
-        config=config
-    ) as s3_client:
-        yield s3_client
+
+# creates the shared client if it does not exist yet
+async def start_s3_client() -> AioBaseClient:
+    global _s3_client, _s3_client_stack
+
+    async with _s3_client_lock:
+        if _s3_client is None:
+            session = aiobotocore.session.get_session()
+            stack = AsyncExitStack()
+            _s3_client = await stack.enter_async_context(session.create_client(
+                service_name='s3',
+                aws_access_key_id=settings.FILE_STORAGE_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.FILE_STORAGE_SECRET_ACCESS_KEY,
+                endpoint_url=settings.FILE_STORAGE_URL,
+                region_name=settings.FILE_STORAGE_REGION,
+                config=get_s3_client_config()
+            ))
+            _s3_client_stack = stack
+
+        return _s3_client
+
+# closes the shared client and its connection pool
+async def close_s3_client():
+    global _s3_client, _s3_client_stack
+
+    async with _s3_client_lock:
+        stack = _s3_client_stack
+        _s3_client, _s3_client_stack = None, None
+
+    if stack is not None:
+        await stack.aclose()
+
+# The shared client is kept on request errors: other requests are still using it, and its
+# connection pool already discards connections that failed, so a transient error stays with its request
+async def get_s3_client() -> AsyncGenerator[AioBaseClient, None]:
+    yield await start_s3_client()
 
 
 async def check_storage_health() -> None:
-    session = aiobotocore.session.get_session()
-    async with session.create_client(
-        service_name='s3',
-        aws_access_key_id=settings.FILE_STORAGE_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.FILE_STORAGE_SECRET_ACCESS_KEY,
-        endpoint_url=settings.FILE_STORAGE_URL,
-        region_name=settings.FILE_STORAGE_REGION
-    ) as s3_client:
-        await s3_client.head_bucket(Bucket=BUCKET_NAME)
\ No newline at end of file
+    s3_client = await start_s3_client()
+
+    await s3_client.head_bucket(Bucket=BUCKET_NAME)
@@ -1,8 +1,11 @@
 # app/schemas/collections.py
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel
 from datetime import datetime
-from app.schemas.dotfiles import DotfileCreate
+from app.schemas.dotfiles import DotfileCreate, DotfileOutput, DotfilePreflight
+
+# oldest/newest: creation order, updated: recently updated first, name: alphabetical
+CollectionSort = Literal["oldest", "newest", "updated", "name"]
 
 class CollectionCreate(BaseModel):
     name : str
@@ -13,6 +16,9 @@ class CollectionContentAdd(BaseModel):
     collection_id : int
     content : list[DotfileCreate]
 
+class CollectionContentPreflight(BaseModel):
+    content : list[DotfilePreflight]
+
 class CollectionContentDelete(BaseModel):
     collection_id : int
     filename : str
@@ -20,6 +26,23 @@ class CollectionContentDelete(BaseModel):
 class CollectionContentRead(BaseModel):
     collection_id : int
 
+# a file the client already has, identified by its path and the sha256 of its content
+class CollectionSyncFile(BaseModel):
+    path : str
+    sha256 : str
+
+class CollectionSyncRequest(BaseModel):
+    files : list[CollectionSyncFile]
+
+class CollectionSyncDotfileOutput(DotfileOutput):
+    content_url : str
+
+class CollectionSyncOutput(BaseModel):
+    version : int
+    added : list[CollectionSyncDotfileOutput]
+    changed : list[CollectionSyncDotfileOutput]
+    deleted : list[str] # paths the client has that are no longer in the collection
+
 class CollectionOutput(BaseModel):
     id : int
     name : str
@@ -1,13 +1,25 @@
 # app/schemas/dotfiles.py
+from typing import Optional
 from pydantic import BaseModel
 
 class DotfileCreate(BaseModel):
     path : str
     filename : str
+    sha256 : Optional[str] = None # set for content the server already has (see the upload pre-flight); no file is uploaded for it
+
+# a dotfile the client intends to upload, described by its content hash and size
+class DotfilePreflight(BaseModel):
+    path : str
+    filename : str
+    sha256 : str
+    size : int
 
 class DotfileOutput(BaseModel):
     path: str
     filename: str
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    etag: Optional[str] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -14,5 +14,5 @@ class KeyGenerationResponse(BaseModel):
     generated_keys: list[str]
 
 class KeyGenerationRequest(BaseModel):
-    # at least 1 key, max 100 at a time.
-    quantity: int = Field(..., gt=0, le=100)
+    # at least 1 key, max 10000 at a time.
+    quantity: int = Field(..., gt=0, le=10000)
@@ -0,0 +1,8 @@
+# app/schemas/storage.py
+from pydantic import BaseModel
+
+class StoredFile(BaseModel):
+    key: str
+    size: int
+    sha256: str
+    etag: str
@@ -15,6 +15,15 @@ class UserOutput(BaseModel):
     class Config: 
         from_attributes = True # SQLAlchemy(DB) to Pydantic(API)
 
+class AuthenticatedUser(BaseModel):
+    id: int
+    username: str
+    email: str
+    account_tier: str
+    class Config:
+        from_attributes = True
+        frozen = True # Shared between requests through the user cache
+
 class UserPromote(BaseModel):
     user_id: int
     to_tier: Literal["free", "pro", "admin"] = "free"
\ No newline at end of file
@@ -0,0 +1,107 @@
+# app/services/archive_cache_service.py
+from collections.abc import AsyncIterator, Callable
+from typing import Optional
+
+from aiobotocore.session import ClientCreatorContext as S3Client
+from fastapi import HTTPException
+
+from app.core.cache import ByteBoundedLRUCache
+from app.core.settings import settings
+from app.services import file_storage_service
+
+# built archives keyed by (collection id, collection version)
+archive_memory_cache = ByteBoundedLRUCache(max_bytes=settings.ARCHIVE_CACHE_MAX_BYTES, max_entry_bytes=settings.ARCHIVE_CACHE_MAX_ENTRY_BYTES)
+
+# storage key prefix of the cached archives of a collection (dotfile keys always start with "c{collection_id}/")
+def generate_archive_prefix(collection_id: int) -> str:
+    return f"archives/c{collection_id}/"
+
+# storage key of a cached archive in the s3 tier
+def generate_archive_name(collection_id: int, version: int) -> str:
+    return f"{generate_archive_prefix(collection_id)}v{version}.zip"
+
+# collection version of a cached archive's storage key, or None for keys not named like an archive
+def get_archive_version(archive_name: str) -> Optional[int]:
+    version = archive_name.rpartition("/")[2].removeprefix("v").removesuffix(".zip")
+    return int(version) if version.isdigit() else None
+
+# archives are kept in the bucket for the s3 tier and for presigned downloads
+def archives_kept_in_storage() -> bool:
+    return settings.ARCHIVE_CACHE_S3_ENABLED or settings.DOWNLOAD_MODE == "presigned"
+
+# retrieves a built archive from the memory tier, then from the s3 tier
+async def get_cached_archive(s3: S3Client, collection_id: int, version: int) -> Optional[bytes]:
+    content = archive_memory_cache.get((collection_id, version))
+    if content is not None:
+        return content
+
+    if not settings.ARCHIVE_CACHE_S3_ENABLED:
+        return None
+
+    try:
+        content = await file_storage_service.retrieve_file_content_from_storage_by_filename(s3, generate_archive_name(collection_id, version))
+    except HTTPException as exc:
+        if exc.status_code == 404:
+            return None
+        raise
+
+    archive_memory_cache.set((collection_id, version), content)
+    return content
+
+# stores a built archive in every enabled tier
+async def cache_archive(s3: S3Client, collection_id: int, version: int, content: bytes):
+    archive_memory_cache.set((collection_id, version), content)
+
+    if settings.ARCHIVE_CACHE_S3_ENABLED and len(content) <= settings.ARCHIVE_CACHE_MAX_ENTRY_BYTES:
+        await file_storage_service.upload_content_to_storage(s3, generate_archive_name(collection_id, version), content)
+
+# makes sure the archive of a collection version is stored in the bucket, uploading it from the memory tier
+# or from build_archive (called only when needed) as it is built; returns its storage key
+async def store_archive(s3: S3Client, collection_id: int, version: int, build_archive: Callable[[], AsyncIterator[bytes]]) -> str:
+    archive_name = generate_archive_name(collection_id, version)
+    if await file_storage_service.file_exists_in_storage(s3, archive_name):
+        return archive_name
+
+    content = archive_memory_cache.get((collection_id, version))
+    if content is not None:
+        await file_storage_service.upload_content_to_storage(s3, archive_name, content)
+    else:
+        await file_storage_service.upload_stream_to_storage(s3, archive_name, build_archive())
+
+    return archive_name
+
+# streams an archive that was retrieved from the cache
+async def stream_cached_archive(content: bytes) -> AsyncIterator[bytes]:
+    yield content
+
+# passes an archive stream through while keeping a copy, then caches it once complete
+async def stream_and_cache_archive(s3: S3Client, collection_id: int, version: int, archive_stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    chunks: Optional[list[bytes]] = []
+    size = 0
+
+    async for chunk in archive_stream:
+        if chunks is not None:
+            size += len(chunk)
+            # Stop collecting once the archive is too large to be cached
+            if size > settings.ARCHIVE_CACHE_MAX_ENTRY_BYTES:
+                chunks = None
+            else:
+                chunks.append(chunk)
+        yield chunk
+
+    if chunks is not None:
+        await cache_archive(s3, collection_id, version, b"".join(chunks))
+
+# drops cached archives of a collection that are older than its current version, or all of them when current_version is None.
+# Stored archives are listed by prefix, so archives of older versions built late by concurrent requests are dropped too
+async def invalidate_collection_archives(s3: S3Client, collection_id: int, current_version: Optional[int]):
+    def is_stale(version: Optional[int]) -> bool:
+        return current_version is None or (version is not None and version < current_version)
+
+    archive_memory_cache.invalidate_where(lambda key: key[0] == collection_id and is_stale(key[1]))
+
+    if archives_kept_in_storage():
+        archive_names = await file_storage_service.list_files_in_storage_by_prefix(s3, generate_archive_prefix(collection_id))
+        stale_archive_names = [archive_name for archive_name in archive_names if is_stale(get_archive_version(archive_name))]
+        if stale_archive_names:
+            await file_storage_service.delete_files_from_storage_by_filenames(s3, stale_archive_names)
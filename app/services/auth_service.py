@@ -11,9 +11,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.settings import settings
 from app.db.database import get_db
 from app.models.users import User
-from app.services.user_service import get_user_by_email
+from app.services.user_service import get_user_by_email, get_user_by_id, get_cached_user, cache_user
 from app.core.security import verify_pwd
 from app.schemas.token import TokenData
+from app.schemas.users import AuthenticatedUser
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
@@ -28,7 +29,7 @@ async def authenticate_user(email: str, pwd: str, db: AsyncSession) -> User | No
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
     db: AsyncSession = Depends(get_db),
-) -> User:
+) -> AuthenticatedUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -39,15 +40,26 @@ async def get_current_user(
         email = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
+        token_data = TokenData(email=email, user_id=payload.get("uid"))
     except jwt.InvalidTokenError:
         raise credentials_exception
-    user = await get_user_by_email(db, email=token_data.email)
-    if user is None:
+
+    # Fast path: tokens carrying the user id are served from the user cache without touching the db.
+    # The tier always comes from the user record, so tier changes apply to tokens already issued
+    if token_data.user_id is not None:
+        cached_user = get_cached_user(token_data.user_id)
+        if cached_user is not None and cached_user.email == token_data.email:
+            return cached_user
+        user = await get_user_by_id(db, token_data.user_id)
+    else:
+        # Tokens issued before the id claim was added
+        user = await get_user_by_email(db, email=token_data.email)
+
+    if user is None or user.email != token_data.email:
         raise credentials_exception
-    return user
+    return cache_user(user)
 
-async def get_current_admin_user(db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)) -> User:
+async def get_current_admin_user(db: AsyncSession = Depends(get_db), user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     if user.account_tier != "admin":
         # print("User is not admin:", user.account_tier)
         raise HTTPException(
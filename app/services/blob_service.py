@@ -0,0 +1,137 @@
+# app/services/blob_service.py
+from collections import Counter
+import hashlib
+from typing import Optional
+
+from fastapi import UploadFile
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.blobs import Blob
+from app.models.collections import Collection
+from app.models.dotfiles import Dotfile
+from app.schemas.storage import StoredFile
+from app.services.file_storage_service import STREAM_CHUNK_SIZE
+
+# subtracts released references from the stored counts, one parameter set per blob
+blobs_table = Blob.__table__
+release_blob_references_statement = (
+    update(blobs_table)
+    .where(blobs_table.c.sha256 == bindparam("b_sha256"))
+    .values(ref_count=blobs_table.c.ref_count - bindparam("b_released"))
+)
+
+# storage key of a content-addressed blob; the two-character prefix spreads keys over storage partitions
+def generate_blob_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+# computes the sha256 and size of an uploaded file in chunks, then rewinds it for the upload
+async def hash_upload_file(file: UploadFile) -> tuple[str, int]:
+    hasher = hashlib.sha256()
+    size = 0
+
+    while chunk := await file.read(STREAM_CHUNK_SIZE):
+        hasher.update(chunk)
+        size += len(chunk)
+
+    await file.seek(0)
+
+    return hasher.hexdigest(), size
+
+# locks the rows of the given blobs until commit (FOR UPDATE on PostgreSQL), in hash order and in one statement.
+# A request locks every blob it adds or releases references to at once, so requests never wait on each other in a cycle
+async def lock_blobs(db: AsyncSession, sha256s: set[str]):
+    if not sha256s:
+        return
+
+    await db.execute(select(Blob.sha256).filter(Blob.sha256.in_(sha256s)).order_by(Blob.sha256).with_for_update())
+
+# retrieves the stored blobs among the given hashes by hash, without locking them: a blob found here may lose its
+# last reference before the caller adds its own, which add_blob_references reports
+async def get_existing_blobs(db: AsyncSession, sha256s: set[str]) -> dict[str, Blob]:
+    if not sha256s:
+        return {}
+
+    result = await db.execute(select(Blob).filter(Blob.sha256.in_(sha256s)))
+    return {blob.sha256: blob for blob in result.scalars().all()}
+
+# retrieves the stored blobs among the given hashes that dotfiles in collections of an owner reference, by hash
+async def get_blobs_referenced_by_owner(db: AsyncSession, owner_id: int, sha256s: set[str]) -> dict[str, Blob]:
+    if not sha256s:
+        return {}
+
+    result = await db.execute(
+        select(Blob)
+        .join(Dotfile, Dotfile.blob_sha256 == Blob.sha256)
+        .join(Collection, Collection.id == Dotfile.collection_id)
+        .filter(Collection.owner_id == owner_id, Blob.sha256.in_(sha256s))
+        .distinct()
+    )
+    return {blob.sha256: blob for blob in result.scalars().all()}
+
+# upserts one row per blob with ref_count set to, or increased by, the given count per hash and returns the resulting counts
+async def _upsert_blobs(db: AsyncSession, stored_files: list[StoredFile], references: Counter) -> dict[str, int]:
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    blobs = {stored_file.sha256: stored_file for stored_file in stored_files}
+
+    statement = dialect_insert(Blob).values([
+        {"sha256": sha256, "size": blobs[sha256].size, "etag": blobs[sha256].etag, "ref_count": references[sha256]}
+        for sha256 in sorted(blobs)
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[Blob.sha256],
+        set_={"ref_count": Blob.ref_count + statement.excluded.ref_count}
+    ).returning(Blob.sha256, Blob.ref_count)
+
+    result = await db.execute(statement)
+    return {sha256: ref_count for sha256, ref_count in result.all()}
+
+# adds one reference per stored file, creating the blob rows that don't exist yet, and returns the resulting
+# reference count of each blob by hash. A count equal to the references added means no other dotfile references
+# the blob, so its object may have been deleted meanwhile; caller commits
+async def add_blob_references(db: AsyncSession, stored_files: list[StoredFile]) -> dict[str, int]:
+    if not stored_files:
+        return {}
+
+    return await _upsert_blobs(db, stored_files, Counter(stored_file.sha256 for stored_file in stored_files))
+
+# records stored objects that no dotfile references as blobs without references, so that they can be found,
+# reused and deleted with delete_unreferenced_blobs; caller commits
+async def add_unreferenced_blobs(db: AsyncSession, stored_files: list[StoredFile]):
+    if stored_files:
+        await _upsert_blobs(db, stored_files, Counter())
+
+# removes one reference per given hash (None stands for a dotfile without a blob) and returns the hashes of the blobs
+# that lost their last reference. Their rows are kept until delete_unreferenced_blobs deletes them with their objects,
+# after the caller commits
+async def release_blob_references(db: AsyncSession, sha256s: list[Optional[str]]) -> list[str]:
+    released = Counter(sha256 for sha256 in sha256s if sha256)
+    if not released:
+        return []
+
+    await lock_blobs(db, set(released))
+    await db.execute(release_blob_references_statement, [{"b_sha256": sha256, "b_released": count} for sha256, count in sorted(released.items())])
+
+    result = await db.execute(select(Blob.sha256).filter(Blob.sha256.in_(released), Blob.ref_count <= 0))
+    return result.scalars().all()
+
+# deletes the rows of the blobs among the given hashes that still have no references, skipping rows another request
+# holds, and returns their storage keys; caller deletes the objects and commits, holding the locks of unreferenced rows only
+async def delete_unreferenced_blobs(db: AsyncSession, sha256s: list[str]) -> list[str]:
+    if not sha256s:
+        return []
+
+    result = await db.execute(
+        select(Blob.sha256)
+        .filter(Blob.sha256.in_(sha256s), Blob.ref_count <= 0)
+        .order_by(Blob.sha256)
+        .with_for_update(skip_locked=True)
+    )
+    unreferenced = result.scalars().all()
+    if not unreferenced:
+        return []
+
+    await db.execute(delete(Blob).where(Blob.sha256.in_(unreferenced)).execution_options(synchronize_session=False))
+    return [generate_blob_key(sha256) for sha256 in unreferenced]
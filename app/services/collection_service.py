@@ -1,62 +1,108 @@
 # app/services/collection_service.py
+from collections.abc import AsyncIterator
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from aiobotocore.session import ClientCreatorContext as S3Client
 from aiobotocore.response import StreamingBody
 
+from sqlalchemy import func, not_, update
 from sqlalchemy.future import select
 
 from fastapi import UploadFile
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException, status
 
-import io
+import asyncio
+import logging
+from datetime import datetime
 import zipfile
+from collections import Counter, deque
 
+from app.core.etag import make_strong_etag
+from app.core.pagination import get_page, paginate_by_keyset
+from app.core.settings import settings
+from app.db.database import get_db
 from app.models.dotfiles import Dotfile
 from app.models.collections import Collection
-from app.schemas.collections import CollectionCreate, CollectionContentAdd, CollectionContentRead
+from app.schemas.users import AuthenticatedUser
+from app.schemas.collections import CollectionCreate, CollectionContentAdd, CollectionContentRead, CollectionSort, CollectionSyncFile
+from app.schemas.dotfiles import DotfilePreflight
+from app.schemas.storage import StoredFile
 
+from app.services import archive_cache_service
+from app.services import blob_service
 from app.services import file_storage_service
 from app.services import dotfile_service
+from app.services.file_storage_service import STREAM_CHUNK_SIZE
+from app.services.auth_service import get_current_user
+
+logger = logging.getLogger(__name__)
 
 # checks if a user has access to a collection (public or owned by user)
-async def get_access_to_collection_for_user(db: AsyncSession, collection_id: int, user_id: int) -> bool:
-    user_is_owner = await is_collection_owned_by_user(db, collection_id, user_id)
-    collection_is_public = await is_collection_public(db, collection_id)
-    
-    return user_is_owner or collection_is_public
+def get_access_to_collection_for_user(collection: Collection, user_id: int) -> bool:
+    return is_collection_owned_by_user(collection, user_id) or is_collection_public(collection)
 
 # checks if collection is public
-async def is_collection_public(db: AsyncSession, collection_id: int) -> bool:
-    result = await db.execute(select(Collection).filter(Collection.id == collection_id))
-    collection = result.scalars().first()
-
+def is_collection_public(collection: Collection) -> bool:
     return not collection.is_private
 
 # checks if a user is owned of a collection
-async def is_collection_owned_by_user(db: AsyncSession, collection_id: int, user_id: int) -> bool:
-    result = await db.execute(select(Collection).filter(Collection.id == collection_id))
-    collection = result.scalars().first()
+def is_collection_owned_by_user(collection: Collection, user_id: int) -> bool:
+    return collection.owner_id == user_id
 
-    user_is_owner = (collection.owner_id == user_id)
-    
-    return user_is_owner
+# dependency: loads a collection once and checks that the current user can read it
+async def get_readable_collection(collection_id: int, db: AsyncSession = Depends(get_db), user: AuthenticatedUser = Depends(get_current_user)) -> Collection:
+    collection = await get_collection_by_id(db, collection_id)
+    if not collection:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
+
+    if not get_access_to_collection_for_user(collection, user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
+
+    return collection
+
+# dependency: loads a collection once and checks that the current user can edit it
+async def get_editable_collection(collection_id: int, db: AsyncSession = Depends(get_db), user: AuthenticatedUser = Depends(get_current_user)) -> Collection:
+    collection = await get_collection_by_id(db, collection_id)
+    if not collection:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Collection {collection_id} not found")
+
+    if not is_collection_public(collection):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this collection")
+
+    if not is_collection_owned_by_user(collection, user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to edit this collection")
+
+    return collection
 
 # retrieves a collection by its id
 async def get_collection_by_id(db: AsyncSession, collection_id: int) -> Optional[Collection]:
     result = await db.execute(select(Collection).filter(Collection.id == collection_id))
     return result.scalars().first()
 
-# retrieves all public collections
-async def get_public_collections(db: AsyncSession) -> Optional[list[Collection]]:
-    result = await db.execute(select(Collection).filter(Collection.is_private == False))
-    return result.scalars().all()
+# sort key columns and direction of each collection sort order; every key ends with the id to make it unique
+COLLECTION_SORT_KEYS = {
+    "oldest": ([Collection.id], False),
+    "newest": ([Collection.id], True),
+    "updated": ([Collection.updated_at, Collection.id], True),
+    "name": ([Collection.name, Collection.id], False),
+}
+
+# retrieves a page of public collections and the cursor of the next page
+async def get_public_collections(db: AsyncSession, sort: CollectionSort = "oldest", limit: int = settings.PAGE_SIZE_DEFAULT, cursor: Optional[str] = None) -> tuple[list[Collection], Optional[str]]:
+    columns, descending = COLLECTION_SORT_KEYS[sort]
+    query = paginate_by_keyset(select(Collection).filter(not_(Collection.is_private)), columns, descending, sort, cursor, limit)
+
+    result = await db.execute(query)
+    return get_page(result.scalars().all(), columns, sort, limit)
+
+# retrieves a page of collections owned by a user and the cursor of the next page
+async def get_collections_by_user_id(db: AsyncSession, user_id: int, sort: CollectionSort = "oldest", limit: int = settings.PAGE_SIZE_DEFAULT, cursor: Optional[str] = None) -> tuple[list[Collection], Optional[str]]:
+    columns, descending = COLLECTION_SORT_KEYS[sort]
+    query = paginate_by_keyset(select(Collection).filter(Collection.owner_id == user_id), columns, descending, sort, cursor, limit)
 
-# retrieves all collections owned by a user
-async def get_collections_by_user_id(db: AsyncSession, user_id: int) -> Optional[list[Collection]]:
-    result = await db.execute(select(Collection).filter(Collection.owner_id == user_id))
-    return result.scalars().all()
+    result = await db.execute(query)
+    return get_page(result.scalars().all(), columns, sort, limit)
 
 # creates a collection db record in the collection table
 async def create_collection(db: AsyncSession, collection: CollectionCreate, user_id: int) -> Collection:
@@ -68,30 +114,213 @@ async def create_collection(db: AsyncSession, collection: CollectionCreate, user
 
     return db_collection
 
-# adds files to a collection: uploads to s3 with storage filename and creates dotfile records in db with original filename
+# increments a collection's version so cached archives of earlier versions are no longer served; caller commits
+async def bump_collection_version(db: AsyncSession, collection_id: int) -> int:
+    result = await db.execute(
+        update(Collection)
+        .where(Collection.id == collection_id)
+        .values(version=Collection.version + 1, updated_at=func.now())
+        .returning(Collection.version)
+    )
+    return result.scalar_one()
+
+# adds files to a collection: uploads content that is not stored yet as content-addressed blobs and
+# creates dotfile records in db with original filename, each referencing its blob.
+# files are the uploads of the entries without a sha256, in order; entries with a sha256 reference content
+# that the collection owner's files already store (see get_required_uploads)
 async def add_to_collection(db: AsyncSession, s3: S3Client, collection_add: CollectionContentAdd, files: list[UploadFile]) -> list[Dotfile]:
-    # upload the files to s3 bucket
-    for file in files:
-        # Generate unique filename for storage
-        storage_filename = dotfile_service.generate_dotfile_name_in_collection(collection_add.collection_id, file.filename)
-        
-        # Temporarily change the filename for storage
-        original_filename = file.filename
-        file.filename = storage_filename
-        
-        await file_storage_service.upload_file_to_storage(s3, file)
-        
-        # Restore original filename
-        file.filename = original_filename
+    collection_id = collection_add.collection_id
+    entries = collection_add.content
+
+    uploads = iter(files)
+    entry_files = [None if entry.sha256 else next(uploads) for entry in entries]
+    # Uploads are hashed before anything is sent, so that content already stored is never uploaded again. This reads each
+    # upload twice from its local spool, which costs far less than uploading content to a temporary key to hash it
+    hashes = [(entry.sha256.lower(), None) if file is None else await blob_service.hash_upload_file(file) for entry, file in zip(entries, entry_files)]
+
+    # Entries matching the dotfile already at their path are left untouched
+    existing_dotfiles = {dotfile.path: dotfile for dotfile in await dotfile_service.get_dotfiles_by_collection_id(db, collection_id)}
+    changed_indices = [
+        index for index, (entry, (sha256, _)) in enumerate(zip(entries, hashes))
+        if not (entry.path in existing_dotfiles and existing_dotfiles[entry.path].filename == entry.filename and existing_dotfiles[entry.path].blob_sha256 == sha256)
+    ]
+    if not changed_indices:
+        return [existing_dotfiles[entry.path] for entry in entries]
+
+    changed_entries = [entries[index] for index in changed_indices]
+    changed_files = [entry_files[index] for index in changed_indices]
+    changed_hashes = [hashes[index] for index in changed_indices]
+
+    # Identical content, within this request or already stored by any collection, is uploaded once. Blobs are looked up
+    # without locks, so that uploads don't wait on each other while content is sent to storage
+    existing_blobs = await blob_service.get_existing_blobs(db, {sha256 for sha256, _ in changed_hashes})
+
+    referenced_hashes = {sha256 for file, (sha256, _) in zip(changed_files, changed_hashes) if file is None}
+    if referenced_hashes:
+        db_collection = await db.get(Collection, collection_id)
+        owned_blobs = await blob_service.get_blobs_referenced_by_owner(db, db_collection.owner_id, referenced_hashes)
+        unknown_filenames = [entry.filename for entry, file, (sha256, _) in zip(changed_entries, changed_files, changed_hashes) if file is None and sha256 not in owned_blobs]
+        if unknown_filenames:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Content of {', '.join(unknown_filenames)} is not stored; upload these files"
+            )
+
+    missing_files = {}
+    for file, (sha256, _) in zip(changed_files, changed_hashes):
+        if file is not None and sha256 not in existing_blobs:
+            missing_files.setdefault(sha256, file)
+
+    # upload the missing blobs to s3 bucket concurrently
+    semaphore = asyncio.Semaphore(max(1, settings.UPLOAD_CONCURRENCY))
+
+    async def upload_file(file: UploadFile, sha256: str):
+        async with semaphore:
+            return await file_storage_service.upload_file_to_storage(s3, file, blob_service.generate_blob_key(sha256))
+
+    results = await asyncio.gather(*[upload_file(file, sha256) for sha256, file in missing_files.items()], return_exceptions=True)
+    uploaded_blobs = dict(zip(missing_files, results))
+    new_stored_files = [result for result in results if not isinstance(result, BaseException)]
+
+    failures = [(entry.filename, uploaded_blobs[sha256]) for entry, (sha256, _) in zip(changed_entries, changed_hashes) if isinstance(uploaded_blobs.get(sha256), BaseException)]
+    if failures:
+        failed_filenames = ", ".join(filename for filename, _ in failures)
+        detail = f"Failed to upload {failed_filenames} to storage; no files were added to the collection"
+
+        kept_filenames = await discard_uploaded_blobs(db, s3, new_stored_files, changed_entries, changed_hashes)
+        if kept_filenames:
+            detail += f"; uploaded content of {', '.join(kept_filenames)} could not be removed"
+
+        status_code = next((exc.status_code for _, exc in failures if isinstance(exc, HTTPException)), status.HTTP_500_INTERNAL_SERVER_ERROR)
+        raise HTTPException(status_code=status_code, detail=detail) from failures[0][1]
+
+    stored_files = [
+        uploaded_blobs[sha256] if sha256 in uploaded_blobs
+        else StoredFile(key=blob_service.generate_blob_key(sha256), size=existing_blobs[sha256].size, sha256=sha256, etag=existing_blobs[sha256].etag)
+        for sha256, _ in changed_hashes
+    ]
+
+    # Dotfiles at the changed paths are replaced and give up their previous content
+    replaced_dotfiles = [
+        (existing_dotfiles[entry.path].filename, existing_dotfiles[entry.path].blob_sha256)
+        for entry in changed_entries
+        if entry.path in existing_dotfiles
+    ]
 
     try:
-        result = await dotfile_service.create_dotfiles_in_collection(db, collection_add.collection_id, collection_add.content)
+        # The version bump and the blob references are committed together with the dotfile records. Every blob gaining
+        # or losing a reference is locked at once, and references are added before the replaced ones are released,
+        # so re-uploaded content is kept
+        version = await bump_collection_version(db, collection_id)
+        await blob_service.lock_blobs(db, {stored_file.sha256 for stored_file in stored_files} | {blob_sha256 for _, blob_sha256 in replaced_dotfiles if blob_sha256})
+        ref_counts = await blob_service.add_blob_references(db, stored_files)
+        await restore_unreferenced_blobs(s3, ref_counts, changed_entries, changed_files, stored_files)
+        changed_dotfiles = await dotfile_service.create_dotfiles_in_collection(db, collection_id, changed_entries, stored_files)
+        released_storage = await release_dotfile_references(db, collection_id, replaced_dotfiles)
+        await db.commit()
     except Exception as exc:
         # Roll back so the session doesn't remain in a broken state
         await db.rollback()
+        await discard_uploaded_blobs(db, s3, new_stored_files, changed_entries, changed_hashes)
+        if isinstance(exc, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Failed to persist dotfiles: {exc}") from exc
 
-    return result
+    await delete_released_storage(db, s3, *released_storage)
+    await archive_cache_service.invalidate_collection_archives(s3, collection_id, version)
+
+    changed_by_path = {dotfile.path: dotfile for dotfile in changed_dotfiles}
+    return [changed_by_path.get(entry.path) or existing_dotfiles[entry.path] for entry in entries]
+
+# makes sure the content of blobs that only this request references is stored: such a blob may have lost its last
+# reference and its object may have been deleted after it was looked up or uploaded. Called with the blob rows locked;
+# blobs that other dotfiles reference, such as popular shared files, need no storage request
+async def restore_unreferenced_blobs(s3: S3Client, ref_counts: dict[str, int], entries: list, files: list[Optional[UploadFile]], stored_files: list[StoredFile]):
+    added_references = Counter(stored_file.sha256 for stored_file in stored_files)
+    unreferenced_files = {}
+    for entry, file, stored_file in zip(entries, files, stored_files):
+        if ref_counts.get(stored_file.sha256) == added_references[stored_file.sha256]:
+            unreferenced_files.setdefault(stored_file.sha256, (entry, file))
+
+    if not unreferenced_files:
+        return
+
+    stored = await asyncio.gather(*[file_storage_service.file_exists_in_storage(s3, blob_service.generate_blob_key(sha256)) for sha256 in unreferenced_files])
+    released_files = {sha256: entry_file for (sha256, entry_file), is_stored in zip(unreferenced_files.items(), stored) if not is_stored}
+    if not released_files:
+        return
+
+    unavailable_filenames = [entry.filename for entry, file in released_files.values() if file is None]
+    if unavailable_filenames:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Content of {', '.join(unavailable_filenames)} is not stored; upload these files"
+        )
+
+    await asyncio.gather(*[
+        file_storage_service.upload_file_to_storage(s3, file, blob_service.generate_blob_key(sha256))
+        for sha256, (_, file) in released_files.items()
+    ])
+
+# removes the blobs a failed request uploaded: they are recorded without references first, so that a request storing
+# the same content meanwhile keeps it, then deleted. Returns the filenames whose content could not be removed;
+# their blobs stay recorded and are reused by later uploads of the same content
+async def discard_uploaded_blobs(db: AsyncSession, s3: S3Client, stored_files: list[StoredFile], entries: list, hashes: list[tuple[str, Optional[int]]]) -> list[str]:
+    if not stored_files:
+        return []
+
+    uploaded_sha256s = {stored_file.sha256 for stored_file in stored_files}
+    uploaded_filenames = [entry.filename for entry, (sha256, _) in zip(entries, hashes) if sha256 in uploaded_sha256s]
+
+    try:
+        await blob_service.add_unreferenced_blobs(db, stored_files)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Failed to record uploaded blobs")
+        return uploaded_filenames
+
+    deleted = await delete_unreferenced_storage(db, s3, sorted(uploaded_sha256s))
+    return [] if deleted else uploaded_filenames
+
+# returns the pre-flight entries whose content must be uploaded: content that none of the collection owner's
+# files store yet. Shared blobs of other users are deliberately not offered, which would reveal whether they store a file
+async def get_required_uploads(db: AsyncSession, db_collection: Collection, entries: list[DotfilePreflight]) -> list[DotfilePreflight]:
+    owned_blobs = await blob_service.get_blobs_referenced_by_owner(db, db_collection.owner_id, {entry.sha256.lower() for entry in entries})
+
+    return [
+        entry for entry in entries
+        if entry.sha256.lower() not in owned_blobs or owned_blobs[entry.sha256.lower()].size != entry.size
+    ]
+
+# releases the references of deleted or replaced dotfiles, given as (filename, blob_sha256), and returns the storage
+# they gave up: the objects of dotfiles stored before blobs existed and the hashes of blobs that lost their last
+# reference. The caller commits, then deletes them with delete_released_storage
+async def release_dotfile_references(db: AsyncSession, collection_id: int, dotfiles: list[tuple[str, Optional[str]]]) -> tuple[list[str], list[str]]:
+    legacy_storage_filenames = [dotfile_service.generate_dotfile_name_in_collection(collection_id, filename) for filename, blob_sha256 in dotfiles if not blob_sha256]
+    released_sha256s = await blob_service.release_blob_references(db, [blob_sha256 for _, blob_sha256 in dotfiles])
+
+    return legacy_storage_filenames, released_sha256s
+
+# deletes the storage released by committed dotfile changes in one batch. Blobs are deleted only while still
+# unreferenced, and a failure is logged only: their rows stay recorded, so the content is reused or deleted later
+async def delete_released_storage(db: AsyncSession, s3: S3Client, legacy_storage_filenames: list[str], released_sha256s: list[str]):
+    await delete_unreferenced_storage(db, s3, released_sha256s, legacy_storage_filenames)
+
+# deletes the blobs among the given hashes that have no references, with their objects and any other given objects,
+# in one storage batch; only rows without references are locked meanwhile. Returns whether the storage was deleted
+async def delete_unreferenced_storage(db: AsyncSession, s3: S3Client, sha256s: list[str], storage_filenames: Optional[list[str]] = None) -> bool:
+    try:
+        blob_keys = await blob_service.delete_unreferenced_blobs(db, sha256s)
+        if storage_filenames or blob_keys:
+            await file_storage_service.delete_files_from_storage_by_filenames(s3, (storage_filenames or []) + blob_keys)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Failed to delete released storage")
+        return False
+
+    return True
 
 # retrieves dotfile from a collection
 async def get_dotfile_from_collection(db: AsyncSession, collection_id: int) -> list[Dotfile]:
@@ -99,48 +328,184 @@ async def get_dotfile_from_collection(db: AsyncSession, collection_id: int) -> l
 
     return result
 
-# retrieves dotfiles from a collection as a zip archive
-async def get_dotfiles_from_collection(db: AsyncSession, s3: S3Client, collection_read: CollectionContentRead) -> bytes:
+# strong entity tag of a representation of a collection's files; every change to the files bumps the version
+def get_collection_etag(collection: Collection, representation: str) -> str:
+    return make_strong_etag(f"c{collection.id}", f"v{collection.version}", representation)
+
+# writable sink that collects zip output until the response stream drains it
+class ZipStreamBuffer:
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# streams a zip archive of dotfiles; objects are opened concurrently within a bounded window
+# and their bodies copied in list order, in chunks, as soon as the next one in line has been opened.
+# Entries are stamped with modified_at (defaults to now), so archives of one collection version are byte-identical
+async def stream_dotfiles_as_zip(s3: S3Client, collection_id: int, db_dotfiles: list[Dotfile], concurrency: Optional[int] = None, modified_at: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    concurrency = max(1, concurrency or settings.ARCHIVE_FETCH_CONCURRENCY)
+    entry_date_time = (modified_at or datetime.now()).timetuple()[:6]
+    # Entries are named after the dotfiles; their content is read from wherever each one is stored
+    filenames = [dotfile_service.generate_dotfile_name_in_collection(collection_id, dotfile.filename) for dotfile in db_dotfiles]
+    storage_keys = [dotfile_service.get_dotfile_storage_key(collection_id, dotfile.filename, dotfile.blob_sha256) for dotfile in db_dotfiles]
+
+    buffer = ZipStreamBuffer()
+    pending: deque[asyncio.Task] = deque()
+    next_index = 0
+
+    try:
+        # The buffer is not seekable, so zipfile writes sizes in data descriptors after each entry
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, False) as zipper:
+            for filename in filenames:
+                # Keep at most `concurrency` requests in flight; only their open bodies are held, not their content
+                while len(pending) < concurrency and next_index < len(filenames):
+                    pending.append(asyncio.create_task(file_storage_service.retrieve_file_object_from_storage_by_filename(s3, storage_keys[next_index])))
+                    next_index += 1
+
+                storage_object = await pending.popleft()
+                codec = file_storage_service.get_storage_codec(storage_object)
+
+                entry_info = zipfile.ZipInfo(filename, date_time=entry_date_time)
+                entry_info.compress_type = zipfile.ZIP_DEFLATED
+                with zipper.open(entry_info, "w") as entry:
+                    async for chunk in file_storage_service.stream_file_body(storage_object["Body"], STREAM_CHUNK_SIZE, codec):
+                        entry.write(chunk)
+                        yield buffer.drain()
+
+                yield buffer.drain()
+
+        # central directory
+        yield buffer.drain()
+    finally:
+        # Stop outstanding requests if the archive failed or the client disconnected, and close the bodies already opened
+        for task in pending:
+            task.cancel()
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, dict):
+                result["Body"].close()
+
+# retrieves dotfiles from a collection as a streamed zip archive, served from the archive cache when this version was built before
+async def get_dotfiles_from_collection(db: AsyncSession, s3: S3Client, collection_read: CollectionContentRead, version: int, modified_at: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    cached_archive = await archive_cache_service.get_cached_archive(s3, collection_read.collection_id, version)
+    if cached_archive is not None:
+        return archive_cache_service.stream_cached_archive(cached_archive)
+
+    # Load the dotfile list up front so the stream itself only depends on s3
     db_dotfiles = await dotfile_service.get_dotfiles_by_collection_id(db, collection_read.collection_id)
+    zip_stream = stream_dotfiles_as_zip(s3, collection_read.collection_id, db_dotfiles, modified_at=modified_at)
+
+    return archive_cache_service.stream_and_cache_archive(s3, collection_read.collection_id, version, zip_stream)
+
+# compares the files a client has with a collection and returns the dotfiles added and changed since, in upload order,
+# and the paths that were deleted; dotfiles without a recorded hash always count as changed
+async def get_collection_changes(db: AsyncSession, collection_id: int, known_files: list[CollectionSyncFile]) -> tuple[list[Dotfile], list[Dotfile], list[str]]:
+    known_hashes = {known_file.path: known_file.sha256.lower() for known_file in known_files}
+    db_dotfiles = await dotfile_service.get_dotfiles_by_collection_id(db, collection_id)
 
-    zip_buffer = io.BytesIO()
+    added = [dotfile for dotfile in db_dotfiles if dotfile.path not in known_hashes]
+    changed = [dotfile for dotfile in db_dotfiles if dotfile.path in known_hashes and (not dotfile.sha256 or dotfile.sha256 != known_hashes[dotfile.path])]
 
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zipper:
-        for dotfile in db_dotfiles:
-            filename = dotfile_service.generate_dotfile_name_in_collection(collection_read.collection_id, dotfile.filename)
-            file = await file_storage_service.retrieve_file_from_storage_by_filename(s3, filename)
+    current_paths = {dotfile.path for dotfile in db_dotfiles}
+    deleted = [path for path in known_hashes if path not in current_paths]
 
-            content = await file.read()
-            zipper.writestr(filename, content)
+    return added, changed, deleted
 
-    return zip_buffer.getvalue()
+# retrieves only the dotfiles added or changed since the client's files as a streamed zip archive, or None if there are none;
+# the archive depends on the client's files, so it is never cached
+async def get_changed_dotfiles_from_collection(db: AsyncSession, s3: S3Client, collection_id: int, known_files: list[CollectionSyncFile], modified_at: Optional[datetime] = None) -> Optional[AsyncIterator[bytes]]:
+    added, changed, _ = await get_collection_changes(db, collection_id, known_files)
+    db_dotfiles = sorted(added + changed, key=lambda dotfile: dotfile.id)
+    if not db_dotfiles:
+        return None
+
+    return stream_dotfiles_as_zip(s3, collection_id, db_dotfiles, modified_at=modified_at)
+
+# returns a presigned storage URL for the archive of a collection version, building and storing the archive first if needed
+async def get_presigned_archive_url(db: AsyncSession, s3: S3Client, collection_read: CollectionContentRead, version: int, modified_at: Optional[datetime] = None) -> str:
+    collection_id = collection_read.collection_id
+
+    async def build_archive() -> AsyncIterator[bytes]:
+        db_dotfiles = await dotfile_service.get_dotfiles_by_collection_id(db, collection_id)
+        async for chunk in stream_dotfiles_as_zip(s3, collection_id, db_dotfiles, modified_at=modified_at):
+            yield chunk
+
+    archive_name = await archive_cache_service.store_archive(s3, collection_id, version, build_archive)
+
+    return await file_storage_service.generate_presigned_download_url(s3, archive_name, "files.zip")
+
+# returns a presigned storage URL for one dotfile of a collection
+async def get_presigned_dotfile_url(s3: S3Client, collection_id: int, dotfile: Dotfile) -> str:
+    storage_filename = dotfile_service.get_dotfile_storage_key(collection_id, dotfile.filename, dotfile.blob_sha256)
+
+    return await file_storage_service.generate_presigned_download_url(s3, storage_filename, dotfile.filename)
+
+# opens the stored content of one dotfile, or the part selected by an HTTP Range header value.
+# Ranges of an object compressed at rest don't address its content, so the whole object is opened instead
+async def get_dotfile_content_from_collection(s3: S3Client, collection_id: int, dotfile: Dotfile, byte_range: Optional[str] = None) -> dict:
+    storage_filename = dotfile_service.get_dotfile_storage_key(collection_id, dotfile.filename, dotfile.blob_sha256)
+
+    storage_object = await file_storage_service.retrieve_file_object_from_storage_by_filename(s3, storage_filename, byte_range)
+    if byte_range and file_storage_service.get_storage_codec(storage_object):
+        storage_object["Body"].close()
+        storage_object = await file_storage_service.retrieve_file_object_from_storage_by_filename(s3, storage_filename)
+
+    return storage_object
 
 # deletes a dotfile from a collection - both from s3 and db
 async def delete_from_collection(db: AsyncSession, s3: S3Client, collection_id: int, filename: str):
-    deleted_filename = dotfile_service.generate_dotfile_name_in_collection(collection_id, filename)
-    
-    await file_storage_service.delete_file_from_storage_by_filename(s3, deleted_filename)
     # DB stores the original filename (not the storage key), so delete by original filename
-    await dotfile_service.delete_dotfile(db, collection_id, filename)
+    # The version bump is committed together with the deletion
+    version = await bump_collection_version(db, collection_id)
+    deleted_dotfile = await dotfile_service.delete_dotfile(db, collection_id, filename)
+
+    try:
+        released_storage = await release_dotfile_references(db, collection_id, [deleted_dotfile] if deleted_dotfile else [])
+    except Exception:
+        await db.rollback()
+        raise
+
+    await db.commit()
+
+    await delete_released_storage(db, s3, *released_storage)
+
+    await archive_cache_service.invalidate_collection_archives(s3, collection_id, version)
 
     return
 
 # deletes an entire collection - both from s3 and db
 async def delete_collection(db: AsyncSession, s3: S3Client, collection_id: int):
-    db_dotfiles = await dotfile_service.get_dotfiles_by_collection_id(db, collection_id)
+    # Delete the collection and its dotfile records in one transaction (the collection is
+    # already in the session's identity map when loaded by a dependency)
+    deleted_dotfiles = await dotfile_service.delete_dotfiles_by_collection_id(db, collection_id)
+    db_collection = await db.get(Collection, collection_id)
 
-    for dotfile in db_dotfiles:
-        deleted_filename = dotfile_service.generate_dotfile_name_in_collection(collection_id, dotfile.filename)
-        await file_storage_service.delete_file_from_storage_by_filename(s3, deleted_filename)
-        # Delete DB record by the original filename field
-        await dotfile_service.delete_dotfile(db, collection_id, dotfile.filename)
-
-    # Delete the collection from the database
-    db_collection = (await db.execute(select(Collection).filter(Collection.id == collection_id))).scalars().first()
-    
     if db_collection:
         await db.delete(db_collection)
-        await db.commit()
+        await db.flush()
+
+    # The stored files are deleted once the records are, so that blob rows are not locked during the storage request
+    try:
+        released_storage = await release_dotfile_references(db, collection_id, deleted_dotfiles)
+    except Exception:
+        await db.rollback()
+        raise
+
+    await db.commit()
+
+    await delete_released_storage(db, s3, *released_storage)
+
+    if db_collection:
+        await archive_cache_service.invalidate_collection_archives(s3, collection_id, None)
 
     return
     
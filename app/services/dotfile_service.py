@@ -1,27 +1,48 @@
 # app/services/dotfile_service.py
+from typing import Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_
+from sqlalchemy import and_, delete
 
+from app.core.etag import make_strong_etag
 from app.models.dotfiles import Dotfile
 from app.schemas.dotfiles import DotfileCreate
+from app.schemas.storage import StoredFile
+from app.services.blob_service import generate_blob_key
 
 # renames a dotfile to include its collection id as a prefix
 def generate_dotfile_name_in_collection(collection_id: int, filename: str):
     return f"c{collection_id}/{filename}"
 
-# retrieves all dotfiles with a collection id
+# storage key of a dotfile's content: its blob, or the per-collection object of dotfiles uploaded before blobs existed
+def get_dotfile_storage_key(collection_id: int, filename: str, blob_sha256: Optional[str]) -> str:
+    if blob_sha256:
+        return generate_blob_key(blob_sha256)
+    return generate_dotfile_name_in_collection(collection_id, filename)
+
+# strong entity tag of a dotfile's content; dotfiles uploaded before hashes were recorded have none
+def get_dotfile_etag(dotfile: Dotfile) -> Optional[str]:
+    return make_strong_etag(dotfile.sha256) if dotfile.sha256 else None
+
+# retrieves all dotfiles with a collection id, in upload order
 async def get_dotfiles_by_collection_id(db: AsyncSession, collection_id: int) -> list[Dotfile]:
-    result = await db.execute(select(Dotfile).filter(Dotfile.collection_id == collection_id))
+    result = await db.execute(select(Dotfile).filter(Dotfile.collection_id == collection_id).order_by(Dotfile.id))
     return result.scalars().all()
 
-# retrieve a dotfile with a filename and collection id
-async def get_dotfile_by_filename_in_collection(db: AsyncSession, collection_id: int, filename: str) -> Dotfile:
-    result = await db.execute(select(Dotfile).filter(and_(Dotfile.collection_id == collection_id, Dotfile.filename == filename)))
+# retrieve the dotfiles with a filename and collection id, in upload order; dotfiles at different paths can share a filename,
+# so a path selects one of them
+async def get_dotfile_by_filename_in_collection(db: AsyncSession, collection_id: int, filename: str, path: Optional[str] = None) -> Dotfile:
+    query = select(Dotfile).filter(and_(Dotfile.collection_id == collection_id, Dotfile.filename == filename))
+    if path is not None:
+        query = query.filter(Dotfile.path == path)
+
+    result = await db.execute(query.order_by(Dotfile.id))
     return result.scalars().all()
 
-# creates dotfile records in the dotfile table 
-async def create_dotfiles_in_collection(db: AsyncSession, collection_id:int, dotfiles : list[DotfileCreate]) -> list[Dotfile]:
+# creates dotfile records in the dotfile table; stored_files (in the same order as dotfiles) records the blob of each one.
+# Caller commits
+async def create_dotfiles_in_collection(db: AsyncSession, collection_id:int, dotfiles : list[DotfileCreate], stored_files: Optional[list[StoredFile]] = None) -> list[Dotfile]:
     if not dotfiles:
         return []
 
@@ -36,26 +57,39 @@ async def create_dotfiles_in_collection(db: AsyncSession, collection_id:int, dot
 
     persisted_dotfiles: list[Dotfile] = []
 
-    for dotfile in dotfiles:
+    for index, dotfile in enumerate(dotfiles):
         if dotfile.path in existing_map:
             db_dotfile = existing_map[dotfile.path]
             db_dotfile.filename = dotfile.filename
         else:
             db_dotfile = Dotfile(collection_id=collection_id, path=dotfile.path, filename=dotfile.filename)
             db.add(db_dotfile)
-        persisted_dotfiles.append(db_dotfile)
 
-    await db.commit()
+        if stored_files is not None:
+            stored_file = stored_files[index]
+            db_dotfile.sha256 = stored_file.sha256
+            db_dotfile.size = stored_file.size
+            db_dotfile.etag = stored_file.etag
+            db_dotfile.blob_sha256 = stored_file.sha256
 
-    for db_dotfile in persisted_dotfiles:
-        await db.refresh(db_dotfile)
+        persisted_dotfiles.append(db_dotfile)
+
+    await db.flush()
 
     return persisted_dotfiles
 
-# deletes a dotfile record from the dotfile table
-async def delete_dotfile(db: AsyncSession, collection_id: int, filename: str):
+# deletes a dotfile record from the dotfile table and returns its (filename, blob_sha256); caller commits
+async def delete_dotfile(db: AsyncSession, collection_id: int, filename: str) -> Optional[tuple[str, Optional[str]]]:
     db_dotfile = (await db.execute(select(Dotfile).filter(and_(Dotfile.collection_id == collection_id, Dotfile.filename == filename)))).scalars().first()
-    if db_dotfile:
-        await db.delete(db_dotfile)
-        await db.commit()
-    return
\ No newline at end of file
+    if not db_dotfile:
+        return None
+
+    deleted_dotfile = (db_dotfile.filename, db_dotfile.blob_sha256)
+    await db.delete(db_dotfile)
+    await db.flush()
+    return deleted_dotfile
+
+# deletes all dotfile records of a collection in a single statement and returns their (filename, blob_sha256); caller commits
+async def delete_dotfiles_by_collection_id(db: AsyncSession, collection_id: int) -> list[tuple[str, Optional[str]]]:
+    result = await db.execute(delete(Dotfile).where(Dotfile.collection_id == collection_id).returning(Dotfile.filename, Dotfile.blob_sha256))
+    return [(filename, blob_sha256) for filename, blob_sha256 in result.all()]
@@ -1,50 +1,275 @@
 # app/services/file_storage_service.py
+from collections.abc import AsyncIterator, Awaitable, Callable
+from aiobotocore.response import StreamingBody
 from aiobotocore.session import ClientCreatorContext as S3Client
-from fastapi import UploadFile, HTTPException
+from fastapi import UploadFile, HTTPException, status
 import asyncio
+import hashlib
+from typing import Optional
+import zlib
 import botocore
+from app.core.settings import settings
 from app.s3.s3_bucket import BUCKET_NAME
+from app.schemas.storage import StoredFile
 
-# uploads a file to S3 bucket
-async def upload_file_to_storage(s3 : S3Client, file : UploadFile):
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024 # S3 rejects smaller parts except for the last one
+MAX_DELETE_BATCH_SIZE = 1000 # S3 DeleteObjects accepts at most 1000 keys per request
+STREAM_CHUNK_SIZE = 64 * 1024
+STORAGE_CODEC_METADATA_KEY = "codec" # object metadata naming the codec content was compressed with at rest
+
+# zstandard is only needed when the zstd codec is used
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise HTTPException(status_code=500, detail="Storage codec zstd requires the zstandard package") from exc
+
+    return zstandard
+
+# creates an incremental compressor for a storage codec; both codecs offer compress(data) and flush()
+def _create_compressor(codec : str):
+    if codec == "gzip":
+        return zlib.compressobj(settings.STORAGE_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _import_zstandard().ZstdCompressor(level=settings.STORAGE_COMPRESSION_LEVEL).compressobj()
+
+# creates an incremental decompressor for a storage codec; both codecs offer decompress(data) and flush()
+def _create_decompressor(codec : str):
+    if codec == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if codec == "zstd":
+        return _import_zstandard().ZstdDecompressor().decompressobj()
+    raise HTTPException(status_code=500, detail=f"Unknown storage codec {codec}")
+
+# the codec an object was compressed with at rest, or None for objects stored as is
+def get_storage_codec(storage_object : dict) -> Optional[str]:
+    return storage_object.get("Metadata", {}).get(STORAGE_CODEC_METADATA_KEY)
+
+# uploads a file to S3 bucket in parts, computing its size and sha256 in the same pass;
+# files above the multipart threshold are sent with a multipart upload so memory stays bounded by the part size
+async def upload_file_to_storage(s3 : S3Client, file : UploadFile, filename : Optional[str] = None) -> StoredFile:
     if not file:
         raise HTTPException(status_code=400, detail="Uploaded file does not exist")
 
-    file_contents = await file.read()
-    if file_contents is None:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    # Store under the given filename, or the uploaded file's own name, compressed with the configured codec
+    if settings.STORAGE_COMPRESSION == "none":
+        stored_file = await _upload_parts_to_storage(s3, filename or file.filename, file.read)
+    else:
+        stored_file = await _upload_compressed_to_storage(s3, filename or file.filename, file.read, settings.STORAGE_COMPRESSION)
 
-    try:
-        result = await asyncio.wait_for(
-            s3.put_object(Body=file_contents, Bucket=BUCKET_NAME, Key=file.filename),
-            timeout=30.0
-        )
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail=f"Storage upload timeout for {file.filename}")
     # Reset pointer so the caller can re-read the file if needed
     await file.seek(0)
 
-    return result  
+    return stored_file
+
+# uploads a stream of chunks (e.g. an archive being built) to S3 bucket in parts without holding it in memory
+async def upload_stream_to_storage(s3 : S3Client, filename : str, chunks : AsyncIterator[bytes]) -> StoredFile:
+    return await _upload_parts_to_storage(s3, filename, _read_exactly(chunks))
+
+# uploads content compressed while it is read; the object records its codec in its metadata and as its Content-Encoding,
+# so HTTP clients of presigned URLs decode it. The returned size and sha256 are those of the uncompressed content
+async def _upload_compressed_to_storage(s3 : S3Client, filename : str, read : Callable[[int], Awaitable[bytes]], codec : str) -> StoredFile:
+    compressor = _create_compressor(codec)
+    hasher = hashlib.sha256()
+    size = 0
+
+    async def compressed_chunks() -> AsyncIterator[bytes]:
+        nonlocal size
+        while chunk := await read(STREAM_CHUNK_SIZE):
+            hasher.update(chunk)
+            size += len(chunk)
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+    object_arguments = {"Metadata": {STORAGE_CODEC_METADATA_KEY: codec}, "ContentEncoding": codec}
+    stored_file = await _upload_parts_to_storage(s3, filename, _read_exactly(compressed_chunks()), object_arguments)
+
+    return stored_file.model_copy(update={"size": size, "sha256": hasher.hexdigest()})
+
+# adapts a stream of chunks to a read that hands out exactly `size` bytes per call (fewer only at the end), like a file's read
+def _read_exactly(chunks : AsyncIterator[bytes]) -> Callable[[int], Awaitable[bytes]]:
+    buffer = bytearray()
+    exhausted = False
+
+    async def read(size : int) -> bytes:
+        nonlocal exhausted
+        while len(buffer) < size and not exhausted:
+            try:
+                buffer.extend(await chunks.__anext__())
+            except StopAsyncIteration:
+                exhausted = True
+
+        part = bytes(buffer[:size])
+        del buffer[:size]
+        return part
+
+    return read
+
+# uploads whatever `read` returns under filename: a single put at or below the multipart threshold, a multipart upload above it;
+# object_arguments (e.g. Metadata) are applied to the stored object
+async def _upload_parts_to_storage(s3 : S3Client, filename : str, read : Callable[[int], Awaitable[bytes]], object_arguments : Optional[dict] = None) -> StoredFile:
+    object_arguments = object_arguments or {}
+    part_size = max(settings.STORAGE_UPLOAD_PART_SIZE, MIN_MULTIPART_PART_SIZE)
+    hasher = hashlib.sha256()
+    size = 0
+
+    part = await read(part_size)
+    next_part = await read(part_size) if part else b""
+
+    hasher.update(part)
+    size += len(part)
+
+    if not next_part and size <= settings.STORAGE_MULTIPART_THRESHOLD:
+        result = await _wait_for_storage(s3.put_object(Body=part, Bucket=BUCKET_NAME, Key=filename, **object_arguments), filename)
+        etag = result["ETag"]
+    else:
+        upload = await _wait_for_storage(s3.create_multipart_upload(Bucket=BUCKET_NAME, Key=filename, **object_arguments), filename)
+        upload_id = upload["UploadId"]
+        completed_parts = []
+
+        try:
+            part_number = 1
+            while part:
+                result = await _wait_for_storage(
+                    s3.upload_part(Body=part, Bucket=BUCKET_NAME, Key=filename, UploadId=upload_id, PartNumber=part_number),
+                    filename
+                )
+                completed_parts.append({"ETag": result["ETag"], "PartNumber": part_number})
+
+                part, next_part = next_part, (await read(part_size) if next_part else b"")
+                hasher.update(part)
+                size += len(part)
+                part_number += 1
+
+            result = await _wait_for_storage(
+                s3.complete_multipart_upload(Bucket=BUCKET_NAME, Key=filename, UploadId=upload_id, MultipartUpload={"Parts": completed_parts}),
+                filename
+            )
+            etag = result["ETag"]
+        except Exception:
+            # Don't leave orphaned parts behind in the bucket
+            await s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=filename, UploadId=upload_id)
+            raise
+
+    return StoredFile(key=filename, size=size, sha256=hasher.hexdigest(), etag=etag.strip('"'))
+
+# waits for a storage call, translating timeouts into a 504
+async def _wait_for_storage(operation, filename : str, timeout : float = 30.0):
+    try:
+        return await asyncio.wait_for(operation, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Storage upload timeout for {filename}")
+
+# uploads raw content to S3 bucket under a filename
+async def upload_content_to_storage(s3 : S3Client, filename : str, content : bytes):
+    result = await _wait_for_storage(s3.put_object(Body=content, Bucket=BUCKET_NAME, Key=filename), filename)
+
+    return result
 
 # retrieves a file from S3 bucket by filename
 async def retrieve_file_from_storage_by_filename(s3 : S3Client, filename : str):
+    result = await retrieve_file_object_from_storage_by_filename(s3, filename)
+
+    return result["Body"]
+
+# retrieves an object from S3 bucket by filename, or the part selected by an HTTP Range header value;
+# the caller streams and closes the body
+async def retrieve_file_object_from_storage_by_filename(s3 : S3Client, filename : str, byte_range : Optional[str] = None) -> dict:
+    get_object_arguments = {"Bucket": BUCKET_NAME, "Key": filename}
+    if byte_range:
+        get_object_arguments["Range"] = byte_range
+
     try:
-        result = await s3.get_object(Bucket=BUCKET_NAME, Key=filename)
+        result = await s3.get_object(**get_object_arguments)
     except botocore.exceptions.ClientError as exc:
         # Translate S3 NoSuchKey into a 404 HTTP response for callers
         error_code = exc.response.get("Error", {}).get("Code")
         if error_code == "NoSuchKey":
             raise HTTPException(status_code=404, detail=f"File {filename} not found") from exc
+        if error_code == "InvalidRange":
+            raise HTTPException(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, detail=f"Range {byte_range} not satisfiable for file {filename}") from exc
         # re-raise other client errors as 500
         raise HTTPException(status_code=500, detail=f"Storage error: {exc}") from exc
 
     if not result:
         raise HTTPException(status_code=404, detail=f"File {filename} not found")
 
-    return result["Body"]
+    return result
+
+# checks whether an object exists in S3 bucket without downloading it
+async def file_exists_in_storage(s3 : S3Client, filename : str) -> bool:
+    try:
+        await s3.head_object(Bucket=BUCKET_NAME, Key=filename)
+    except botocore.exceptions.ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise HTTPException(status_code=500, detail=f"Storage error: {exc}") from exc
+
+    return True
+
+# creates a short-lived URL through which a client downloads an object directly from storage
+async def generate_presigned_download_url(s3 : S3Client, filename : str, download_name : str) -> str:
+    return await s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": BUCKET_NAME, "Key": filename, "ResponseContentDisposition": f'attachment; filename="{download_name}"'},
+        ExpiresIn=settings.PRESIGNED_URL_EXPIRES_SECONDS,
+    )
+
+# streams an object body in chunks, decompressed when a codec is given, and closes it once the stream ends or is abandoned
+async def stream_file_body(body : StreamingBody, chunk_size : int = STREAM_CHUNK_SIZE, codec : Optional[str] = None) -> AsyncIterator[bytes]:
+    decompressor = _create_decompressor(codec) if codec else None
+
+    async with body:
+        async for chunk in body.iter_chunks(chunk_size):
+            if decompressor is None:
+                yield chunk
+            elif content := decompressor.decompress(chunk):
+                yield content
+
+    if decompressor is not None and (content := decompressor.flush()):
+        yield content
+
+# retrieves the full content of a file from S3 bucket by filename, decompressed if it was compressed at rest
+async def retrieve_file_content_from_storage_by_filename(s3 : S3Client, filename : str) -> bytes:
+    storage_object = await retrieve_file_object_from_storage_by_filename(s3, filename)
+    codec = get_storage_codec(storage_object)
+
+    async with storage_object["Body"] as file:
+        content = await file.read()
+
+    if codec:
+        decompressor = _create_decompressor(codec)
+        content = decompressor.decompress(content) + decompressor.flush()
+
+    return content
+
+# lists the keys of the objects in S3 bucket whose key starts with a prefix
+async def list_files_in_storage_by_prefix(s3 : S3Client, prefix : str) -> list[str]:
+    paginator = s3.get_paginator("list_objects_v2")
+
+    filenames = []
+    async for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        filenames.extend(storage_object["Key"] for storage_object in page.get("Contents", []))
+
+    return filenames
 
 # deletes a file from S3 bucket by filename
 async def delete_file_from_storage_by_filename(s3 : S3Client, filename : str):
     result = await s3.delete_object(Bucket=BUCKET_NAME, Key=filename)
     
-    return result
\ No newline at end of file
+    return result
+
+# deletes files from S3 bucket by filename, in DeleteObjects batches
+async def delete_files_from_storage_by_filenames(s3 : S3Client, filenames : list[str]):
+    batches = [filenames[index:index + MAX_DELETE_BATCH_SIZE] for index in range(0, len(filenames), MAX_DELETE_BATCH_SIZE)]
+
+    results = await asyncio.gather(*[
+        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": filename} for filename in batch], "Quiet": True})
+        for batch in batches
+    ])
+
+    errors = [error for result in results for error in result.get("Errors", [])]
+    if errors:
+        failed_filenames = ", ".join(error["Key"] for error in errors)
+        raise HTTPException(status_code=500, detail=f"Storage error: failed to delete {failed_filenames}")
+
+    return results
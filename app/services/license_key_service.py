@@ -1,11 +1,13 @@
 # app/services/license_key_service.py
-from datetime import date, timedelta
+from datetime import datetime
 import secrets
 import string
 from typing import Optional
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.pagination import CountMode, get_page, get_total_count, paginate_by_keyset
 from app.core.settings import settings
 from app.models.license_keys import LicenseKey
 from app.schemas.license_key import LicenseKeyOutput
@@ -20,24 +22,50 @@ def generate_key_string() -> str:
 
     return '-'.join(groups)
 
-# Creates multiple license keys and stores them in the database
+# Keys are inserted in batches so that one statement stays well below the bind parameter limits
+MAX_KEYS_PER_INSERT = 1000
+# Collisions are rare (36^16 possible keys), so a few rounds of regeneration are always enough in practice
+MAX_KEY_GENERATION_ATTEMPTS = 5
+
+# Inserts the given key strings, skipping the ones that already exist, and returns the inserted ones
+async def insert_new_key_strings(db: AsyncSession, key_strings: list[str]) -> list[str]:
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    inserted = []
+
+    for start in range(0, len(key_strings), MAX_KEYS_PER_INSERT):
+        batch = key_strings[start:start + MAX_KEYS_PER_INSERT]
+        statement = (
+            dialect_insert(LicenseKey)
+            .values([{"key_string": key_string} for key_string in batch])
+            .on_conflict_do_nothing(index_elements=[LicenseKey.key_string])
+            .returning(LicenseKey.key_string)
+        )
+        inserted.extend((await db.execute(statement)).scalars().all())
+
+    return inserted
+
+# Creates multiple license keys and stores them in the database, regenerating only the keys that collided
 async def create_keys(db: AsyncSession, num_keys: int) -> list[str]:
     keys = []
-    db_objs = []
 
-    for _ in range(num_keys):
-        key_str = generate_key_string()
-        keys.append(key_str)  # Append plain string
+    for _ in range(MAX_KEY_GENERATION_ATTEMPTS):
+        missing = num_keys - len(keys)
+        if missing == 0:
+            break
 
-        db_obj = LicenseKey(key_string=key_str)
-        db.add(db_obj)
-        db_objs.append(db_obj)
+        # a dict drops duplicates within the batch while keeping the generation order
+        candidates = {}
+        while len(candidates) < missing:
+            candidates[generate_key_string()] = None
 
-    if db_objs:
-        await db.commit()
+        keys.extend(await insert_new_key_strings(db, list(candidates)))
 
-        for obj in db_objs:
-            await db.refresh(obj)
+    if len(keys) < num_keys:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to generate unique license keys")
+
+    if keys:
+        await db.commit()
 
     return keys
 
@@ -55,27 +83,41 @@ async def get_license_key_by_id(db: AsyncSession, key_id: str) -> Optional[Licen
     )
     return result.scalars().first()
 
-async def get_all_license_key(db: AsyncSession) -> list[LicenseKeyOutput]:
-    result = await db.execute(select(LicenseKey))
-    license_keys = result.scalars().all()
+# Get one page of license keys in id order matching the given filters, the next page cursor and the total count
+async def get_license_keys(
+    db: AsyncSession,
+    limit: int = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    is_used: Optional[bool] = None,
+    activated_by_user_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    count_mode: CountMode = "none"
+) -> tuple[list[LicenseKeyOutput], Optional[str], Optional[int], CountMode]:
+    # Only the listed columns are loaded, no ORM objects are built
+    query = select(LicenseKey.id, LicenseKey.key_string, LicenseKey.is_used, LicenseKey.activated_by_user_id)
+    if is_used is not None:
+        query = query.filter(LicenseKey.is_used == is_used)
+    if activated_by_user_id is not None:
+        query = query.filter(LicenseKey.activated_by_user_id == activated_by_user_id)
+    if created_after is not None:
+        query = query.filter(LicenseKey.created_at >= created_after)
+    if created_before is not None:
+        query = query.filter(LicenseKey.created_at < created_before)
+
+    total_count, count_mode = await get_total_count(db, query, count_mode)
 
-    return [
+    columns = [LicenseKey.id]
+    result = await db.execute(paginate_by_keyset(query, columns, False, "id", cursor, limit))
+    rows, next_cursor = get_page(result.all(), columns, "id", limit)
+
+    license_keys = [
         LicenseKeyOutput(
-            id=license_key.id,
-            key_string=license_key.key_string,
-            is_active=not license_key.is_used,
-            assigned_to_user_id=license_key.activated_by_user_id,
+            id=row.id,
+            key_string=row.key_string,
+            is_active=not row.is_used,
+            assigned_to_user_id=row.activated_by_user_id,
         )
-        for license_key in license_keys
+        for row in rows
     ]
-
-# Refresh retrieval period
-async def refresh_retrieval_period(db: AsyncSession, user):
-    period_end_date = user.retrieval_period_start_date + timedelta(days=settings.RETRIEVAL_PERIOD_DAYS)
-    if date.today() > period_end_date:
-        user.monthly_retrieval_count = 0
-        user.retrieval_period_start_date = date.today()
-        await db.commit()
-        await db.refresh(user)
-    return
-    
+    return license_keys, next_cursor, total_count, count_mode
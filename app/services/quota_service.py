@@ -0,0 +1,117 @@
+# app/services/quota_service.py
+import asyncio
+import logging
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, case, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.quota import InMemoryRetrievalCounterStore
+from app.core.settings import settings
+from app.db.database import AsyncSessionLocal
+from app.models.users import User
+from app.schemas.users import AuthenticatedUser
+from app.services import user_service
+
+logger = logging.getLogger(__name__)
+
+# per-worker retrieval counters used by the "memory" quota engine
+retrieval_counter_store = InMemoryRetrievalCounterStore()
+
+# sessions of the flushes triggered by requests, separate from the request's own session
+retrieval_count_session_maker: async_sessionmaker = AsyncSessionLocal
+
+# adds the flushed increments to the stored counts; a stored period older than the flushed one is restarted first
+users_table = User.__table__
+flush_retrieval_counts_statement = (
+    update(users_table)
+    .where(users_table.c.id == bindparam("b_user_id"))
+    .values(
+        monthly_retrieval_count=case(
+            (or_(users_table.c.retrieval_period_start_date.is_(None), users_table.c.retrieval_period_start_date < bindparam("b_period_start")), bindparam("b_pending")),
+            else_=users_table.c.monthly_retrieval_count + bindparam("b_pending"),
+        ),
+        retrieval_period_start_date=case(
+            (or_(users_table.c.retrieval_period_start_date.is_(None), users_table.c.retrieval_period_start_date < bindparam("b_period_start")), bindparam("b_period_start")),
+            else_=users_table.c.retrieval_period_start_date,
+        ),
+    )
+)
+
+# counts one free-tier retrieval; returns the new count, or None if the limit is reached
+async def consume_retrieval(db: AsyncSession, user_id: int) -> Optional[int]:
+    if settings.QUOTA_ENGINE == "database":
+        return await user_service.consume_retrieval(db, user_id)
+
+    # the database is only read the first time a user is seen since the last flush
+    if not await retrieval_counter_store.is_loaded(user_id):
+        result = await db.execute(select(User.monthly_retrieval_count, User.retrieval_period_start_date).filter(User.id == user_id))
+        row = result.first()
+        if row is None:
+            return None
+        await retrieval_counter_store.load(user_id, row.monthly_retrieval_count, row.retrieval_period_start_date)
+
+    retrieval_count = await retrieval_counter_store.try_increment(
+        user_id, settings.FREE_TIER_RETRIEVAL_LIMIT, date.today(), settings.RETRIEVAL_PERIOD_DAYS
+    )
+
+    # bursts flush early so that at most QUOTA_FLUSH_MAX_PENDING increments can be lost on a crash; the flush commits
+    # on its own, so neither a rollback of this request nor its duration affects the other users' counts
+    if retrieval_count is not None and await retrieval_counter_store.pending_total() >= settings.QUOTA_FLUSH_MAX_PENDING:
+        try:
+            await flush_retrieval_counts_in_session(retrieval_count_session_maker)
+        except Exception:
+            # the increments were restored and are written by the next flush
+            logger.exception("Failed to flush retrieval counts")
+
+    return retrieval_count
+
+# counts a retrieval of a free-tier user and rejects it with 429 once the limit is reached; other tiers are unlimited
+async def enforce_retrieval_quota(db: AsyncSession, user: AuthenticatedUser):
+    if user.account_tier != "free":
+        return
+
+    retrieval_count = await consume_retrieval(db, user.id)
+    if retrieval_count is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"You have exceeded your monthly limit of {settings.FREE_TIER_RETRIEVAL_LIMIT} retrievals. Please upgrade to a Pro account for unlimited access."
+        )
+
+# takes back a counted retrieval that could not be served (the database engine relies on the rollback instead)
+async def refund_retrieval(user_id: int):
+    if settings.QUOTA_ENGINE == "memory":
+        await retrieval_counter_store.decrement(user_id)
+
+# writes the pending increments of every user in one batched UPDATE in a session of its own and commits it.
+# Counters are only dropped once their counts are committed; if the flush fails, the increments are put back
+async def flush_retrieval_counts_in_session(session_maker: async_sessionmaker) -> int:
+    pending = await retrieval_counter_store.take_pending()
+    if not pending:
+        return 0
+
+    try:
+        async with session_maker() as db:
+            await db.execute(flush_retrieval_counts_statement, [
+                {"b_user_id": user_id, "b_pending": increments, "b_period_start": period_start}
+                for user_id, increments, period_start in pending
+            ])
+            await db.commit()
+    except Exception:
+        await retrieval_counter_store.restore_pending(pending)
+        raise
+
+    await retrieval_counter_store.discard_flushed(pending)
+    return len(pending)
+
+# background task started by the app lifespan for the "memory" engine; bounds crash loss to one interval
+async def run_retrieval_count_flusher(session_maker: async_sessionmaker):
+    while True:
+        await asyncio.sleep(settings.QUOTA_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_retrieval_counts_in_session(session_maker)
+        except Exception:
+            # the increments were restored and are written by the next flush
+            logger.exception("Failed to flush retrieval counts")
@@ -1,19 +1,76 @@
 # app/services/user_service.py
 import asyncio
+from datetime import date, timedelta
 from typing import Optional
 
+from sqlalchemy import case, or_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.models.users import User
 from app.models.license_keys import LicenseKey
 
-from app.schemas.users import UserCreate
+from app.schemas.users import UserCreate, AuthenticatedUser
+from app.core.cache import TTLCache
+from app.core.pagination import CountMode, get_page, get_total_count, paginate_by_keyset
 from app.core.security import get_pwd_hash
+from app.core.settings import settings
 
-async def get_users(db: AsyncSession) -> Optional[list[User]]:
-    result = await db.execute(select(User))
-    return result.scalars().all()
+# snapshots of authenticated users keyed by user id
+authenticated_user_cache = TTLCache(max_size=settings.USER_CACHE_MAX_SIZE, ttl_seconds=settings.USER_CACHE_TTL_SECONDS)
+
+def get_cached_user(user_id: int) -> Optional[AuthenticatedUser]:
+    return authenticated_user_cache.get(user_id)
+
+def cache_user(user: User) -> AuthenticatedUser:
+    snapshot = AuthenticatedUser.model_validate(user)
+    authenticated_user_cache.set(snapshot.id, snapshot)
+    return snapshot
+
+# must be called whenever a user's tier changes or the user is deleted
+def invalidate_cached_user(user_id: int):
+    authenticated_user_cache.invalidate(user_id)
+
+# returns one page of users in id order, the next page cursor and the total count requested by count_mode
+async def get_users(
+    db: AsyncSession,
+    limit: int = settings.PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    account_tier: Optional[str] = None,
+    count_mode: CountMode = "none"
+) -> tuple[list[User], Optional[str], Optional[int], CountMode]:
+    query = select(User)
+    if account_tier:
+        query = query.filter(User.account_tier == account_tier)
+
+    total_count, count_mode = await get_total_count(db, query, count_mode)
+
+    columns = [User.id]
+    result = await db.execute(paginate_by_keyset(query, columns, False, "id", cursor, limit))
+    db_users, next_cursor = get_page(result.scalars().all(), columns, "id", limit)
+    return db_users, next_cursor, total_count, count_mode
+
+# Counts one retrieval against a free-tier quota in a single statement: the period is reset if it expired,
+# the limit is checked and the count incremented atomically, so concurrent retrievals cannot exceed the limit.
+# Returns the new count, or None if the limit is reached; the caller commits once the retrieval succeeded.
+async def consume_retrieval(db: AsyncSession, user_id: int) -> Optional[int]:
+    today = date.today()
+    period_expired = or_(
+        User.retrieval_period_start_date.is_(None),
+        User.retrieval_period_start_date < today - timedelta(days=settings.RETRIEVAL_PERIOD_DAYS),
+    )
+
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id, or_(period_expired, User.monthly_retrieval_count < settings.FREE_TIER_RETRIEVAL_LIMIT))
+        .values(
+            monthly_retrieval_count=case((period_expired, 1), else_=User.monthly_retrieval_count + 1),
+            retrieval_period_start_date=case((period_expired, today), else_=User.retrieval_period_start_date),
+        )
+        .returning(User.monthly_retrieval_count)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
 
 async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
     result = await db.execute(select(User).filter(User.id == user_id))
@@ -45,4 +102,5 @@ async def delete_user(db: AsyncSession, user_id: int):
             license_key.activated_by_user_id = None
         await db.delete(db_user)
         await db.commit()
+        invalidate_cached_user(user_id)
     return
@@ -0,0 +1,68 @@
+# benchmarks/bench_archive.py
+# Measures archive build latency as a function of file count, against the same moto server the tests use.
+# moto answers in-process within microseconds, so a per-request latency is added to model a remote object store:
+#   BENCH_S3_LATENCY_MS=20 python -m benchmarks.bench_archive
+import asyncio
+import logging
+import os
+import time
+
+import aioboto3
+from aiobotocore.config import AioConfig
+from moto.server import ThreadedMotoServer
+
+from app.models.dotfiles import Dotfile
+from app.s3.s3_bucket import BUCKET_NAME
+from app.services.collection_service import stream_dotfiles_as_zip
+from app.services.dotfile_service import generate_dotfile_name_in_collection
+
+MOTO_PORT = int(os.environ.get("BENCH_MOTO_PORT", 5001))
+FILE_COUNTS = [10, 50, 200]
+CONCURRENCY_LEVELS = [1, 8, 32]
+FILE_SIZE = 4 * 1024
+COLLECTION_ID = 1
+S3_LATENCY_SECONDS = float(os.environ.get("BENCH_S3_LATENCY_MS", 20)) / 1000
+
+# simulates the network round trip of a remote object store before each request is sent
+async def add_s3_latency(**kwargs):
+    await asyncio.sleep(S3_LATENCY_SECONDS)
+
+async def build_archive(s3, db_dotfiles, concurrency) -> float:
+    start = time.perf_counter()
+    async for _ in stream_dotfiles_as_zip(s3, COLLECTION_ID, db_dotfiles, concurrency=concurrency):
+        pass
+    return time.perf_counter() - start
+
+async def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = ThreadedMotoServer(ip_address="localhost", port=MOTO_PORT)
+    server.start()
+
+    try:
+        session = aioboto3.Session(region_name="us-east-1", aws_secret_access_key="xxx", aws_access_key_id="xxx")
+        config = AioConfig(signature_version="v4", max_pool_connections=max(CONCURRENCY_LEVELS))
+
+        async with session.client("s3", endpoint_url=f"http://localhost:{MOTO_PORT}", config=config) as s3:
+            await s3.create_bucket(Bucket=BUCKET_NAME)
+
+            db_dotfiles = [Dotfile(collection_id=COLLECTION_ID, path=f"/bench/.file{n}", filename=f".file{n}") for n in range(max(FILE_COUNTS))]
+            for dotfile in db_dotfiles:
+                key = generate_dotfile_name_in_collection(COLLECTION_ID, dotfile.filename)
+                await s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=os.urandom(FILE_SIZE))
+
+            s3.meta.events.register("before-send.s3.GetObject", add_s3_latency)
+
+            header = f"{'files':>6}" + "".join(f" {f'concurrency={c} (ms)':>22}" for c in CONCURRENCY_LEVELS)
+            print(header)
+            for file_count in FILE_COUNTS:
+                row = f"{file_count:>6}"
+                for concurrency in CONCURRENCY_LEVELS:
+                    elapsed = await build_archive(s3, db_dotfiles[:file_count], concurrency)
+                    row += f" {elapsed * 1000:>22.1f}"
+                print(row)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
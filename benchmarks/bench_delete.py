@@ -0,0 +1,103 @@
+# benchmarks/bench_delete.py
+# Measures collection delete latency as a function of file count, comparing per-file deletion
+# (delete_object and a committed DELETE per dotfile) with the batched delete_collection.
+# Storage is the moto server used by the tests with a simulated per-request latency; the database is in-memory SQLite:
+#   BENCH_S3_LATENCY_MS=20 python -m benchmarks.bench_delete
+import asyncio
+import logging
+import os
+import time
+
+import aioboto3
+from aiobotocore.config import AioConfig
+from moto.server import ThreadedMotoServer
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.database import Base
+from app.models.collections import Collection
+from app.models.dotfiles import Dotfile
+from app.models.users import User
+from app.s3.s3_bucket import BUCKET_NAME
+from app.services import collection_service, dotfile_service, file_storage_service
+
+MOTO_PORT = int(os.environ.get("BENCH_MOTO_PORT", 5001))
+FILE_COUNTS = [10, 100, 300]
+S3_LATENCY_SECONDS = float(os.environ.get("BENCH_S3_LATENCY_MS", 20)) / 1000
+
+# simulates the network round trip of a remote object store before each request is sent
+async def add_s3_latency(**kwargs):
+    await asyncio.sleep(S3_LATENCY_SECONDS)
+
+# the previous implementation: one storage request and one committed transaction per dotfile
+async def delete_collection_per_file(db: AsyncSession, s3, collection_id: int):
+    for dotfile in await dotfile_service.get_dotfiles_by_collection_id(db, collection_id):
+        await file_storage_service.delete_file_from_storage_by_filename(s3, dotfile_service.generate_dotfile_name_in_collection(collection_id, dotfile.filename))
+        await dotfile_service.delete_dotfile(db, collection_id, dotfile.filename)
+
+    await db.delete(await db.get(Collection, collection_id))
+    await db.commit()
+
+async def create_collection_with_files(session_maker, s3, file_count: int) -> int:
+    async with session_maker() as db:
+        db_collection = Collection(name="bench", description="", owner_id=1, is_private=False)
+        db.add(db_collection)
+        await db.flush()
+
+        for n in range(file_count):
+            db.add(Dotfile(collection_id=db_collection.id, path=f"/bench/.file{n}", filename=f".file{n}"))
+        await db.commit()
+
+    await asyncio.gather(*[
+        s3.put_object(Bucket=BUCKET_NAME, Key=dotfile_service.generate_dotfile_name_in_collection(db_collection.id, f".file{n}"), Body=b"bench")
+        for n in range(file_count)
+    ])
+    return db_collection.id
+
+async def time_delete(session_maker, s3, file_count: int, delete_function) -> float:
+    collection_id = await create_collection_with_files(session_maker, s3, file_count)
+
+    async with session_maker() as db:
+        await db.get(Collection, collection_id)
+
+        s3.meta.events.register("before-send.s3", add_s3_latency)
+        start = time.perf_counter()
+        await delete_function(db, s3, collection_id)
+        elapsed = time.perf_counter() - start
+        s3.meta.events.unregister("before-send.s3", add_s3_latency)
+
+    return elapsed
+
+async def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    engine = create_async_engine("sqlite+aiosqlite:///", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async with session_maker() as db:
+        db.add(User(username="bench", email="bench@email.com", hashed_pwd="bench"))
+        await db.commit()
+
+    server = ThreadedMotoServer(ip_address="localhost", port=MOTO_PORT)
+    server.start()
+
+    try:
+        session = aioboto3.Session(region_name="us-east-1", aws_secret_access_key="xxx", aws_access_key_id="xxx")
+        config = AioConfig(signature_version="v4", max_pool_connections=50)
+
+        async with session.client("s3", endpoint_url=f"http://localhost:{MOTO_PORT}", config=config) as s3:
+            await s3.create_bucket(Bucket=BUCKET_NAME)
+
+            print(f"{'files':>6} {'per file (ms)':>14} {'batched (ms)':>14}")
+            for file_count in FILE_COUNTS:
+                per_file = await time_delete(session_maker, s3, file_count, delete_collection_per_file)
+                batched = await time_delete(session_maker, s3, file_count, collection_service.delete_collection)
+                print(f"{file_count:>6} {per_file * 1000:>14.1f} {batched * 1000:>14.1f}")
+    finally:
+        server.stop()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+# benchmarks/bench_s3_client.py
+# Compares storage call latency when a new client is created per request (the previous get_s3_client)
+# with the shared client created once by the app lifespan, against the moto server used by the tests:
+#   python -m benchmarks.bench_s3_client
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+import aiobotocore.session
+from moto.server import ThreadedMotoServer
+
+from app.core.settings import settings
+from app.s3 import s3_bucket
+from app.s3.s3_bucket import BUCKET_NAME, get_s3_client_config
+
+MOTO_PORT = int(os.environ.get("BENCH_MOTO_PORT", 5001))
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", 200))
+KEY = "bench/.bashrc"
+
+async def per_request_client_call(endpoint_url: str):
+    session = aiobotocore.session.get_session()
+    async with session.create_client(
+        service_name='s3',
+        aws_access_key_id=settings.FILE_STORAGE_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.FILE_STORAGE_SECRET_ACCESS_KEY,
+        endpoint_url=endpoint_url,
+        region_name=settings.FILE_STORAGE_REGION,
+        config=get_s3_client_config()
+    ) as s3_client:
+        await s3_client.head_object(Bucket=BUCKET_NAME, Key=KEY)
+
+async def shared_client_call():
+    s3_client = await s3_bucket.start_s3_client()
+    await s3_client.head_object(Bucket=BUCKET_NAME, Key=KEY)
+
+async def measure(call) -> list[float]:
+    timings = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+async def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = ThreadedMotoServer(ip_address="localhost", port=MOTO_PORT)
+    server.start()
+    endpoint_url = f"http://localhost:{MOTO_PORT}"
+    settings.FILE_STORAGE_URL = endpoint_url
+
+    try:
+        s3_client = await s3_bucket.start_s3_client()
+        await s3_client.create_bucket(Bucket=BUCKET_NAME)
+        await s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=b"export PATH")
+
+        results = {
+            "per request": await measure(lambda: per_request_client_call(endpoint_url)),
+            "shared": await measure(shared_client_call),
+        }
+
+        print(f"{'client':<12} {'mean (ms)':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+        for name, timings in results.items():
+            mean = statistics.fmean(timings) * 1000
+            p50 = timings[len(timings) // 2] * 1000
+            p99 = timings[int(len(timings) * 0.99)] * 1000
+            print(f"{name:<12} {mean:>10.2f} {p50:>10.2f} {p99:>10.2f}")
+    finally:
+        await s3_bucket.close_s3_client()
+        server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
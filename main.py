@@ -1,13 +1,39 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from app.db.database import get_db
+from app.core.settings import settings
+from app.db.database import AsyncSessionLocal, engine, get_db
 from app.routers import admin, auth, users, collections
-from app.s3.s3_bucket import check_storage_health
+from app.s3.s3_bucket import check_storage_health, close_s3_client, start_s3_client
 from app.services.auth_service import get_current_admin_user
+from app.services.quota_service import flush_retrieval_counts_in_session, run_retrieval_count_flusher
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one storage client (and its connection pool) between all requests of this worker
+    await start_s3_client()
+
+    # Write retrieval counts kept in memory behind to the database
+    quota_flusher = None
+    if settings.QUOTA_ENGINE == "memory":
+        quota_flusher = asyncio.create_task(run_retrieval_count_flusher(AsyncSessionLocal))
+
+    yield
+
+    if quota_flusher is not None:
+        quota_flusher.cancel()
+        with suppress(asyncio.CancelledError):
+            await quota_flusher
+        await flush_retrieval_counts_in_session(AsyncSessionLocal)
+
+    await close_s3_client()
+    await engine.dispose()
 
-app = FastAPI(title="Punkt-Backend API")
+app = FastAPI(title="Punkt-Backend API", lifespan=lifespan)
 
 @app.get("/api/healthcheck")
 async def healthcheck(db: AsyncSession = Depends(get_db)):
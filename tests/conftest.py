@@ -12,6 +12,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'helpers'))
 from fastapi.testclient import TestClient
 from fastapi import UploadFile
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.pool import StaticPool
 
@@ -25,6 +26,10 @@ from aiobotocore.config import AioConfig
 from main import app
 
 from app.services.auth_service import get_current_admin_user
+from app.services.user_service import authenticated_user_cache
+from app.services.archive_cache_service import archive_memory_cache
+from app.services import quota_service
+from app.services.quota_service import retrieval_counter_store
 from app.models.users import User
 
 # in-memory temporary database for testing
@@ -62,6 +67,31 @@ async def db_session():
     await connection.close()
 
 
+@pytest.fixture()
+def query_counter():
+    # records every SQL statement sent to the mock database
+    statements = []
+
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+
+@pytest.fixture()
+def statement_recorder():
+    # records every SQL statement sent to the mock database together with its parameters
+    statements = []
+
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+
 @pytest.fixture(scope="session")
 def moto_server():
     ip_address = "localhost"
@@ -92,10 +122,16 @@ async def s3_client(moto_server, moto_aio_config):
     async with session.client("s3", region_name="us-east-1", endpoint_url=moto_server, config=moto_aio_config) as client:
         await client.create_bucket(Bucket=BUCKET_NAME)
 
+        # the moto server outlives each test while database ids are reused, so start from an empty bucket
+        listed_objects = await client.list_objects_v2(Bucket=BUCKET_NAME)
+        stored_keys = [{"Key": stored_object["Key"]} for stored_object in listed_objects.get("Contents", [])]
+        if stored_keys:
+            await client.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": stored_keys, "Quiet": True})
+
         return client
 
 @pytest_asyncio.fixture(scope="function")
-async def mock_client(db_session, s3_client):
+async def mock_client(db_session, s3_client, monkeypatch):
     async def get_override_db():
         try:
             yield db_session
@@ -107,6 +143,19 @@ async def mock_client(db_session, s3_client):
 
     # reset dependency overrides
     app.dependency_overrides = {}
+
+    # user ids are reused between tests since every test rolls back the database
+    authenticated_user_cache.clear()
+    archive_memory_cache.clear()
+    await retrieval_counter_store.clear()
+
+    # flushes of retrieval counts commit a savepoint within the test's transaction instead of a transaction of their own
+    monkeypatch.setattr(quota_service, "retrieval_count_session_maker", async_sessionmaker(
+        bind=db_session.bind,
+        expire_on_commit=False,
+        class_=AsyncSession,
+        join_transaction_mode="create_savepoint"
+    ))
     
     app.dependency_overrides[get_db] = get_override_db
     app.dependency_overrides[get_s3_client] = get_override_s3_client
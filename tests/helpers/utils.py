@@ -160,6 +160,16 @@ def seperate_mock_files(mock_files):
 
     return mock_filenames, mock_file_contents
 
+def count_table_selects(statements, table_name):
+    return len([statement for statement in statements if statement.lstrip().upper().startswith("SELECT") and f"FROM {table_name.upper()}" in statement.upper()])
+
+def find_sequential_scans(query_plan_details):
+    # sqlite reports a full table scan as "SCAN <table>"; scans in index order read "SCAN <table> USING INDEX ..."
+    return [detail for detail in query_plan_details if detail.startswith("SCAN") and "USING" not in detail]
+
+def seperate_dotfile_paths(dotfiles):
+    return [{"path": dotfile["path"], "filename": dotfile["filename"]} for dotfile in dotfiles]
+
 def seperate_collection_content(collection_content):
     collection_content_filenames = [file["filename"] for file in collection_content]
     collection_content_file_contents = [file["content"] for file in collection_content]
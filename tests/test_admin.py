@@ -1,8 +1,12 @@
 # tests/test_admin.py
 import utils
 import pytest
+from datetime import datetime, timedelta, timezone
+
+from app.services import license_key_service
 
 ADMIN_PREFIX = "/admin"
+USERS_PREFIX = "/users"
 
 USER_TIER_PARAMETERS = ["pro", "admin"]
 
@@ -48,6 +52,50 @@ def test_create_license_keys(mock_client_with_admin_tier, key_generation_request
     
     assert len(generated_keys) == key_generation_request["quantity"] 
 
+def test_create_license_keys_retries_collisions(mock_client_with_admin_tier, monkeypatch):
+    """
+    Verifies that the api regenerates only the license keys that collide with existing ones
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # generate a first license key
+    existing_key = utils.generate_license_keys(mock_client, 1)["generated_keys"][0]
+
+    # make the next generated key collide with the existing one
+    generated_key_strings = iter([existing_key, "AAAA-AAAA-AAAA-AAAA", "BBBB-BBBB-BBBB-BBBB"])
+    monkeypatch.setattr(license_key_service, "generate_key_string", lambda: next(generated_key_strings))
+
+    generate_license_json = utils.generate_license_keys(mock_client, 2)
+    assert generate_license_json["generated_keys"] == ["AAAA-AAAA-AAAA-AAAA", "BBBB-BBBB-BBBB-BBBB"]
+
+    # check that every license key is stored once
+    listed_keys = [license_key["key_string"] for license_key in utils.list_license_keys(mock_client)]
+    assert listed_keys == [existing_key, "AAAA-AAAA-AAAA-AAAA", "BBBB-BBBB-BBBB-BBBB"]
+
+    # keep colliding until the attempts are exhausted
+    monkeypatch.setattr(license_key_service, "generate_key_string", lambda: existing_key)
+
+    generate_license_response = mock_client.post(ADMIN_PREFIX + "/license", json={"quantity": 1})
+    assert generate_license_response.status_code == 500
+    assert generate_license_response.json()["detail"] == "Failed to generate unique license keys"
+
+def test_create_many_license_keys(mock_client_with_admin_tier):
+    """
+    Verifies that the api can generate more license keys than fit in one insert statement
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    key_quantity = license_key_service.MAX_KEYS_PER_INSERT + 1
+    generated_keys = utils.generate_license_keys(mock_client, key_quantity)["generated_keys"]
+
+    assert len(generated_keys) == key_quantity
+    assert len(set(generated_keys)) == key_quantity
+
+    list_license_keys_response = mock_client.get(ADMIN_PREFIX + "/license", params={"limit": 1, "count": "exact"})
+    assert list_license_keys_response.headers["X-Total-Count"] == str(key_quantity)
+
 # license listing tests
 def test_list_license_keys(mock_client_with_admin_tier, key_generation_request):
     """
@@ -75,6 +123,77 @@ def test_list_license_keys(mock_client_with_admin_tier, key_generation_request):
     assert len(list_license_keys_json) == len(generated_keys)
     assert listed_keys == generated_keys
 
+def test_paginate_and_filter_license_keys(mock_client_with_admin_tier, user_create_payload):
+    """
+    Verifies that the api returns license keys page by page and filters them on the server
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # generate license keys
+    generate_license_json = utils.generate_license_keys(mock_client, 5)
+    generated_keys = generate_license_json["generated_keys"]
+
+    # activate one of the license keys for a user
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    license_key_payload = utils.get_license_key_payload(generated_keys[2])
+    activate_license_response = mock_client.post(USERS_PREFIX + "/me/license-activate", json=license_key_payload, headers=authorization_headers)
+    assert activate_license_response.status_code == 200
+
+    # get all license keys two at a time
+    listed_keys = []
+    cursor = None
+
+    while True:
+        params = {"limit": 2, "count": "exact"}
+        if cursor:
+            params["cursor"] = cursor
+
+        list_license_keys_response = mock_client.get(ADMIN_PREFIX + "/license", params=params)
+
+        list_license_keys_status_code = list_license_keys_response.status_code
+        assert list_license_keys_status_code == 200
+        assert list_license_keys_response.headers["X-Total-Count"] == "5"
+
+        list_license_keys_json = list_license_keys_response.json()
+        assert len(list_license_keys_json) <= 2
+        listed_keys.extend(license_key["key_string"] for license_key in list_license_keys_json)
+
+        cursor = list_license_keys_response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert listed_keys == generated_keys
+
+    # filter by usage and by activating user
+    used_license_keys_json = mock_client.get(ADMIN_PREFIX + "/license", params={"used": True}).json()
+    assert [license_key["key_string"] for license_key in used_license_keys_json] == [generated_keys[2]]
+    assert used_license_keys_json[0]["is_active"] is False
+    assert used_license_keys_json[0]["assigned_to_user_id"] == user_id
+
+    unused_license_keys_json = mock_client.get(ADMIN_PREFIX + "/license", params={"used": False}).json()
+    assert [license_key["key_string"] for license_key in unused_license_keys_json] == generated_keys[:2] + generated_keys[3:]
+
+    activated_license_keys_json = mock_client.get(ADMIN_PREFIX + "/license", params={"activated_by_user_id": user_id}).json()
+    assert [license_key["key_string"] for license_key in activated_license_keys_json] == [generated_keys[2]]
+
+    # filter by creation time
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    created_today_json = mock_client.get(ADMIN_PREFIX + "/license", params={
+        "created_after": (now - timedelta(days=1)).isoformat(),
+        "created_before": (now + timedelta(days=1)).isoformat(),
+    }).json()
+    assert len(created_today_json) == 5
+
+    created_tomorrow_json = mock_client.get(ADMIN_PREFIX + "/license", params={"created_after": (now + timedelta(days=1)).isoformat()}).json()
+    assert len(created_tomorrow_json) == 0
+
 # license deletion tests
 def test_valid_delete_license_key(mock_client_with_admin_tier, key_generation_request):
     """
@@ -91,3 +91,81 @@ def test_invalid_password_login(mock_client, user_create_payload):
     get_token_json = get_token_response.json()
     assert get_token_json["detail"] == "Incorrect email or password"
 
+
+# authenticated user cache tests
+def test_authenticated_request_skips_user_query(mock_client, user_create_payload, query_counter):
+    """
+    Verifies that repeated authenticated requests are served from the user cache without querying the users table
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # first request populates the user cache
+    current_user_info_response_0 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+    assert current_user_info_response_0.status_code == 200
+
+    # second request does not touch the users table
+    query_counter.clear()
+    current_user_info_response_1 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+
+    assert current_user_info_response_1.status_code == 200
+    assert current_user_info_response_1.json()["email"] == user_create_payload["email"]
+    assert utils.count_table_selects(query_counter, "users") == 0
+
+def test_promoted_user_is_not_served_stale_tier(mock_client_with_admin_tier, user_create_payload):
+    """
+    Verifies that promoting a user invalidates the cached user so the new tier applies immediately
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a user
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    user_id = user_create_json["id"]
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # cache the free tier user
+    current_user_info_response_0 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+    assert current_user_info_response_0.json()["account_tier"] == "free"
+
+    # promote the user with the same token still in use
+    utils.promote_user(mock_client, user_id, "pro")
+
+    current_user_info_response_1 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+    assert current_user_info_response_1.json()["account_tier"] == "pro"
+
+def test_deleted_user_token_is_rejected(mock_client, user_create_payload):
+    """
+    Verifies that deleting a user invalidates the cached user so its token stops working
+    """
+    # create a user
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    user_id = user_create_json["id"]
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # cache the user
+    current_user_info_response_0 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+    assert current_user_info_response_0.status_code == 200
+
+    # delete the user
+    user_delete_response = mock_client.delete(USERS_PREFIX + f"/{user_id}")
+    assert user_delete_response.status_code == 204
+
+    current_user_info_response_1 = mock_client.get(USERS_PREFIX + "/me", headers=authorization_headers)
+    assert current_user_info_response_1.status_code == 401
@@ -4,15 +4,34 @@ import utils
 import json
 
 import io
+import os
+import sys
+import types
 import zipfile
+import hashlib
+import httpx
 
-from app.services.dotfile_service import generate_dotfile_name_in_collection 
-from app.core.settings import settings
+from fastapi import HTTPException, UploadFile
+from pydantic import ValidationError
+
+from datetime import date, timedelta
+
+from app.models.blobs import Blob
+from app.models.collections import Collection
+from app.models.dotfiles import Dotfile
+from app.models.users import User
+from app.schemas.collections import CollectionContentAdd
+from app.services import archive_cache_service, blob_service, collection_service, file_storage_service, quota_service, user_service
+from app.services.archive_cache_service import archive_memory_cache
+from app.services.blob_service import generate_blob_key
+from app.services.dotfile_service import generate_dotfile_name_in_collection
+from app.core.settings import Settings, settings
 
 COLLECTIONS_PREFIX = "/collections"
 
 FILE_INDICES_PARAMETERS = [0, 1]
 USER_TIER_PARAMETERS = ["pro", "admin"]
+COLLECTION_SORT_PARAMETERS = ["oldest", "newest", "name"]
 
 FREE_TIER_RETRIEVAL_LIMIT = settings.FREE_TIER_RETRIEVAL_LIMIT
 
@@ -142,6 +161,101 @@ def test_get_public_collections(mock_client, user_create_payload, collection_cre
 
 
 
+@pytest.mark.parametrize("listing_prefix", ["/public", "/owned"])
+@pytest.mark.parametrize("sort", COLLECTION_SORT_PARAMETERS)
+def test_paginate_collections(mock_client, user_create_payload, collection_create_payload, listing_prefix, sort):
+    """
+    Verifies that the api returns collections page by page in the requested sort order
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create public collections
+    collection_names = ["delta", "alpha", "echo", "charlie", "bravo"]
+    collection_ids = []
+
+    for collection_name in collection_names:
+        named_collection_create_payload = collection_create_payload.copy()
+        named_collection_create_payload["name"] = collection_name
+        named_collection_create_payload["is_private"] = False
+
+        collection_ids.append(utils.create_new_collection(mock_client, named_collection_create_payload, authorization_headers)["id"])
+
+    # get all collections two at a time
+    page_sizes = []
+    listed_collections = []
+    cursor = None
+
+    while True:
+        params = {"sort": sort, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+
+        collection_page_response = mock_client.get(COLLECTIONS_PREFIX + listing_prefix, params=params, headers=authorization_headers)
+        
+        collection_page_status_code = collection_page_response.status_code
+        assert collection_page_status_code == 200
+
+        collection_page_json = collection_page_response.json()
+        page_sizes.append(len(collection_page_json))
+        listed_collections.extend(collection_page_json)
+
+        cursor = collection_page_response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    # check that every collection is listed once in the requested order
+    assert page_sizes == [2, 2, 1]
+
+    expected_orders = {
+        "oldest": collection_ids,
+        "newest": collection_ids[::-1],
+        "name": [collection_id for _, collection_id in sorted(zip(collection_names, collection_ids))],
+    }
+    assert [collection["id"] for collection in listed_collections] == expected_orders[sort]
+
+def test_paginate_collections_with_invalid_cursor(mock_client, user_create_payload, collection_create_payload):
+    """
+    Verifies that the api rejects malformed cursors and cursors issued for another sort order
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create two public collections
+    utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+
+    # get a cursor for the name sort order
+    collection_page_response_0 = mock_client.get(COLLECTIONS_PREFIX + "/public", params={"sort": "name", "limit": 1})
+    cursor = collection_page_response_0.headers["X-Next-Cursor"]
+
+    # attempt to continue with another sort order
+    collection_page_response_1 = mock_client.get(COLLECTIONS_PREFIX + "/public", params={"sort": "newest", "limit": 1, "cursor": cursor})
+
+    assert collection_page_response_1.status_code == 400
+    assert collection_page_response_1.json()["detail"] == "Invalid cursor"
+
+    # attempt to continue with a malformed cursor
+    collection_page_response_2 = mock_client.get(COLLECTIONS_PREFIX + "/public", params={"sort": "name", "limit": 1, "cursor": "invalid_cursor"})
+
+    assert collection_page_response_2.status_code == 400
+    assert collection_page_response_2.json()["detail"] == "Invalid cursor"
+
+
+
+
 # collection content addition tests
 def test_valid_add_to_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
     """
@@ -178,6 +292,317 @@ def test_valid_add_to_collection(mock_client, user_create_payload, collection_cr
     assert collection_add_json[1]["path"] == collection_add_payload["content"][1]["path"]  
     assert collection_add_json[1]["filename"] == collection_add_payload["content"][1]["filename"]  
 
+def test_add_multipart_file_to_collection(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload):
+    """
+    Verifies that the api uploads files larger than the multipart threshold to storage intact
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    utils.promote_user(mock_client, user_create_json["id"], "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add a mock file spanning several upload parts and a small mock file
+    large_file_content = "".join(f".mock0 line {index}\n" for index in range(settings.STORAGE_MULTIPART_THRESHOLD // 10))
+    mock_files = [("files", (".mock0", io.BytesIO(large_file_content.encode("utf-8")))), ("files", (".mock1", io.BytesIO(".mock1".encode("utf-8"))))]
+
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # check files in collection
+    collection_content = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    _, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+
+    assert len(large_file_content) > settings.STORAGE_MULTIPART_THRESHOLD
+    assert collection_content_file_contents == [large_file_content, ".mock1"]
+
+def test_add_to_collection_with_failed_upload(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
+    """
+    Verifies that the api adds no files to the collection when one of the uploads fails, and removes the uploaded blobs
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # make the upload of the second mock file time out and record removed files
+    failed_filename = collection_add_payload["content"][1]["filename"]
+    upload_file_to_storage = file_storage_service.upload_file_to_storage
+    delete_files_from_storage_by_filenames = file_storage_service.delete_files_from_storage_by_filenames
+    deleted_filenames = []
+
+    async def failing_upload_file_to_storage(s3, file, filename=None):
+        if file.filename == failed_filename:
+            raise HTTPException(status_code=504, detail=f"Storage upload timeout for {filename}")
+        return await upload_file_to_storage(s3, file, filename)
+
+    async def recording_delete_files_from_storage_by_filenames(s3, filenames):
+        deleted_filenames.extend(filenames)
+        return await delete_files_from_storage_by_filenames(s3, filenames)
+
+    monkeypatch.setattr(file_storage_service, "upload_file_to_storage", failing_upload_file_to_storage)
+    monkeypatch.setattr(file_storage_service, "delete_files_from_storage_by_filenames", recording_delete_files_from_storage_by_filenames)
+
+    # attempt to add mock files to collection
+    collection_add_payload["collection_id"] = collection_id
+    collection_add_data = {"collection_add_payload": json.dumps(collection_add_payload)}
+
+    collection_add_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", data=collection_add_data, files=mock_files, headers=authorization_headers)
+
+    collection_add_status_code = collection_add_response.status_code
+    assert collection_add_status_code == 504
+
+    collection_add_json = collection_add_response.json()
+    assert collection_add_json["detail"] == f"Failed to upload {failed_filename} to storage; no files were added to the collection"
+
+    # check that the blob of the first mock file was uploaded and removed again, and no file was added
+    _, mock_file_contents = utils.seperate_mock_files(mock_files)
+    assert deleted_filenames == [generate_blob_key(hashlib.sha256(mock_file_contents[0].encode("utf-8")).hexdigest())]
+
+    collection_file_paths = utils.get_collection_file_paths(mock_client, collection_id, authorization_headers)
+    assert len(collection_file_paths) == 0
+
+def test_add_identical_content_is_stored_once(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
+    """
+    Verifies that the api uploads content already stored by another collection only once, and deletes it with its last reference
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    utils.promote_user(mock_client, user_create_json["id"], "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # record uploads and storage batch deletions
+    upload_file_to_storage = file_storage_service.upload_file_to_storage
+    delete_files_from_storage_by_filenames = file_storage_service.delete_files_from_storage_by_filenames
+    uploaded_filenames = []
+    deleted_filenames = []
+
+    async def recording_upload_file_to_storage(s3, file, filename=None):
+        uploaded_filenames.append(filename)
+        return await upload_file_to_storage(s3, file, filename)
+
+    async def recording_delete_files_from_storage_by_filenames(s3, filenames):
+        deleted_filenames.extend(filenames)
+        return await delete_files_from_storage_by_filenames(s3, filenames)
+
+    monkeypatch.setattr(file_storage_service, "upload_file_to_storage", recording_upload_file_to_storage)
+    monkeypatch.setattr(file_storage_service, "delete_files_from_storage_by_filenames", recording_delete_files_from_storage_by_filenames)
+
+    # add the same mock files to two collections
+    mock_filenames, mock_file_contents = utils.seperate_mock_files(mock_files)
+    blob_keys = sorted(generate_blob_key(hashlib.sha256(content.encode("utf-8")).hexdigest()) for content in mock_file_contents)
+
+    collection_id_0 = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)["id"]
+    utils.add_to_collection(mock_client, collection_id_0, collection_add_payload, mock_files, authorization_headers)
+    assert sorted(uploaded_filenames) == blob_keys
+
+    uploaded_filenames.clear()
+    collection_id_1 = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)["id"]
+    same_mock_files = [("files", (filename, io.BytesIO(content.encode("utf-8")))) for filename, content in zip(mock_filenames, mock_file_contents)]
+    utils.add_to_collection(mock_client, collection_id_1, collection_add_payload, same_mock_files, authorization_headers)
+    assert uploaded_filenames == []
+
+    # check that deleting the first collection keeps the content of the second
+    collection_delete_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id_0}", headers=authorization_headers)
+    assert collection_delete_response.status_code == 204
+    assert deleted_filenames == []
+
+    collection_content = utils.get_collection_content(mock_client, collection_id_1, authorization_headers)
+    _, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+    assert collection_content_file_contents == mock_file_contents
+
+    # check that deleting the last reference deletes the content
+    collection_delete_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id_1}", headers=authorization_headers)
+    assert collection_delete_response.status_code == 204
+    assert sorted(deleted_filenames) == blob_keys
+
+def test_add_to_collection_locks_blobs_once_after_uploading(mock_client, user_create_payload, collection_create_payload, monkeypatch):
+    """
+    Verifies that swapping the content of two files uploads new content first and then locks every blob gaining or losing
+    a reference in one statement, so that concurrent swaps cannot deadlock
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection with two files
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    file_contents = [b"content a", b"content b", b"content c"]
+    sha256s = [hashlib.sha256(file_content).hexdigest() for file_content in file_contents]
+
+    collection_add_payload = {"content": [{"path": "/a/.x", "filename": ".x"}, {"path": "/b/.y", "filename": ".y"}]}
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, [("files", (".x", io.BytesIO(file_contents[0]))), ("files", (".y", io.BytesIO(file_contents[1])))], authorization_headers)
+
+    # record uploads and blob locks
+    events = []
+    upload_file_to_storage = file_storage_service.upload_file_to_storage
+    lock_blobs = blob_service.lock_blobs
+
+    async def recording_upload_file_to_storage(s3, file, filename=None):
+        events.append(("upload", filename))
+        return await upload_file_to_storage(s3, file, filename)
+
+    async def recording_lock_blobs(db, sha256s):
+        events.append(("lock", set(sha256s)))
+        return await lock_blobs(db, sha256s)
+
+    monkeypatch.setattr(file_storage_service, "upload_file_to_storage", recording_upload_file_to_storage)
+    monkeypatch.setattr(blob_service, "lock_blobs", recording_lock_blobs)
+
+    # swap the contents of the two files and add a third one
+    collection_add_payload = {"content": [{"path": "/a/.x", "filename": ".x"}, {"path": "/b/.y", "filename": ".y"}, {"path": "/c/.z", "filename": ".z"}]}
+    swapped_files = [("files", (".x", io.BytesIO(file_contents[1]))), ("files", (".y", io.BytesIO(file_contents[0]))), ("files", (".z", io.BytesIO(file_contents[2])))]
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, swapped_files, authorization_headers)
+
+    # new content is uploaded before any lock, then all blobs are locked at once; later locks only take locks already held
+    assert events[0] == ("upload", generate_blob_key(sha256s[2]))
+    assert events[1] == ("lock", set(sha256s))
+    assert all(kind == "lock" and locked <= set(sha256s) for kind, locked in events[2:])
+
+@pytest.mark.asyncio
+async def test_add_identical_content_while_its_blob_is_released(db_session, s3_client, monkeypatch):
+    """
+    Verifies that content found stored by an upload stays stored when its last reference is released before the upload is committed
+    """
+    db_session.add(User(id=1, username="mock_user", email="mock_email@email.com", hashed_pwd="mock_password"))
+    db_session.add_all([Collection(id=collection_id, name="mock_collection", description="", owner_id=1, is_private=False) for collection_id in (1, 2)])
+    await db_session.flush()
+
+    filename, file_content = ".bashrc", b"export PATH"
+    sha256 = hashlib.sha256(file_content).hexdigest()
+    collection_add = CollectionContentAdd(collection_id=1, content=[{"path": f"/home/{filename}", "filename": filename}])
+
+    await collection_service.add_to_collection(db_session, s3_client, collection_add, [UploadFile(file=io.BytesIO(file_content), filename=filename)])
+
+    # the last reference is released right after the second upload found the blob stored
+    get_existing_blobs = blob_service.get_existing_blobs
+
+    async def get_existing_blobs_then_release(db, sha256s):
+        existing_blobs = await get_existing_blobs(db, sha256s)
+        await collection_service.delete_collection(db, s3_client, 1)
+        return existing_blobs
+
+    monkeypatch.setattr(blob_service, "get_existing_blobs", get_existing_blobs_then_release)
+
+    collection_add = CollectionContentAdd(collection_id=2, content=[{"path": f"/home/{filename}", "filename": filename}])
+    await collection_service.add_to_collection(db_session, s3_client, collection_add, [UploadFile(file=io.BytesIO(file_content), filename=filename)])
+
+    # the blob is referenced once and its content is stored
+    db_blob = await db_session.get(Blob, sha256, populate_existing=True)
+    assert db_blob.ref_count == 1
+
+    stored_content = await file_storage_service.retrieve_file_content_from_storage_by_filename(s3_client, generate_blob_key(sha256))
+    assert stored_content == file_content
+
+def test_add_to_collection_after_preflight(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
+    """
+    Verifies that the api asks only for files whose content the user does not store yet, and adds the others without their files
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # record uploads
+    upload_file_to_storage = file_storage_service.upload_file_to_storage
+    uploaded_filenames = []
+
+    async def recording_upload_file_to_storage(s3, file, filename=None):
+        uploaded_filenames.append(filename)
+        return await upload_file_to_storage(s3, file, filename)
+
+    monkeypatch.setattr(file_storage_service, "upload_file_to_storage", recording_upload_file_to_storage)
+
+    # add mock files to a first collection
+    collection_id_0 = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)["id"]
+    utils.add_to_collection(mock_client, collection_id_0, collection_add_payload, mock_files, authorization_headers)
+
+    # pre-flight the mock files and a new file for a second collection
+    collection_id_1 = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)["id"]
+    mock_filenames, mock_file_contents = utils.seperate_mock_files(mock_files)
+    new_filename, new_file_content = ".mock2", ".mock2"
+
+    preflight_content = [
+        {**content, "sha256": hashlib.sha256(file_content.encode("utf-8")).hexdigest(), "size": len(file_content)}
+        for content, file_content in zip(collection_add_payload["content"], mock_file_contents)
+    ]
+    new_preflight_entry = {"path": f"/mock_dir/{new_filename}", "filename": new_filename, "sha256": hashlib.sha256(new_file_content.encode("utf-8")).hexdigest(), "size": len(new_file_content)}
+    preflight_content.append(new_preflight_entry)
+
+    preflight_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id_1}/dotfiles/preflight", json={"content": preflight_content}, headers=authorization_headers)
+    assert preflight_response.status_code == 200
+    assert preflight_response.json() == [new_preflight_entry]
+
+    # add the stored files without their content and upload only the new file
+    uploaded_filenames.clear()
+    stored_content = [{"path": entry["path"], "filename": entry["filename"], "sha256": entry["sha256"]} for entry in preflight_content[:-1]]
+    new_content = {"path": new_preflight_entry["path"], "filename": new_filename}
+    collection_add_payload_1 = {"content": stored_content + [new_content]}
+
+    collection_add_json = utils.add_to_collection(mock_client, collection_id_1, collection_add_payload_1, [("files", (new_filename, io.BytesIO(new_file_content.encode("utf-8"))))], authorization_headers)
+
+    assert uploaded_filenames == [generate_blob_key(new_preflight_entry["sha256"])]
+    assert [dotfile["sha256"] for dotfile in collection_add_json] == [entry["sha256"] for entry in preflight_content]
+
+    collection_content = utils.get_collection_content(mock_client, collection_id_1, authorization_headers)
+    _, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+    assert collection_content_file_contents == mock_file_contents + [new_file_content]
+
+    # adding unchanged files leaves the collection as it is
+    etag = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id_1}/dotfiles", headers=authorization_headers).headers["ETag"]
+
+    collection_add_payload_2 = {"content": [{"path": entry["path"], "filename": entry["filename"], "sha256": entry["sha256"]} for entry in preflight_content]}
+    collection_add_json = utils.add_to_collection(mock_client, collection_id_1, collection_add_payload_2, None, authorization_headers)
+    assert [dotfile["path"] for dotfile in collection_add_json] == [entry["path"] for entry in preflight_content]
+
+    get_collection_file_paths_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id_1}/dotfiles", headers={**authorization_headers, "If-None-Match": etag})
+    assert get_collection_file_paths_response.status_code == 304
+
+    # content that is not stored cannot be added without its file
+    unknown_content = {"path": "/mock_dir/.unknown", "filename": ".unknown", "sha256": hashlib.sha256(b"unknown").hexdigest()}
+    collection_add_data = {"collection_add_payload": json.dumps({"collection_id": collection_id_1, "content": [unknown_content]})}
+
+    collection_add_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id_1}/dotfiles", data=collection_add_data, headers=authorization_headers)
+    assert collection_add_response.status_code == 409
+    assert collection_add_response.json()["detail"] == "Content of .unknown is not stored; upload these files"
+
 def test_add_to_collection_with_mismatch_collection_id(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
     """
     Verifies that the api rejects attempts to add files to a collection by providing different collection ids in the api endpoint and request data
@@ -467,22 +892,858 @@ def test_valid_get_collection_content(mock_client, user_create_payload, collecti
         mock_filenames = [mock_files[n][1][0] for n in range(len(mock_files))]
         mock_file_contents = [mock_files[n][1][1].getvalue().decode("utf-8") for n in range(len(mock_files))]
 
-        # check if number of file retrieved is the same as the number of files uploaded
-        assert len(archive_filenames) == len(mock_filenames)
-        
-        # check that each file is retrieved is correct
-        for index, archive_filename in enumerate(archive_filenames):
-            mock_filename_in_collection = generate_dotfile_name_in_collection(collection_id, mock_filenames[index])
-            mock_file_content = mock_file_contents[index]
-            archive_file_content = archive.open(archive_filename).read().decode()
+        # check if number of file retrieved is the same as the number of files uploaded
+        assert len(archive_filenames) == len(mock_filenames)
+        
+        # check that each file is retrieved is correct
+        for index, archive_filename in enumerate(archive_filenames):
+            mock_filename_in_collection = generate_dotfile_name_in_collection(collection_id, mock_filenames[index])
+            mock_file_content = mock_file_contents[index]
+            archive_file_content = archive.open(archive_filename).read().decode()
+
+            assert archive_filename == mock_filename_in_collection
+            assert archive_file_content == mock_file_content
+
+def test_get_collection_content_with_multi_chunk_file(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
+    """
+    Verifies that the api streams files larger than a single archive chunk into the zip archive intact
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add large mock files to collection
+    large_file_contents = ["".join(f".mock{n} line {index}\n" for index in range(20000)) for n in range(2)]
+    large_mock_files = [("files", (".mock0", io.BytesIO(large_file_contents[0].encode("utf-8")))), ("files", (".mock1", io.BytesIO(large_file_contents[1].encode("utf-8"))))]
+
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, large_mock_files, authorization_headers)
+
+    # check files in collection
+    collection_content = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    _, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+
+    assert collection_content_file_contents == large_file_contents
+
+def test_get_collection_content_keeps_file_order(mock_client, user_create_payload, collection_create_payload):
+    """
+    Verifies that files fetched concurrently from storage are archived in the same order as in the collection
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add more mock files than are fetched at once
+    file_count = settings.ARCHIVE_FETCH_CONCURRENCY * 2 + 1
+    mock_filenames = [f".mock{n}" for n in range(file_count)]
+
+    many_collection_add_payload = {"content": [{"path": f"/mock_dir/{filename}", "filename": filename} for filename in mock_filenames]}
+    many_mock_files = [("files", (filename, io.BytesIO(filename.encode("utf-8")))) for filename in mock_filenames]
+
+    utils.add_to_collection(mock_client, collection_id, many_collection_add_payload, many_mock_files, authorization_headers)
+
+    # check files in collection
+    collection_content = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    collection_content_filenames, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+
+    assert collection_content_filenames == [generate_dotfile_name_in_collection(collection_id, filename) for filename in mock_filenames]
+    assert collection_content_file_contents == mock_filenames
+
+def test_get_collection_content_is_served_from_archive_cache(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
+    """
+    Verifies that repeated retrievals of an unchanged collection are served from the archive cache without fetching from storage
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    utils.promote_user(mock_client, user_create_json["id"], "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # first retrieval builds the archive
+    collection_content_0 = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+
+    # count storage fetches from now on
+    retrieved_filenames = []
+    retrieve_file_object = file_storage_service.retrieve_file_object_from_storage_by_filename
+
+    async def counting_retrieve_file_object(s3, filename):
+        retrieved_filenames.append(filename)
+        return await retrieve_file_object(s3, filename)
+
+    monkeypatch.setattr(file_storage_service, "retrieve_file_object_from_storage_by_filename", counting_retrieve_file_object)
+
+    # second retrieval is served from the cache
+    collection_content_1 = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+
+    assert collection_content_1 == collection_content_0
+    assert len(retrieved_filenames) == 0
+
+@pytest.mark.asyncio
+async def test_stream_dotfiles_as_zip_copies_content_in_chunks(s3_client):
+    """
+    Verifies that archive entries are copied from storage in chunks rather than read whole into memory
+    """
+    chunk_size = file_storage_service.STREAM_CHUNK_SIZE
+    # random content does not deflate, so the archive grows chunk by chunk with the content
+    file_contents = [os.urandom(4 * chunk_size), os.urandom(chunk_size // 2)]
+    db_dotfiles = [Dotfile(path=f"/home/.file{index}", filename=f".file{index}") for index in range(len(file_contents))]
+
+    for db_dotfile, file_content in zip(db_dotfiles, file_contents):
+        await file_storage_service.upload_content_to_storage(s3_client, generate_dotfile_name_in_collection(1, db_dotfile.filename), file_content)
+
+    archive_chunks = [chunk async for chunk in collection_service.stream_dotfiles_as_zip(s3_client, 1, db_dotfiles, concurrency=2)]
+
+    assert max(len(chunk) for chunk in archive_chunks) < 2 * chunk_size
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(archive_chunks)), "r") as archive:
+        assert [archive.read(name) for name in archive.namelist()] == file_contents
+
+@pytest.mark.asyncio
+async def test_invalidate_collection_archives_in_storage(s3_client, monkeypatch):
+    """
+    Verifies that every stored archive of a collection older than its current version is deleted, including ones built late
+    """
+    monkeypatch.setattr(settings, "ARCHIVE_CACHE_S3_ENABLED", True)
+
+    for collection_id, version in [(1, 1), (1, 2), (1, 3), (12, 1)]:
+        await file_storage_service.upload_content_to_storage(s3_client, archive_cache_service.generate_archive_name(collection_id, version), b"archive")
+
+    # the archives of versions 1 and 2 were both still in storage when version 3 was made current
+    await archive_cache_service.invalidate_collection_archives(s3_client, 1, 3)
+
+    assert await file_storage_service.list_files_in_storage_by_prefix(s3_client, "archives/") == [
+        archive_cache_service.generate_archive_name(1, 3),
+        archive_cache_service.generate_archive_name(12, 1),
+    ]
+
+    # a deleted collection drops all of its archives
+    await archive_cache_service.invalidate_collection_archives(s3_client, 1, None)
+
+    assert await file_storage_service.list_files_in_storage_by_prefix(s3_client, "archives/") == [archive_cache_service.generate_archive_name(12, 1)]
+
+def test_get_collection_content_after_collection_changes(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that cached archives are not served once files are added to or deleted from the collection
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    utils.promote_user(mock_client, user_create_json["id"], "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add the first mock file to collection and cache its archive
+    first_collection_add_payload = {"content": collection_add_payload["content"][:1]}
+    utils.add_to_collection(mock_client, collection_id, first_collection_add_payload, mock_files[:1], authorization_headers)
+
+    collection_content_0 = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    assert len(collection_content_0) == 1
+
+    # add the second mock file to collection
+    second_collection_add_payload = {"content": collection_add_payload["content"][1:]}
+    utils.add_to_collection(mock_client, collection_id, second_collection_add_payload, mock_files[1:], authorization_headers)
+
+    collection_content_1 = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    assert len(collection_content_1) == 2
+
+    # delete the first mock file from collection
+    mock_filename = collection_add_payload["content"][0]["filename"]
+    delete_file_in_collection_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filename}", headers=authorization_headers)
+    assert delete_file_in_collection_response.status_code == 204
+
+    collection_content_2 = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    collection_content_filenames, _ = utils.seperate_collection_content(collection_content_2)
+    assert collection_content_filenames == [generate_dotfile_name_in_collection(collection_id, collection_add_payload["content"][1]["filename"])]
+
+def test_get_collection_content_retrieval_limit_for_free_user(mock_client, user_create_payload, collection_create_payload):
+    """
+    Verifies that the api limits the number of file retrievals from a collection for free users
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # check files in collection until the retrieval limit is just reached
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+
+        get_collection_content_status_code_0 = get_collection_content_response_0.status_code
+        assert get_collection_content_status_code_0 == 200
+
+    # attempt to check files in collection after retrieval limit is reached
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+
+    get_collection_content_status_code_1 = get_collection_content_response_1.status_code
+    assert get_collection_content_status_code_1 == 429
+
+    get_collection_content_json_1 = get_collection_content_response_1.json()
+    assert get_collection_content_json_1["detail"] == f"You have exceeded your monthly limit of {FREE_TIER_RETRIEVAL_LIMIT} retrievals. Please upgrade to a Pro account for unlimited access."
+
+def test_get_collection_content_retrieval_limit_in_one_statement(mock_client, user_create_payload, collection_create_payload, query_counter):
+    """
+    Verifies that a retrieval is counted and a rejected retrieval is decided by a single statement on the users table
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # every retrieval is counted with one statement on the users table
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        query_counter.clear()
+        get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+        assert get_collection_content_response_0.status_code == 200
+
+        user_statements = [statement for statement in query_counter if "users" in statement.lower()]
+        assert len(user_statements) == 1
+        assert user_statements[0].lstrip().upper().startswith("UPDATE USERS")
+
+    # the rejected retrieval costs one statement on the users table
+    query_counter.clear()
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    assert get_collection_content_response_1.status_code == 429
+
+    user_statements = [statement for statement in query_counter if "users" in statement.lower()]
+    assert len(user_statements) == 1
+    assert user_statements[0].lstrip().upper().startswith("UPDATE USERS")
+
+def test_get_collection_content_retrieval_period_reset(mock_client, user_create_payload, collection_create_payload, monkeypatch):
+    """
+    Verifies that the retrieval count of a free user starts over once the retrieval period has expired
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # reach the retrieval limit
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 429
+
+    # move past the end of the retrieval period
+    class NextPeriodDate(date):
+        @classmethod
+        def today(cls):
+            return date.today() + timedelta(days=settings.RETRIEVAL_PERIOD_DAYS + 1)
+
+    monkeypatch.setattr(user_service, "date", NextPeriodDate)
+
+    # the new period allows the full number of retrievals again
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 429
+
+def test_get_collection_content_retrieval_limit_in_memory(mock_client, user_create_payload, collection_create_payload, query_counter, monkeypatch):
+    """
+    Verifies that the memory quota engine enforces the retrieval limit without writing every retrieval to the users table,
+    and that the flushed counts are enforced once the counters are reloaded
+    """
+    monkeypatch.setattr(settings, "QUOTA_ENGINE", "memory")
+    monkeypatch.setattr(settings, "QUOTA_FLUSH_MAX_PENDING", 2)
+
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # the first retrieval loads the counter and the next ones are counted in memory until enough increments are pending
+    query_counter.clear()
+    for _ in range(settings.QUOTA_FLUSH_MAX_PENDING - 1):
+        assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    user_statements = [statement for statement in query_counter if "users" in statement.lower()]
+    assert len(user_statements) == 1
+    assert user_statements[0].lstrip().upper().startswith("SELECT")
+
+    # reaching the pending threshold writes the increments in one batched update
+    query_counter.clear()
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    user_statements = [statement for statement in query_counter if "users" in statement.lower()]
+    assert len(user_statements) == 1
+    assert user_statements[0].lstrip().upper().startswith("UPDATE USERS")
+
+    # the flushed counter was dropped, so the remaining retrievals are counted from the stored count
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT - settings.QUOTA_FLUSH_MAX_PENDING):
+        assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    # the limit is enforced from memory
+    query_counter.clear()
+    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    assert get_collection_content_response.status_code == 429
+    assert not [statement for statement in query_counter if "users" in statement.lower()]
+
+def test_get_collection_content_retrieval_limit_in_memory_after_failed_flush(mock_client, user_create_payload, collection_create_payload, monkeypatch):
+    """
+    Verifies that the memory quota engine keeps the increments of a failed flush and writes them with the next one
+    """
+    monkeypatch.setattr(settings, "QUOTA_ENGINE", "memory")
+    monkeypatch.setattr(settings, "QUOTA_FLUSH_MAX_PENDING", 1)
+
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # the flush of the first retrieval fails without failing the retrieval
+    session_maker = quota_service.retrieval_count_session_maker
+
+    def failing_session_maker():
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(quota_service, "retrieval_count_session_maker", failing_session_maker)
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+    assert len(quota_service.retrieval_counter_store) == 1
+
+    # the next flush writes both increments and drops the counter once they are committed
+    monkeypatch.setattr(quota_service, "retrieval_count_session_maker", session_maker)
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+    assert len(quota_service.retrieval_counter_store) == 0
+
+    # the remaining retrievals are counted from the committed count
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT - 2):
+        assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 200
+
+    assert mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers).status_code == 429
+
+def test_memory_quota_engine_requires_a_single_worker():
+    """
+    Verifies that the memory quota engine is rejected at startup with several workers, which would each grant the whole limit
+    """
+    with pytest.raises(ValidationError, match="single worker"):
+        Settings(QUOTA_ENGINE="memory", WEB_CONCURRENCY=4)
+
+    assert Settings(QUOTA_ENGINE="memory", WEB_CONCURRENCY=1).QUOTA_ENGINE == "memory"
+    assert Settings(QUOTA_ENGINE="database", WEB_CONCURRENCY=4).QUOTA_ENGINE == "database"
+
+@pytest.mark.parametrize("user_tier", USER_TIER_PARAMETERS)
+def test_get_collection_content_retrieval_limit_for_nonfree_user(mock_client_with_admin_tier, user_create_payload, collection_create_payload, user_tier):
+    """
+    Verifies that the api allows for unlimited file retrievals from a collection for non-free users
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+    
+    # create a user
+    user_create_json = utils.create_new_user(mock_client, user_create_payload)
+    user_id = user_create_json["id"]
+
+    # promote user
+    utils.promote_user(mock_client, user_id, user_tier)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # check files in collection until the retrieval limit is just reached
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+
+        get_collection_content_status_code_0 = get_collection_content_response_0.status_code
+        assert get_collection_content_status_code_0 == 200
+
+    # attempt to check files in collection after retrieval limit is reached
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+
+    get_collection_content_status_code_1 = get_collection_content_response_1.status_code
+    assert get_collection_content_status_code_1 == 200
+
+def test_get_collection_content_from_invalid_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
+    """
+    Verifies that the api rejects attempts to retrieve files from a non-existant collection
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create an invalid collection id
+    collection_id = 1
+
+    # attempt to get file content of invalid collection
+    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+
+    get_collection_content_status_code = get_collection_content_response.status_code
+    assert get_collection_content_status_code == 404
+
+    get_collection_content_json = get_collection_content_response.json()
+    assert get_collection_content_json["detail"] == f"Collection {collection_id} not found"
+
+def test_get_collection_content_of_unowned_private_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
+    """
+    Verifies that the api rejects attempts to retrieve files from a private collection that the user does not own
+    """
+    # create the first user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication for the first user
+    user_login_payload_0 = utils.get_user_login_payload(user_create_payload)
+    access_token_0 = utils.get_user_access_token(mock_client, user_login_payload_0)
+    
+    authorization_headers_0 = utils.get_authorization_headers(access_token_0)
+
+    # create a private collection for first user
+    collection_create_payload["is_private"] = True
+
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers_0)
+    collection_id = collection_create_json["id"]
+
+    # create the second user
+    user_create_payload["username"] = "new_mock_user"
+    user_create_payload["email"] = "new_mock_email@email.com"
+
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for the second user
+    user_login_payload_1 = utils.get_user_login_payload(user_create_payload)
+    access_token_1 = utils.get_user_access_token(mock_client, user_login_payload_1)
+    
+    authorization_headers_1 = utils.get_authorization_headers(access_token_1)
+
+    # attempt to get file content of collection without access permission
+    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers_1)
+
+    get_collection_content_status_code = get_collection_content_response.status_code
+    assert get_collection_content_status_code == 403
+
+    get_collection_content_json = get_collection_content_response.json()
+    assert get_collection_content_json["detail"] == "You do not have permission to access this collection"
+
+def test_get_collection_content_of_unowned_public_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that the api returns files from a public collection that the user does not own
+    """
+    # create the first user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication for the first user
+    user_login_payload_0 = utils.get_user_login_payload(user_create_payload)
+    access_token_0 = utils.get_user_access_token(mock_client, user_login_payload_0)
+    
+    authorization_headers_0 = utils.get_authorization_headers(access_token_0)
+
+    # create a public collection for first user
+    collection_create_payload["is_private"] = False
+
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers_0)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers_0)
+
+    # create the second user
+    user_create_payload["username"] = "new_mock_user"
+    user_create_payload["email"] = "new_mock_email@email.com"
+
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for the second user
+    user_login_payload_1 = utils.get_user_login_payload(user_create_payload)
+    access_token_1 = utils.get_user_access_token(mock_client, user_login_payload_1)
+    
+    authorization_headers_1 = utils.get_authorization_headers(access_token_1)
+
+    # check files in collection
+    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers_1)
+
+    get_collection_content_status_code = get_collection_content_response.status_code
+    assert get_collection_content_status_code == 200
+
+    # convert the bytes response content to a zip file
+    byte_data = io.BytesIO(get_collection_content_response.content)
+
+    with zipfile.ZipFile(byte_data, "r") as archive:
+        archive_filenames = archive.namelist()
+        mock_filenames = [mock_files[n][1][0] for n in range(len(mock_files))]
+        mock_file_contents = [mock_files[n][1][1].getvalue().decode("utf-8") for n in range(len(mock_files))]
+
+        # check if number of file retrieved is the same as the number of files uploaded
+        assert len(archive_filenames) == len(mock_filenames)
+        
+        # check that each file is retrieved is correct
+        for index, archive_filename in enumerate(archive_filenames):
+            mock_filename_in_collection = generate_dotfile_name_in_collection(collection_id, mock_filenames[index])
+            mock_file_content = mock_file_contents[index]
+            archive_file_content = archive.open(archive_filename).read().decode()
+
+            assert archive_filename == mock_filename_in_collection
+            assert archive_file_content == mock_file_content
+
+
+
+
+# collection file paths retrieval tests
+def test_valid_get_collection_file_paths(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that the api returns a list of file path information of files from a collection
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # check file paths in collection
+    get_collection_file_paths_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", headers=authorization_headers)
+
+    get_collection_file_paths_status_code = get_collection_file_paths_response.status_code
+    assert get_collection_file_paths_status_code == 200
+
+    get_collection_file_paths_json = get_collection_file_paths_response.json()
+
+    assert get_collection_file_paths_json[0]["path"] == collection_add_payload["content"][0]["path"]
+    assert get_collection_file_paths_json[0]["filename"] == collection_add_payload["content"][0]["filename"]
+
+    assert get_collection_file_paths_json[1]["path"] == collection_add_payload["content"][1]["path"]
+    assert get_collection_file_paths_json[1]["filename"] == collection_add_payload["content"][1]["filename"]
+
+def test_get_collection_file_paths_with_content_metadata(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that the api records the hash, size and storage etag of uploaded files
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    _, mock_file_contents = utils.seperate_mock_files(mock_files)
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # check the content metadata of the files in the collection
+    get_collection_file_paths_json = utils.get_collection_file_paths(mock_client, collection_id, authorization_headers)
+
+    for dotfile, mock_file_content in zip(get_collection_file_paths_json, mock_file_contents):
+        assert dotfile["sha256"] == hashlib.sha256(mock_file_content.encode("utf-8")).hexdigest()
+        assert dotfile["size"] == len(mock_file_content.encode("utf-8"))
+        assert dotfile["etag"]
+
+def test_get_collection_file_paths_not_modified(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that the api answers a conditional request for unchanged file paths with 304 and a changed collection with 200
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # get the file paths and their etag
+    get_collection_file_paths_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", headers=authorization_headers)
+    assert get_collection_file_paths_response_0.status_code == 200
+
+    etag_0 = get_collection_file_paths_response_0.headers["ETag"]
+    assert etag_0.startswith('"')
+
+    # an unchanged collection is not sent again
+    conditional_headers = {**authorization_headers, "If-None-Match": etag_0}
+    get_collection_file_paths_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", headers=conditional_headers)
+
+    assert get_collection_file_paths_response_1.status_code == 304
+    assert get_collection_file_paths_response_1.headers["ETag"] == etag_0
+    assert get_collection_file_paths_response_1.content == b""
+
+    # a changed collection is sent with a new etag
+    filename = mock_files[0][1][0]
+    delete_file_in_collection_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{filename}", headers=authorization_headers)
+    assert delete_file_in_collection_response.status_code == 204
+
+    get_collection_file_paths_response_2 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", headers=conditional_headers)
+
+    assert get_collection_file_paths_response_2.status_code == 200
+    assert get_collection_file_paths_response_2.headers["ETag"] != etag_0
+    assert len(get_collection_file_paths_response_2.json()) == len(mock_files) - 1
+
+def test_get_collection_content_not_modified(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
+    """
+    Verifies that the api answers a conditional archive request with 304 without fetching from storage or counting a retrieval,
+    and that rebuilding the archive of an unchanged collection gives the same bytes
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # get the archive and its etag
+    get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    assert get_collection_content_response_0.status_code == 200
+
+    etag = get_collection_content_response_0.headers["ETag"]
+
+    # a rebuilt archive of the same version is byte-identical
+    archive_memory_cache.clear()
+
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    assert get_collection_content_response_1.headers["ETag"] == etag
+    assert get_collection_content_response_1.content == get_collection_content_response_0.content
+
+    # conditional requests neither touch storage nor count towards the retrieval limit
+    async def fail_to_retrieve(*args, **kwargs):
+        raise AssertionError("storage must not be accessed")
+
+    monkeypatch.setattr(file_storage_service, "retrieve_file_object_from_storage_by_filename", fail_to_retrieve)
+    archive_memory_cache.clear()
+
+    conditional_headers = {**authorization_headers, "If-None-Match": etag}
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        get_collection_content_response_2 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=conditional_headers)
+
+        assert get_collection_content_response_2.status_code == 304
+        assert get_collection_content_response_2.headers["ETag"] == etag
+
+# collection file content retrieval tests
+def test_get_file_content_in_collection(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that the api streams the content of one file, whole or by byte range, and answers conditional requests with 304
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+    utils.promote_user(mock_client, user_id, "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    mock_filenames, mock_file_contents = utils.seperate_mock_files(mock_files)
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    file_content_url = COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filenames[1]}/content"
+    mock_file_content = mock_file_contents[1].encode("utf-8")
+
+    # get the whole file
+    get_file_content_response_0 = mock_client.get(file_content_url, headers=authorization_headers)
+
+    assert get_file_content_response_0.status_code == 200
+    assert get_file_content_response_0.content == mock_file_content
+    assert get_file_content_response_0.headers["Accept-Ranges"] == "bytes"
+    assert get_file_content_response_0.headers["ETag"] == f'"{hashlib.sha256(mock_file_content).hexdigest()}"'
+
+    etag = get_file_content_response_0.headers["ETag"]
+
+    # get the first bytes and resume from there
+    get_file_content_response_1 = mock_client.get(file_content_url, headers={**authorization_headers, "Range": "bytes=0-1"})
+
+    assert get_file_content_response_1.status_code == 206
+    assert get_file_content_response_1.content == mock_file_content[:2]
+    assert get_file_content_response_1.headers["Content-Range"] == f"bytes 0-1/{len(mock_file_content)}"
+
+    get_file_content_response_2 = mock_client.get(file_content_url, headers={**authorization_headers, "Range": "bytes=2-"})
+
+    assert get_file_content_response_2.status_code == 206
+    assert get_file_content_response_2.content == mock_file_content[2:]
+
+    # a range beyond the end of the file cannot be satisfied
+    get_file_content_response_3 = mock_client.get(file_content_url, headers={**authorization_headers, "Range": "bytes=100-"})
+    assert get_file_content_response_3.status_code == 416
+
+    # an unchanged file is not sent again
+    get_file_content_response_4 = mock_client.get(file_content_url, headers={**authorization_headers, "If-None-Match": etag})
+
+    assert get_file_content_response_4.status_code == 304
+    assert get_file_content_response_4.headers["ETag"] == etag
+
+    # a file that is not in the collection is not found
+    get_file_content_response_5 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/.missing/content", headers=authorization_headers)
+    assert get_file_content_response_5.status_code == 404
+
+def test_get_file_content_in_collection_retrieval_limit_for_free_user(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    """
+    Verifies that file content downloads count towards the retrieval limit of free users, while conditional requests do not
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    mock_filenames, _ = utils.seperate_mock_files(mock_files)
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    file_content_url = COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filenames[0]}/content"
+
+    # download the file until the retrieval limit is just reached
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
+        get_file_content_response_0 = mock_client.get(file_content_url, headers=authorization_headers)
+        assert get_file_content_response_0.status_code == 200
+
+    etag = get_file_content_response_0.headers["ETag"]
 
-            assert archive_filename == mock_filename_in_collection
-            assert archive_file_content == mock_file_content
+    # conditional requests are still answered
+    get_file_content_response_1 = mock_client.get(file_content_url, headers={**authorization_headers, "If-None-Match": etag})
+    assert get_file_content_response_1.status_code == 304
 
-def test_get_collection_content_retrieval_limit_for_free_user(mock_client, user_create_payload, collection_create_payload):
+    # downloads past the limit are rejected, whole or by range
+    get_file_content_response_2 = mock_client.get(file_content_url, headers=authorization_headers)
+    assert get_file_content_response_2.status_code == 429
+
+    get_file_content_response_2 = mock_client.get(file_content_url, headers={**authorization_headers, "Range": "bytes=1-"})
+    assert get_file_content_response_2.status_code == 429
+
+@pytest.mark.parametrize("storage_compression, download_mode, expected_status_code", [
+    ("none", "proxy", 206),
+    ("gzip", "proxy", 200), # compressed files are served whole
+    ("none", "presigned", 307), # the presigned URL serves the whole file
+])
+def test_get_file_content_in_collection_ranges_count_for_free_user(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch, storage_compression, download_mode, expected_status_code):
     """
-    Verifies that the api limits the number of file retrievals from a collection for free users
+    Verifies that every range request counts towards the retrieval limit of free users, including suffix ranges
+    and ranges of files that are served whole
     """
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", storage_compression)
+    monkeypatch.setattr(settings, "DOWNLOAD_MODE", download_mode)
+
     # create a user
     utils.create_new_user(mock_client, user_create_payload)
 
@@ -496,36 +1757,36 @@ def test_get_collection_content_retrieval_limit_for_free_user(mock_client, user_
     collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
     collection_id = collection_create_json["id"]
 
-    # check files in collection until the retrieval limit is just reached
-    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
-        get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
-
-        get_collection_content_status_code_0 = get_collection_content_response_0.status_code
-        assert get_collection_content_status_code_0 == 200
+    # add mock files to collection
+    mock_filenames, _ = utils.seperate_mock_files(mock_files)
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
 
-    # attempt to check files in collection after retrieval limit is reached
-    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    file_content_url = COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filenames[0]}/content"
 
-    get_collection_content_status_code_1 = get_collection_content_response_1.status_code
-    assert get_collection_content_status_code_1 == 429
+    # suffix ranges, ranges from the first byte and ranges from a later byte all count
+    byte_ranges = ["bytes=-1000000", "bytes=0-1", "bytes=1-"]
+    for index in range(FREE_TIER_RETRIEVAL_LIMIT):
+        range_headers = {**authorization_headers, "Range": byte_ranges[index % len(byte_ranges)]}
+        get_file_content_response_0 = mock_client.get(file_content_url, headers=range_headers, follow_redirects=False)
+        assert get_file_content_response_0.status_code == expected_status_code
 
-    get_collection_content_json_1 = get_collection_content_response_1.json()
-    assert get_collection_content_json_1["detail"] == f"You have exceeded your monthly limit of {FREE_TIER_RETRIEVAL_LIMIT} retrievals. Please upgrade to a Pro account for unlimited access."
+    for byte_range in byte_ranges:
+        get_file_content_response_1 = mock_client.get(file_content_url, headers={**authorization_headers, "Range": byte_range}, follow_redirects=False)
+        assert get_file_content_response_1.status_code == 429
 
-@pytest.mark.parametrize("user_tier", USER_TIER_PARAMETERS)
-def test_get_collection_content_retrieval_limit_for_nonfree_user(mock_client_with_admin_tier, user_create_payload, collection_create_payload, user_tier):
+# presigned download tests
+def test_get_collection_content_with_presigned_url(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
     """
-    Verifies that the api allows for unlimited file retrievals from a collection for non-free users
+    Verifies that in presigned mode the api redirects archive and file downloads to storage, storing each archive version once
     """
+    monkeypatch.setattr(settings, "DOWNLOAD_MODE", "presigned")
+
     # rename for convenience
     mock_client = mock_client_with_admin_tier
-    
-    # create a user
-    user_create_json = utils.create_new_user(mock_client, user_create_payload)
-    user_id = user_create_json["id"]
 
-    # promote user
-    utils.promote_user(mock_client, user_id, user_tier)
+    # create a pro user so that retrievals are not limited
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+    utils.promote_user(mock_client, user_id, "pro")
 
     # get a jwt token for authentication
     user_login_payload = utils.get_user_login_payload(user_create_payload)
@@ -537,23 +1798,48 @@ def test_get_collection_content_retrieval_limit_for_nonfree_user(mock_client_wit
     collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
     collection_id = collection_create_json["id"]
 
-    # check files in collection until the retrieval limit is just reached
-    for _ in range(FREE_TIER_RETRIEVAL_LIMIT):
-        get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    # add mock files to collection
+    mock_filenames, mock_file_contents = utils.seperate_mock_files(mock_files)
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
 
-        get_collection_content_status_code_0 = get_collection_content_response_0.status_code
-        assert get_collection_content_status_code_0 == 200
+    # the archive request is redirected to a presigned storage url
+    get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
 
-    # attempt to check files in collection after retrieval limit is reached
-    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    assert get_collection_content_response_0.status_code == 307
+    archive_url = get_collection_content_response_0.headers["Location"]
+    assert "X-Amz-Signature" in archive_url
 
-    get_collection_content_status_code_1 = get_collection_content_response_1.status_code
-    assert get_collection_content_status_code_1 == 200
+    # the archive is downloaded from storage without credentials
+    archive_response = httpx.get(archive_url)
+    assert archive_response.status_code == 200
 
-def test_get_collection_content_from_invalid_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
+    with zipfile.ZipFile(io.BytesIO(archive_response.content), "r") as archive:
+        assert archive.namelist() == [generate_dotfile_name_in_collection(collection_id, mock_filename) for mock_filename in mock_filenames]
+        assert [archive.read(name).decode() for name in archive.namelist()] == mock_file_contents
+
+    # the stored archive is reused without fetching the files again
+    async def fail_to_retrieve(*args, **kwargs):
+        raise AssertionError("storage must not be accessed")
+
+    monkeypatch.setattr(file_storage_service, "retrieve_file_object_from_storage_by_filename", fail_to_retrieve)
+
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
+    assert get_collection_content_response_1.status_code == 307
+
+    # a file request is redirected too, and storage serves the range
+    get_file_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filenames[0]}/content", headers=authorization_headers, follow_redirects=False)
+    assert get_file_content_response.status_code == 307
+
+    file_response = httpx.get(get_file_content_response.headers["Location"], headers={"Range": "bytes=1-"})
+    assert file_response.status_code == 206
+    assert file_response.content == mock_file_contents[0].encode("utf-8")[1:]
+
+def test_get_collection_content_with_presigned_url_retrieval_limit_for_free_user(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, monkeypatch):
     """
-    Verifies that the api rejects attempts to retrieve files from a non-existant collection
+    Verifies that in presigned mode free-tier retrievals are counted only once the archive is stored, and not when storing fails
     """
+    monkeypatch.setattr(settings, "DOWNLOAD_MODE", "presigned")
+
     # create a user
     utils.create_new_user(mock_client, user_create_payload)
 
@@ -563,128 +1849,145 @@ def test_get_collection_content_from_invalid_collection(mock_client, user_create
     
     authorization_headers = utils.get_authorization_headers(access_token)
 
-    # create an invalid collection id
-    collection_id = 1
-
-    # attempt to get file content of invalid collection
-    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers)
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
 
-    get_collection_content_status_code = get_collection_content_response.status_code
-    assert get_collection_content_status_code == 404
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
 
-    get_collection_content_json = get_collection_content_response.json()
-    assert get_collection_content_json["detail"] == f"Collection {collection_id} not found"
+    # record the order in which the archive is stored and the retrieval is counted
+    calls = []
+    get_presigned_archive_url = collection_service.get_presigned_archive_url
+    enforce_retrieval_quota = quota_service.enforce_retrieval_quota
 
-def test_get_collection_content_of_unowned_private_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
-    """
-    Verifies that the api rejects attempts to retrieve files from a private collection that the user does not own
-    """
-    # create the first user
-    utils.create_new_user(mock_client, user_create_payload)
+    async def recording_get_presigned_archive_url(*args, **kwargs):
+        calls.append("store")
+        return await get_presigned_archive_url(*args, **kwargs)
 
-    # get a jwt token for authentication for the first user
-    user_login_payload_0 = utils.get_user_login_payload(user_create_payload)
-    access_token_0 = utils.get_user_access_token(mock_client, user_login_payload_0)
-    
-    authorization_headers_0 = utils.get_authorization_headers(access_token_0)
+    async def recording_enforce_retrieval_quota(*args, **kwargs):
+        calls.append("count")
+        return await enforce_retrieval_quota(*args, **kwargs)
 
-    # create a private collection for first user
-    collection_create_payload["is_private"] = True
+    monkeypatch.setattr(collection_service, "get_presigned_archive_url", recording_get_presigned_archive_url)
+    monkeypatch.setattr(quota_service, "enforce_retrieval_quota", recording_enforce_retrieval_quota)
 
-    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers_0)
-    collection_id = collection_create_json["id"]
+    get_collection_content_response_0 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
+    assert get_collection_content_response_0.status_code == 307
+    assert calls == ["store", "count"]
 
-    # create the second user
-    user_create_payload["username"] = "new_mock_user"
-    user_create_payload["email"] = "new_mock_email@email.com"
+    # a failure to store the archive is not counted
+    async def fail_to_store(*args, **kwargs):
+        raise HTTPException(status_code=500, detail="Storage error")
 
-    utils.create_new_user(mock_client, user_create_payload)
+    monkeypatch.setattr(collection_service, "get_presigned_archive_url", fail_to_store)
 
-    # get a jwt token for the second user
-    user_login_payload_1 = utils.get_user_login_payload(user_create_payload)
-    access_token_1 = utils.get_user_access_token(mock_client, user_login_payload_1)
-    
-    authorization_headers_1 = utils.get_authorization_headers(access_token_1)
+    get_collection_content_response_1 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
+    assert get_collection_content_response_1.status_code == 500
 
-    # attempt to get file content of collection without access permission
-    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers_1)
+    monkeypatch.setattr(collection_service, "get_presigned_archive_url", recording_get_presigned_archive_url)
 
-    get_collection_content_status_code = get_collection_content_response.status_code
-    assert get_collection_content_status_code == 403
+    # the remaining retrievals are served, the ones past the limit are rejected
+    for _ in range(FREE_TIER_RETRIEVAL_LIMIT - 1):
+        get_collection_content_response_2 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
+        assert get_collection_content_response_2.status_code == 307
 
-    get_collection_content_json = get_collection_content_response.json()
-    assert get_collection_content_json["detail"] == "You do not have permission to access this collection"
+    get_collection_content_response_3 = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers, follow_redirects=False)
+    assert get_collection_content_response_3.status_code == 429
 
-def test_get_collection_content_of_unowned_public_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+def test_zstd_storage_compression_requires_zstandard(monkeypatch):
     """
-    Verifies that the api returns files from a public collection that the user does not own
+    Verifies that the zstd codec is rejected at startup when the zstandard package cannot be imported
     """
-    # create the first user
-    utils.create_new_user(mock_client, user_create_payload)
+    # a None entry makes the import fail
+    monkeypatch.setitem(sys.modules, "zstandard", None)
 
-    # get a jwt token for authentication for the first user
-    user_login_payload_0 = utils.get_user_login_payload(user_create_payload)
-    access_token_0 = utils.get_user_access_token(mock_client, user_login_payload_0)
-    
-    authorization_headers_0 = utils.get_authorization_headers(access_token_0)
+    with pytest.raises(ValidationError, match="zstandard"):
+        Settings(STORAGE_COMPRESSION="zstd")
 
-    # create a public collection for first user
-    collection_create_payload["is_private"] = False
+    assert Settings(STORAGE_COMPRESSION="gzip").STORAGE_COMPRESSION == "gzip"
 
-    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers_0)
-    collection_id = collection_create_json["id"]
+def test_zstd_storage_compression_requires_proxy_downloads(monkeypatch):
+    """
+    Verifies that the zstd codec is rejected at startup with presigned downloads, whose clients would get zstd-encoded content
+    """
+    # an importable stand-in for the zstandard package
+    monkeypatch.setitem(sys.modules, "zstandard", types.ModuleType("zstandard"))
 
-    # add mock files to collection
-    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers_0)
+    with pytest.raises(ValidationError, match="DOWNLOAD_MODE=presigned"):
+        Settings(STORAGE_COMPRESSION="zstd", DOWNLOAD_MODE="presigned")
 
-    # create the second user
-    user_create_payload["username"] = "new_mock_user"
-    user_create_payload["email"] = "new_mock_email@email.com"
+    assert Settings(STORAGE_COMPRESSION="zstd", DOWNLOAD_MODE="proxy").STORAGE_COMPRESSION == "zstd"
+    assert Settings(STORAGE_COMPRESSION="gzip", DOWNLOAD_MODE="presigned").STORAGE_COMPRESSION == "gzip"
 
-    utils.create_new_user(mock_client, user_create_payload)
+def test_get_collection_content_compressed_at_rest(mock_client_with_admin_tier, user_create_payload, collection_create_payload, monkeypatch):
+    """
+    Verifies that the api stores files compressed when a storage codec is configured and serves them decompressed
+    """
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "gzip")
 
-    # get a jwt token for the second user
-    user_login_payload_1 = utils.get_user_login_payload(user_create_payload)
-    access_token_1 = utils.get_user_access_token(mock_client, user_login_payload_1)
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+    utils.promote_user(mock_client, user_id, "pro")
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
     
-    authorization_headers_1 = utils.get_authorization_headers(access_token_1)
+    authorization_headers = utils.get_authorization_headers(access_token)
 
-    # check files in collection
-    get_collection_content_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/archive", headers=authorization_headers_1)
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
 
-    get_collection_content_status_code = get_collection_content_response.status_code
-    assert get_collection_content_status_code == 200
+    # add a compressible file to collection
+    filename = ".bashrc"
+    file_content = b"export PATH=$HOME/.local/bin:$PATH\n" * 1000
+    collection_add_payload = {"content": [{"path": f"/mock_dir/{filename}", "filename": filename}]}
 
-    # convert the bytes response content to a zip file
-    byte_data = io.BytesIO(get_collection_content_response.content)
+    collection_add_json = utils.add_to_collection(mock_client, collection_id, collection_add_payload, [("files", (filename, io.BytesIO(file_content)))], authorization_headers)
 
-    with zipfile.ZipFile(byte_data, "r") as archive:
-        archive_filenames = archive.namelist()
-        mock_filenames = [mock_files[n][1][0] for n in range(len(mock_files))]
-        mock_file_contents = [mock_files[n][1][1].getvalue().decode("utf-8") for n in range(len(mock_files))]
+    # the recorded size and hash are those of the content, not of the stored object
+    assert collection_add_json[0]["size"] == len(file_content)
+    assert collection_add_json[0]["sha256"] == hashlib.sha256(file_content).hexdigest()
 
-        # check if number of file retrieved is the same as the number of files uploaded
-        assert len(archive_filenames) == len(mock_filenames)
-        
-        # check that each file is retrieved is correct
-        for index, archive_filename in enumerate(archive_filenames):
-            mock_filename_in_collection = generate_dotfile_name_in_collection(collection_id, mock_filenames[index])
-            mock_file_content = mock_file_contents[index]
-            archive_file_content = archive.open(archive_filename).read().decode()
+    # the archive and the file are served decompressed; ranges of compressed files are answered with the whole file
+    collection_content = utils.get_collection_content(mock_client, collection_id, authorization_headers)
+    _, collection_content_file_contents = utils.seperate_collection_content(collection_content)
+    assert collection_content_file_contents == [file_content.decode("utf-8")]
 
-            assert archive_filename == mock_filename_in_collection
-            assert archive_file_content == mock_file_content
+    file_content_url = COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{filename}/content"
+    get_file_content_response = mock_client.get(file_content_url, headers={**authorization_headers, "Range": "bytes=0-9"})
 
+    assert get_file_content_response.status_code == 200
+    assert get_file_content_response.content == file_content
+    assert get_file_content_response.headers["Accept-Ranges"] == "none"
+    assert get_file_content_response.headers["Content-Length"] == str(len(file_content))
 
+    # storage sends the compressed object with its content encoding, which HTTP clients decode
+    monkeypatch.setattr(settings, "DOWNLOAD_MODE", "presigned")
 
+    get_file_content_response = mock_client.get(file_content_url, headers=authorization_headers, follow_redirects=False)
+    assert get_file_content_response.status_code == 307
 
-# collection file paths retrieval tests
-def test_valid_get_collection_file_paths(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
+    file_response = httpx.get(get_file_content_response.headers["Location"])
+    assert file_response.headers["Content-Encoding"] == "gzip"
+    assert file_response.num_bytes_downloaded < len(file_content)
+    assert file_response.content == file_content
+
+def test_sync_collection(mock_client_with_admin_tier, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
     """
-    Verifies that the api returns a list of file path information of files from a collection
+    Verifies that the api returns only the files added, changed or deleted since the files the client has, as metadata and as an archive
     """
-    # create a user
-    utils.create_new_user(mock_client, user_create_payload)
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
+
+    # create a pro user so that retrievals are not limited
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+    utils.promote_user(mock_client, user_id, "pro")
 
     # get a jwt token for authentication
     user_login_payload = utils.get_user_login_payload(user_create_payload)
@@ -697,21 +2000,94 @@ def test_valid_get_collection_file_paths(mock_client, user_create_payload, colle
     collection_id = collection_create_json["id"]
 
     # add mock files to collection
+    mock_filenames, mock_file_contents = utils.seperate_mock_files(mock_files)
     utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
 
-    # check file paths in collection
-    get_collection_file_paths_response = mock_client.get(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles", headers=authorization_headers)
+    # the client has the first file unchanged, an older second file and a file deleted from the collection
+    mock_paths = [content["path"] for content in collection_add_payload["content"]]
+    deleted_path = "/mock_dir/.deleted"
+    sync_payload = {"files": [
+        {"path": mock_paths[0], "sha256": hashlib.sha256(mock_file_contents[0].encode("utf-8")).hexdigest()},
+        {"path": mock_paths[1], "sha256": hashlib.sha256(b"older content").hexdigest()},
+        {"path": deleted_path, "sha256": hashlib.sha256(b"deleted content").hexdigest()},
+    ]}
+
+    sync_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync", json=sync_payload, headers=authorization_headers)
+    assert sync_response.status_code == 200
+
+    sync_json = sync_response.json()
+    assert sync_json["added"] == []
+    assert [dotfile["path"] for dotfile in sync_json["changed"]] == [mock_paths[1]]
+    assert sync_json["deleted"] == [deleted_path]
+
+    # the changed file can be downloaded from its content url
+    get_file_content_response = mock_client.get(sync_json["changed"][0]["content_url"], headers=authorization_headers)
+    assert get_file_content_response.status_code == 200
+    assert get_file_content_response.content == mock_file_contents[1].encode("utf-8")
+
+    # the archive of changes only holds the changed file
+    sync_archive_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync/archive", json=sync_payload, headers=authorization_headers)
+    assert sync_archive_response.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(sync_archive_response.content), "r") as archive:
+        assert archive.namelist() == [generate_dotfile_name_in_collection(collection_id, mock_filenames[1])]
+        assert archive.read(archive.namelist()[0]).decode("utf-8") == mock_file_contents[1]
+
+    # a client without files gets every file as added
+    sync_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync", json={"files": []}, headers=authorization_headers)
+    assert [dotfile["path"] for dotfile in sync_response.json()["added"]] == mock_paths
+
+    # an up to date client has nothing to download
+    up_to_date_payload = {"files": [
+        {"path": path, "sha256": hashlib.sha256(content.encode("utf-8")).hexdigest()}
+        for path, content in zip(mock_paths, mock_file_contents)
+    ]}
+
+    sync_json = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync", json=up_to_date_payload, headers=authorization_headers).json()
+    assert sync_json["added"] == sync_json["changed"] == sync_json["deleted"] == []
+
+    sync_archive_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync/archive", json=up_to_date_payload, headers=authorization_headers)
+    assert sync_archive_response.status_code == 204
+
+def test_sync_collection_dotfiles_sharing_a_filename(mock_client_with_admin_tier, user_create_payload, collection_create_payload):
+    """
+    Verifies that the content url of each synced dotfile serves its own content when dotfiles at different paths share a filename
+    """
+    # rename for convenience
+    mock_client = mock_client_with_admin_tier
 
-    get_collection_file_paths_status_code = get_collection_file_paths_response.status_code
-    assert get_collection_file_paths_status_code == 200
+    # create a pro user so that retrievals are not limited
+    user_id = utils.create_new_user(mock_client, user_create_payload)["id"]
+    utils.promote_user(mock_client, user_id, "pro")
 
-    get_collection_file_paths_json = get_collection_file_paths_response.json()
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
 
-    assert get_collection_file_paths_json[0]["path"] == collection_add_payload["content"][0]["path"]
-    assert get_collection_file_paths_json[0]["filename"] == collection_add_payload["content"][0]["filename"]
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
 
-    assert get_collection_file_paths_json[1]["path"] == collection_add_payload["content"][1]["path"]
-    assert get_collection_file_paths_json[1]["filename"] == collection_add_payload["content"][1]["filename"]
+    # add two files with the same filename at different paths
+    filename = ".x"
+    file_contents = {"/a/.x": b"content of a", "/b/.x": b"content of b"}
+    for path, file_content in file_contents.items():
+        collection_add_payload = {"content": [{"path": path, "filename": filename}]}
+        utils.add_to_collection(mock_client, collection_id, collection_add_payload, [("files", (filename, io.BytesIO(file_content)))], authorization_headers)
+
+    sync_response = mock_client.post(COLLECTIONS_PREFIX + f"/{collection_id}/sync", json={"files": []}, headers=authorization_headers)
+    assert sync_response.status_code == 200
+
+    added = sync_response.json()["added"]
+    assert [dotfile["path"] for dotfile in added] == list(file_contents)
+
+    # each content url serves the content of its own path
+    for dotfile in added:
+        get_file_content_response = mock_client.get(dotfile["content_url"], headers=authorization_headers)
+        assert get_file_content_response.status_code == 200
+        assert get_file_content_response.content == file_contents[dotfile["path"]]
 
 def test_get_collection_file_paths_from_invalid_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
     """
@@ -865,7 +2241,7 @@ def test_valid_delete_file_in_collection(mock_client, user_create_payload, colle
 
     # check file paths in collection in database
     get_collection_file_paths_0 = utils.get_collection_file_paths(mock_client, collection_id, authorization_headers)
-    assert get_collection_file_paths_0 == collection_add_payload["content"]
+    assert utils.seperate_dotfile_paths(get_collection_file_paths_0) == collection_add_payload["content"]
 
     # delete file in collection
     filename = mock_files[delete_index][1][0]
@@ -892,7 +2268,7 @@ def test_valid_delete_file_in_collection(mock_client, user_create_payload, colle
 
     # check if file paths in collection is deleted from database
     get_collection_file_paths_1 = utils.get_collection_file_paths(mock_client, collection_id, authorization_headers)
-    assert get_collection_file_paths_1 == collection_add_payload["content"]
+    assert utils.seperate_dotfile_paths(get_collection_file_paths_1) == collection_add_payload["content"]
 
 def test_delete_invalid_file_in_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files):
     """
@@ -1076,6 +2452,52 @@ def test_valid_delete_collection(mock_client, user_create_payload, collection_cr
     
     assert len(get_collection_list_json_1) == 0
 
+def test_delete_collection_in_batch(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, query_counter, monkeypatch):
+    """
+    Verifies that the api deletes all files of a collection with a single storage batch and a single dotfile statement
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+
+    # record storage batch deletions
+    delete_files_from_storage_by_filenames = file_storage_service.delete_files_from_storage_by_filenames
+    deleted_batches = []
+
+    async def recording_delete_files_from_storage_by_filenames(s3, filenames):
+        deleted_batches.append(filenames)
+        return await delete_files_from_storage_by_filenames(s3, filenames)
+
+    monkeypatch.setattr(file_storage_service, "delete_files_from_storage_by_filenames", recording_delete_files_from_storage_by_filenames)
+
+    # delete collection
+    query_counter.clear()
+    collection_delete_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id}", headers=authorization_headers)
+
+    collection_delete_status_code = collection_delete_response.status_code
+    assert collection_delete_status_code == 204
+
+    # check that the blobs of all files were deleted at once
+    _, mock_file_contents = utils.seperate_mock_files(mock_files)
+    assert len(deleted_batches) == 1
+    assert sorted(deleted_batches[0]) == sorted(generate_blob_key(hashlib.sha256(content.encode("utf-8")).hexdigest()) for content in mock_file_contents)
+
+    dotfile_statements = [statement for statement in query_counter if "dotfiles" in statement.lower()]
+    assert len(dotfile_statements) == 1
+    assert dotfile_statements[0].lstrip().upper().startswith("DELETE")
+
 def test_delete_invalid_collection(mock_client, user_create_payload, collection_create_payload, collection_add_payload):
     """
     Verifies that the api rejects attempts to delete non-existant collections
@@ -1180,3 +2602,57 @@ def test_delete_unowned_public_collection(mock_client, user_create_payload, coll
 
     delete_collection_json = delete_collection_response.json()
     assert delete_collection_json["detail"] == "You do not have permission to edit this collection"
+
+
+
+
+# collection authorization query tests
+def test_collection_routes_load_collection_once(mock_client, user_create_payload, collection_create_payload, collection_add_payload, mock_files, query_counter):
+    """
+    Verifies that each collection route makes its existence, visibility and ownership checks from a single collection query
+    """
+    # create a user
+    utils.create_new_user(mock_client, user_create_payload)
+
+    # get a jwt token for authentication
+    user_login_payload = utils.get_user_login_payload(user_create_payload)
+    access_token = utils.get_user_access_token(mock_client, user_login_payload)
+    
+    authorization_headers = utils.get_authorization_headers(access_token)
+
+    # create a collection
+    collection_create_json = utils.create_new_collection(mock_client, collection_create_payload, authorization_headers)
+    collection_id = collection_create_json["id"]
+
+    # add mock files to collection
+    query_counter.clear()
+    utils.add_to_collection(mock_client, collection_id, collection_add_payload, mock_files, authorization_headers)
+    
+    assert utils.count_table_selects(query_counter, "collections") == 1
+
+    # list files in collection
+    query_counter.clear()
+    utils.get_collection_file_paths(mock_client, collection_id, authorization_headers)
+
+    assert utils.count_table_selects(query_counter, "collections") == 1
+
+    # retrieve files in collection
+    query_counter.clear()
+    utils.get_collection_content(mock_client, collection_id, authorization_headers)
+
+    assert utils.count_table_selects(query_counter, "collections") == 1
+
+    # delete a file in collection
+    query_counter.clear()
+    mock_filename = collection_add_payload["content"][0]["filename"]
+    delete_file_in_collection_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id}/dotfiles/{mock_filename}", headers=authorization_headers)
+
+    assert delete_file_in_collection_response.status_code == 204
+    assert utils.count_table_selects(query_counter, "collections") == 1
+
+    # delete collection
+    query_counter.clear()
+    collection_delete_response = mock_client.delete(COLLECTIONS_PREFIX + f"/{collection_id}", headers=authorization_headers)
+
+    assert collection_delete_response.status_code == 204
+    assert utils.count_table_selects(query_counter, "collections") == 1
@@ -0,0 +1,99 @@
+# tests/test_query_plans.py
+import pytest
+import pytest_asyncio
+import utils
+
+from datetime import datetime
+
+from sqlalchemy import not_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from app.core.pagination import encode_cursor
+from app.models.collections import Collection
+from app.models.dotfiles import Dotfile
+from app.models.users import User
+from app.services import collection_service, dotfile_service
+
+COLLECTION_SORT_PARAMETERS = ["oldest", "newest", "updated", "name"]
+
+COLLECTION_SORT_CURSOR_VALUES = {
+    "oldest": [1],
+    "newest": [1],
+    "updated": [datetime(2024, 1, 1), 1],
+    "name": ["mock_collection", 1],
+}
+
+async def explain_recorded_queries(db_session, statement_recorder, table_name):
+    # runs EXPLAIN QUERY PLAN on every recorded select of the table, with the parameters it was sent with
+    connection = await db_session.connection()
+    query_plan_details = []
+
+    for statement, parameters in list(statement_recorder):
+        if statement.lstrip().upper().startswith("SELECT") and f"FROM {table_name.upper()}" in statement.upper():
+            result = await connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            query_plan_details.extend(row[3] for row in result.all())
+
+    return query_plan_details
+
+@pytest_asyncio.fixture(scope="function")
+async def seeded_db_session(db_session):
+    db_session.add(User(id=1, username="mock_user", email="mock_email@email.com", hashed_pwd="mock_password"))
+    db_session.add(Collection(id=1, name="mock_collection", description="", owner_id=1, is_private=False))
+    db_session.add(Dotfile(collection_id=1, path="/home/.bashrc", filename=".bashrc"))
+    await db_session.flush()
+
+    return db_session
+
+# collection listing query plan tests
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort", COLLECTION_SORT_PARAMETERS)
+async def test_collection_listings_use_indexes(seeded_db_session, statement_recorder, sort):
+    """
+    Verifies that the owned and public collection listings do not scan the collections table, with and without a cursor
+    """
+    cursor = encode_cursor(sort, COLLECTION_SORT_CURSOR_VALUES[sort])
+    statement_recorder.clear()
+
+    await collection_service.get_collections_by_user_id(seeded_db_session, 1, sort)
+    await collection_service.get_collections_by_user_id(seeded_db_session, 1, sort, cursor=cursor)
+    await collection_service.get_public_collections(seeded_db_session, sort)
+    await collection_service.get_public_collections(seeded_db_session, sort, cursor=cursor)
+
+    query_plan_details = await explain_recorded_queries(seeded_db_session, statement_recorder, "collections")
+
+    assert len(query_plan_details) >= 4
+    assert utils.find_sequential_scans(query_plan_details) == []
+
+# dotfile lookup query plan tests
+@pytest.mark.asyncio
+async def test_dotfile_lookups_use_indexes(seeded_db_session, statement_recorder):
+    """
+    Verifies that dotfile lookups by collection and by filename within a collection do not scan the dotfiles table
+    """
+    statement_recorder.clear()
+
+    await dotfile_service.get_dotfiles_by_collection_id(seeded_db_session, 1)
+    await dotfile_service.get_dotfile_by_filename_in_collection(seeded_db_session, 1, ".bashrc")
+    await dotfile_service.delete_dotfile(seeded_db_session, 1, ".bashrc")
+
+    query_plan_details = await explain_recorded_queries(seeded_db_session, statement_recorder, "dotfiles")
+
+    assert len(query_plan_details) >= 3
+    assert utils.find_sequential_scans(query_plan_details) == []
+    assert any("ix_dotfiles_collection_id_filename" in detail for detail in query_plan_details)
+
+# partial index DDL tests
+@pytest.mark.parametrize("index_name", ["ix_collections_public_id", "ix_collections_public_updated_at_id", "ix_collections_public_name_id"])
+def test_public_collection_indexes_match_listing_predicate_on_postgresql(index_name):
+    """
+    Verifies that on PostgreSQL the public collection indexes are created with the predicate the public listing filters by
+    """
+    index = next(index for index in Collection.__table__.indexes if index.name == index_name)
+    create_index = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+
+    # the listing filter as PostgreSQL renders it, without the table name the index predicate leaves out
+    listing_predicate = str(not_(Collection.is_private).compile(dialect=postgresql.dialect())).replace("collections.", "")
+
+    assert create_index.startswith(f"CREATE INDEX {index_name} ON collections")
+    assert create_index.endswith(f"WHERE {listing_predicate}")
@@ -134,6 +134,79 @@ def test_user_list(mock_client, user_create_payload):
     assert second_get_user_list_json_2[1]["email"] == user_create_payload_2["email"]
     assert second_get_user_list_json_2[1]["id"] == 2
 
+def test_paginate_user_list(mock_client_with_admin_tier, user_create_payload):
+    """
+    Verifies that the api returns users page by page, filtered by tier and with a total count
+    """
+    mock_client = mock_client_with_admin_tier
+
+    # create five users and promote two of them to pro
+    user_ids = []
+    for n in range(5):
+        numbered_user_create_payload = user_create_payload.copy()
+        numbered_user_create_payload["username"] = f"mock_username_{n}"
+        numbered_user_create_payload["email"] = f"mock_email_{n}@email.com"
+
+        user_ids.append(utils.create_new_user(mock_client, numbered_user_create_payload)["id"])
+
+    utils.promote_user(mock_client, user_ids[1], "pro")
+    utils.promote_user(mock_client, user_ids[3], "pro")
+
+    # get all users two at a time
+    listed_user_ids = []
+    cursor = None
+
+    while True:
+        params = {"limit": 2, "count": "exact"}
+        if cursor:
+            params["cursor"] = cursor
+
+        get_user_page_response = mock_client.get(USERS_PREFIX + "/", params=params)
+
+        get_user_page_status_code = get_user_page_response.status_code
+        assert get_user_page_status_code == 200
+
+        assert get_user_page_response.headers["X-Total-Count"] == "5"
+        assert get_user_page_response.headers["X-Total-Count-Mode"] == "exact"
+
+        get_user_page_json = get_user_page_response.json()
+        assert len(get_user_page_json) <= 2
+        listed_user_ids.extend(user["id"] for user in get_user_page_json)
+
+        cursor = get_user_page_response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert listed_user_ids == user_ids
+
+    # get only pro users with an estimated count, which falls back to an exact count on small tables
+    get_pro_user_list_response = mock_client.get(USERS_PREFIX + "/", params={"tier": "pro", "count": "estimated"})
+
+    get_pro_user_list_status_code = get_pro_user_list_response.status_code
+    assert get_pro_user_list_status_code == 200
+
+    assert [user["id"] for user in get_pro_user_list_response.json()] == [user_ids[1], user_ids[3]]
+    assert get_pro_user_list_response.headers["X-Total-Count"] == "2"
+    assert get_pro_user_list_response.headers["X-Total-Count-Mode"] == "exact"
+    assert "X-Next-Cursor" not in get_pro_user_list_response.headers
+
+    # the total count is only computed when requested
+    get_user_list_response = mock_client.get(USERS_PREFIX + "/")
+    assert "X-Total-Count" not in get_user_list_response.headers
+
+def test_paginate_user_list_with_invalid_parameters(mock_client):
+    """
+    Verifies that the api rejects malformed cursors and page sizes above the maximum
+    """
+    get_user_list_response_0 = mock_client.get(USERS_PREFIX + "/", params={"cursor": "invalid_cursor"})
+    assert get_user_list_response_0.status_code == 400
+
+    get_user_list_response_1 = mock_client.get(USERS_PREFIX + "/", params={"limit": 10000})
+    assert get_user_list_response_1.status_code == 422
+
+    get_user_list_response_2 = mock_client.get(USERS_PREFIX + "/", params={"tier": "unknown"})
+    assert get_user_list_response_2.status_code == 422
+
 # user deletion tests
 def test_valid_user_delete(mock_client, user_create_payload):
     """